@@ -10,13 +10,17 @@ import sys
 import json
 import asyncio
 import logging
+import time
+import hashlib
+import functools
+import threading
 from typing import Dict, Any, List, Optional
 from datetime import datetime
 from pathlib import Path
 
-from fastapi import FastAPI, HTTPException, BackgroundTasks, UploadFile, File
+from fastapi import FastAPI, HTTPException, BackgroundTasks, UploadFile, File, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel, Field
 import uvicorn
 import yaml
@@ -27,7 +31,20 @@ from scripts.inference import MCPInference
 from scripts.train_mcp_model import MCPTrainer
 from scripts.model_manager import ModelManager
 from scripts.huggingface_manager import HuggingFaceManager
-from examples.mcp_tools import MCPToolRegistry
+from scripts.model_server import RemoteInference
+from scripts.single_flight import SingleFlight
+from scripts.intent_router import IntentRouter
+from scripts.semantic_cache import create_semantic_cache
+from scripts.speculative_tools import ToolSpeculator
+from scripts.tool_sandbox import ToolSandbox
+from scripts.shared_weights import process_memory, worker_memory_report
+from scripts.inference_scheduler import (
+    InferenceScheduler, DeadlineExceeded, AdmissionRejected, parse_priority, parse_deadline
+)
+from examples.mcp_tools import tool_registry
+from examples.file_reader import FileReader
+from examples.search_backends import create_search_backend
+from examples.mcp_server import MCPServer, create_http_router
 import platform
 import psutil
 import docker
@@ -61,9 +78,37 @@ app.add_middleware(
 inference_engine = None
 model_manager = None
 hf_manager = None
-tool_registry = MCPToolRegistry()
 training_status = {"is_training": False, "progress": 0, "message": ""}
 
+# 推理指标
+inference_metrics = {
+    "requests": 0,
+    "aborted_requests": 0,
+    "aborted_tokens": 0,
+    "saved_tokens": 0,
+    "generated_tokens": 0,
+    "templated_answers": 0,
+    "speculative_hits": 0
+}
+
+# 推理服务配置，启动时从config.yaml的inference段加载
+inference_config: Dict[str, Any] = {}
+
+# 推理调度器，启动时按配置重建；默认单个工作线程保证请求按优先级顺序使用模型
+inference_scheduler = InferenceScheduler(max_workers=1)
+
+# 相同请求合并器
+single_flight = SingleFlight()
+
+# 意图快速路由器，配置 inference.router.enabled 开启
+intent_router: Optional[IntentRouter] = None
+
+# 批量工具调用的最大调用数
+MAX_BATCH_TOOL_CALLS = 256
+
+# 客户端断开检测间隔（秒）
+DISCONNECT_POLL_INTERVAL = 0.1
+
 # Pydantic模型定义
 class ChatMessage(BaseModel):
     role: str = Field(..., description="消息角色: system, user, assistant")
@@ -72,17 +117,32 @@ class ChatMessage(BaseModel):
 class ChatRequest(BaseModel):
     messages: List[ChatMessage] = Field(..., description="对话消息列表")
     max_length: Optional[int] = Field(2048, description="最大生成长度")
+    max_new_tokens: Optional[int] = Field(None, ge=1, description="最大生成token数，默认使用配置 inference.max_new_tokens")
     temperature: Optional[float] = Field(0.7, description="生成温度")
     system_prompt: Optional[str] = Field(None, description="系统提示词")
 
 class SimpleTextRequest(BaseModel):
     text: str = Field(..., description="输入文本")
     system_prompt: Optional[str] = Field(None, description="系统提示词")
+    temperature: Optional[float] = Field(0.7, description="生成温度，0表示贪心解码（相同请求会被合并）")
+    max_new_tokens: Optional[int] = Field(None, ge=1, description="最大生成token数，默认使用配置 inference.max_new_tokens")
+    template_answers: Optional[bool] = Field(True, description="工具结果按模板渲染最终回答，跳过第二轮生成；false时总由模型生成")
+
+class ScoreRequest(BaseModel):
+    messages: Optional[List[ChatMessage]] = Field(None, description="对话消息列表，与text二选一")
+    text: Optional[str] = Field(None, description="用户输入，按聊天接口的方式构建消息")
+    system_prompt: Optional[str] = Field(None, description="系统提示词（配合text使用）")
+    candidates: Optional[List[str]] = Field(None, description="候选续写，默认为每个已注册工具的工具调用开头")
+    max_length: Optional[int] = Field(2048, description="提示最大长度")
 
 class ToolCallRequest(BaseModel):
     tool_name: str = Field(..., description="工具名称")
     arguments: Dict[str, Any] = Field(..., description="工具参数")
 
+class BatchToolCallRequest(BaseModel):
+    calls: List[ToolCallRequest] = Field(..., description="工具调用列表")
+    timeout: Optional[float] = Field(None, gt=0, description="单个调用的超时（秒）")
+
 class TrainingRequest(BaseModel):
     config_updates: Optional[Dict[str, Any]] = Field(None, description="配置更新")
     dataset_path: Optional[str] = Field(None, description="数据集路径")
@@ -95,7 +155,7 @@ class ModelLoadRequest(BaseModel):
 @app.on_event("startup")
 async def startup_event():
     """应用启动时的初始化"""
-    global model_manager, hf_manager
+    global model_manager, hf_manager, inference_config, inference_scheduler, intent_router
     
     logger.info("正在启动MCP API服务...")
     
@@ -105,6 +165,72 @@ async def startup_event():
         model_manager = ModelManager(config_path)
         logger.info("模型管理器初始化成功")
         
+        # 初始化推理调度器
+        inference_config = model_manager.config.get("inference", {})
+        scheduler_config = inference_config.get("scheduler", {})
+        budget_mb = inference_config.get("kv_cache_budget_mb", 0)
+        inference_scheduler = InferenceScheduler(
+            max_workers=scheduler_config.get("max_workers", 1),
+            memory_budget_bytes=int(budget_mb * 1024**2) if budget_mb else None
+        )
+        logger.info(f"推理调度器初始化成功，KV缓存预算: {budget_mb or '不限制'}MB")
+        
+        # 按工具设置模板回答、并发上限（舱壁）与熔断器
+        tool_registry.configure_template_answers(inference_config.get("template_answers") or {})
+        tools_config = model_manager.config.get("tools", {})
+        for tool_name, limit in (tools_config.get("concurrency") or {}).items():
+            tool_registry.set_concurrency_limit(tool_name, limit, tools_config.get("bulkhead_max_wait", 1.0))
+        breaker_config = tools_config.get("circuit_breaker") or {}
+        if breaker_config.get("enabled"):
+            for tool_name in breaker_config.get("tools") or list(tool_registry.tools):
+                tool_registry.enable_circuit_breaker(
+                    tool_name,
+                    failure_threshold=breaker_config.get("failure_threshold", 5),
+                    reset_timeout=breaker_config.get("reset_timeout_seconds", 30),
+                    call_timeout=breaker_config.get("call_timeout_seconds")
+                )
+        
+        # read_file的单次读取上限
+        read_file_config = model_manager.config.get("tools", {}).get("read_file") or {}
+        if read_file_config:
+            tool_registry.file_reader = FileReader(
+                max_bytes=read_file_config.get("max_bytes", tool_registry.file_reader.max_bytes),
+                max_stream_bytes=read_file_config.get("max_stream_bytes", tool_registry.file_reader.max_stream_bytes),
+                mmap_threshold=read_file_config.get("mmap_threshold", tool_registry.file_reader.mmap_threshold)
+            )
+        
+        # web_search的搜索后端
+        search_config = model_manager.config.get("tools", {}).get("web_search") or {}
+        if search_config:
+            tool_registry.set_search_backend(create_search_backend(search_config))
+            logger.info(f"web_search后端: {tool_registry.search_backend.name}")
+        
+        # 进程隔离执行的工具；工作进程由forkserver创建，不复制服务进程的模型内存与线程状态
+        sandbox_config = model_manager.config.get("tools", {}).get("sandbox") or {}
+        if sandbox_config.get("enabled"):
+            sandboxed_tools = sandbox_config.get("tools") or ["calculate"]
+            tool_sandbox = ToolSandbox(
+                {name: tool_registry.tools[name] for name in sandboxed_tools if name in tool_registry.tools},
+                num_workers=sandbox_config.get("workers", 2),
+                timeout=sandbox_config.get("timeout_seconds", 5),
+                cpu_seconds=sandbox_config.get("cpu_seconds", 5),
+                memory_mb=sandbox_config.get("memory_mb", 512),
+                max_tasks_per_worker=sandbox_config.get("max_tasks_per_worker", 200)
+            )
+            tool_sandbox.start()
+            tool_registry.enable_sandbox(tool_sandbox, sandboxed_tools)
+            logger.info(f"沙箱执行的工具: {', '.join(sorted(tool_registry.sandboxed_tools))}")
+        
+        # 初始化意图快速路由器
+        router_config = inference_config.get("router", {})
+        if router_config.get("enabled"):
+            intent_router = IntentRouter(
+                threshold=router_config.get("threshold", 0.9),
+                tools=router_config.get("tools"),
+                registry=tool_registry
+            )
+            logger.info(f"意图快速路由已开启，阈值: {intent_router.threshold}")
+        
         # 初始化HuggingFace管理器
         try:
             hf_manager = HuggingFaceManager(config_path)
@@ -113,28 +239,59 @@ async def startup_event():
             logger.warning(f"HuggingFace管理器初始化失败: {e}")
             hf_manager = None
         
-        # 尝试加载默认模型
-        try:
-            default_model_path = model_manager.config["output"]["model_dir"]
-            if os.path.exists(default_model_path):
-                await load_model_async(default_model_path)
-                logger.info(f"默认模型加载成功: {default_model_path}")
-        except Exception as e:
-            logger.warning(f"默认模型加载失败: {e}")
+        # 配置了模型服务时连接模型服务，否则尝试在本进程加载默认模型
+        model_server_socket = get_model_server_socket()
+        if model_server_socket:
+            try:
+                await connect_model_server(model_server_socket)
+            except Exception as e:
+                logger.warning(f"连接模型服务失败: {e}")
+        else:
+            try:
+                default_model_path = model_manager.config["output"]["model_dir"]
+                if os.path.exists(default_model_path):
+                    await load_model_async(default_model_path)
+                    logger.info(f"默认模型加载成功: {default_model_path}")
+            except Exception as e:
+                logger.warning(f"默认模型加载失败: {e}")
         
         logger.info("MCP API服务启动完成")
-        
+    
     except Exception as e:
         logger.error(f"服务启动失败: {e}")
         raise
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """应用关闭时终止工具沙箱的工作进程，关闭搜索后端的连接池"""
+    if tool_registry.sandbox is not None:
+        tool_registry.sandbox.shutdown()
+    tool_registry.search_backend.close()
+
 # 辅助函数
 async def load_model_async(model_path: str, base_model_name: Optional[str] = None):
     """异步加载模型"""
     global inference_engine
     
+    # 多工作进程模式下由start_api.py通过环境变量开启共享权重
+    shared_weights = (os.environ.get("MCP_SHARED_WEIGHTS") == "1" or
+                      bool(inference_config.get("shared_weights", False)))
+    compile_config = dict(inference_config.get("compile") or {})
+    if os.environ.get("MCP_COMPILE") == "1":
+        compile_config["enabled"] = True
+    backend = os.environ.get("MCP_BACKEND") or inference_config.get("backend", "torch")
+    backend_options = dict(inference_config.get(backend) or {})
+    if backend == "torch" and model_manager is not None:
+        # CPU上的数据类型与磁盘卸载沿用model段配置
+        model_config = model_manager.config.get("model", {})
+        for key in ("cpu_dtype", "max_memory_mb", "offload_folder"):
+            backend_options.setdefault(key, model_config.get(key))
+    
     try:
-        inference_engine = MCPInference(model_path, base_model_name)
+        inference_engine = MCPInference(model_path, base_model_name, shared_weights=shared_weights,
+                                        compile_config=compile_config, backend=backend,
+                                        backend_options=backend_options)
+        configure_inference_engine(inference_engine)
         logger.info(f"模型加载成功: {model_path}")
         return True
     except Exception as e:
@@ -142,6 +299,143 @@ async def load_model_async(model_path: str, base_model_name: Optional[str] = Non
         inference_engine = None
         raise HTTPException(status_code=500, detail=f"模型加载失败: {str(e)}")
 
+def configure_inference_engine(engine: MCPInference):
+    """按配置为推理器开启语义缓存和工具预执行，每次加载模型都使用新的缓存"""
+    cache_config = inference_config.get("semantic_cache") or {}
+    if cache_config.get("enabled"):
+        engine.semantic_cache = create_semantic_cache(cache_config, engine)
+        logger.info(f"语义缓存已开启: {engine.semantic_cache.embedder.name}向量，"
+                    f"阈值 {engine.semantic_cache.threshold}")
+    
+    speculative_config = inference_config.get("speculative_tools") or {}
+    if speculative_config.get("enabled"):
+        engine.speculator = ToolSpeculator(
+            tool_registry,
+            threshold=speculative_config.get("threshold", 0.6),
+            tools=speculative_config.get("tools")
+        )
+        logger.info(f"工具预执行已开启: {', '.join(sorted(engine.speculator.router.tools))}")
+
+def get_model_server_socket() -> List[str]:
+    """获取模型服务套接字路径，环境变量优先于配置；多个副本以逗号分隔"""
+    value = os.environ.get("MCP_MODEL_SERVER_SOCKET") or inference_config.get("model_server_socket") or ""
+    if isinstance(value, list):
+        return value
+    return [path.strip() for path in value.split(",") if path.strip()]
+
+async def connect_model_server(socket_paths: List[str]):
+    """连接独立模型服务进程，本进程只加载分词器"""
+    global inference_engine, inference_scheduler
+    
+    loop = asyncio.get_running_loop()
+    inference_engine = await loop.run_in_executor(None, RemoteInference, socket_paths)
+    configure_inference_engine(inference_engine)
+    
+    # 每个副本同一时间处理一个生成请求，推理线程数不少于副本数才能让所有副本同时工作
+    if inference_scheduler.max_workers < len(socket_paths):
+        inference_scheduler = InferenceScheduler(
+            max_workers=len(socket_paths),
+            memory_budget_bytes=inference_scheduler.memory_budget_bytes
+        )
+    logger.info(f"已连接模型服务: {', '.join(socket_paths)}")
+
+async def watch_disconnect(http_request: Request, cancel_event: threading.Event):
+    """轮询客户端连接状态，断开时设置取消令牌"""
+    while not cancel_event.is_set():
+        if await http_request.is_disconnected():
+            logger.info("客户端已断开，取消推理请求")
+            cancel_event.set()
+            return
+        await asyncio.sleep(DISCONNECT_POLL_INTERVAL)
+
+def record_inference_metrics(stats: Dict[str, Any]):
+    """记录推理指标"""
+    inference_metrics["requests"] += 1
+    if stats.get("cancelled"):
+        inference_metrics["aborted_requests"] += 1
+    for key in ("aborted_tokens", "saved_tokens", "generated_tokens", "templated_answers", "speculative_hits"):
+        inference_metrics[key] += stats.get(key, 0)
+
+def read_scheduling_headers(http_request: Request, default_priority: str):
+    """读取请求头中的优先级(X-Priority)和截止时间(X-Deadline-Ms)"""
+    try:
+        priority = parse_priority(http_request.headers.get("X-Priority"), default_priority)
+        deadline = parse_deadline(http_request.headers.get("X-Deadline-Ms"))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return priority, deadline
+
+def resolve_max_new_tokens(requested: Optional[int]) -> int:
+    """确定请求的最大生成token数，并检查配置上限"""
+    max_new_tokens = requested or inference_config.get("max_new_tokens", 512)
+    limit = inference_config.get("max_new_tokens_limit")
+    if limit and max_new_tokens > limit:
+        raise HTTPException(status_code=400, detail=f"max_new_tokens 不能超过 {limit}")
+    return max_new_tokens
+
+async def submit_inference(func, args, kwargs, priority: int, deadline: Optional[float],
+                           max_tokens: int, memory_bytes: int, cancel_event):
+    """提交推理任务到调度器"""
+    stats: Dict[str, Any] = {}
+    try:
+        result = await inference_scheduler.submit(
+            functools.partial(func, *args, cancel_event=cancel_event, stats=stats, **kwargs),
+            priority=priority,
+            deadline=deadline,
+            max_tokens=max_tokens,
+            memory_bytes=memory_bytes,
+            cancel_event=cancel_event,
+            stats=stats
+        )
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    finally:
+        record_inference_metrics(stats)
+    
+    if stats.get("cancelled"):
+        # 客户端已断开，响应不会再被读取
+        raise HTTPException(status_code=499, detail="客户端已断开连接")
+    return result
+
+async def run_inference(http_request: Request, func, *args, default_priority: str = "normal",
+                        max_tokens: int = 512, memory_bytes: int = 0,
+                        coalesce_key: Optional[str] = None, **kwargs):
+    """通过调度器执行生成，客户端断开或截止时间到达后通过取消令牌中止
+    
+    指定coalesce_key时，相同键的并发请求合并为一次生成。合并后的生成不受单个
+    请求截止时间的限制，各请求分别等待自己的截止时间，所有请求都放弃后生成才会终止。
+    """
+    priority, deadline = read_scheduling_headers(http_request, default_priority)
+    client_gone = threading.Event()
+    watcher = asyncio.create_task(watch_disconnect(http_request, client_gone))
+    
+    try:
+        if coalesce_key is None:
+            return await submit_inference(func, args, kwargs, priority, deadline,
+                                          max_tokens, memory_bytes, client_gone)
+        
+        shared = single_flight.do(
+            coalesce_key,
+            lambda cancel_group: submit_inference(func, args, kwargs, priority, None,
+                                                  max_tokens, memory_bytes, cancel_group),
+            cancel_event=client_gone,
+            label=http_request.url.path
+        )
+        timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+        try:
+            return await asyncio.wait_for(shared, timeout)
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=504, detail="请求已超过截止时间")
+    finally:
+        watcher.cancel()
+
+def request_fingerprint(route: str, payload: BaseModel) -> str:
+    """根据路由和规范化后的请求体计算合并键"""
+    body = json.dumps(payload.dict(), sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(f"{route}\n{body}".encode("utf-8")).hexdigest()
+
 # API路由定义
 
 @app.get("/")
@@ -164,6 +458,24 @@ async def health_check():
         "training_status": training_status["is_training"]
     }
 
+@app.get("/metrics")
+async def get_metrics():
+    """获取推理指标"""
+    return {
+        "inference": inference_metrics,
+        "scheduler": inference_scheduler.snapshot(),
+        "single_flight": single_flight.snapshot(),
+        "model_server": inference_engine.snapshot() if isinstance(inference_engine, RemoteInference) else None,
+        "router": intent_router.snapshot() if intent_router else None,
+        "semantic_cache": (inference_engine.semantic_cache.snapshot()
+                           if inference_engine and inference_engine.semantic_cache else None),
+        "speculative_tools": (inference_engine.speculator.snapshot()
+                              if inference_engine and inference_engine.speculator else None),
+        "tool_sandbox": tool_registry.sandbox.snapshot() if tool_registry.sandbox else None,
+        "mcp_server": mcp_server.snapshot(),
+        "timestamp": datetime.now().isoformat()
+    }
+
 @app.get("/status")
 async def get_status():
     """获取服务状态"""
@@ -175,10 +487,29 @@ async def get_status():
         "hf_manager_available": hf_manager is not None
     }
 
+@app.get("/system/memory")
+async def get_memory_report():
+    """获取各工作进程的RSS与PSS，用于确认权重页是否在进程间共享"""
+    try:
+        workers = worker_memory_report()
+    except OSError:
+        # 非Linux系统无法读取/proc
+        workers = []
+    
+    return {
+        "shared_weights": bool(inference_engine and inference_engine.shared_weights),
+        "current": process_memory() if os.path.exists("/proc/self") else None,
+        "workers": workers,
+        "timestamp": datetime.now().isoformat()
+    }
+
 # 模型管理API
 @app.post("/model/load")
 async def load_model(request: ModelLoadRequest):
     """加载模型"""
+    if isinstance(inference_engine, RemoteInference):
+        raise HTTPException(status_code=400, detail="模型由独立模型服务进程管理，请重启模型服务以更换模型")
+    
     try:
         await load_model_async(request.model_path, request.base_model_name)
         return {
@@ -199,12 +530,16 @@ async def get_model_info():
         "model_path": inference_engine.model_path,
         "base_model_name": inference_engine.base_model_name,
         "model_type": "LoRA" if inference_engine.base_model_name else "Full",
+        "kv_cache": inference_engine.kv_estimator.to_dict() if inference_engine.kv_estimator else None,
+        "backend": inference_engine.backend.describe() if inference_engine.backend else inference_engine.server.get("backend"),
+        "model_server": inference_engine.socket_paths if isinstance(inference_engine, RemoteInference) else None,
+        "compiled": inference_engine.compiled_generator.snapshot() if inference_engine.compiled_generator else None,
         "loaded_at": datetime.now().isoformat()
     }
 
 # 推理API
 @app.post("/chat")
-async def chat(request: ChatRequest):
+async def chat(request: ChatRequest, http_request: Request):
     """聊天接口"""
     if not inference_engine:
         raise HTTPException(status_code=404, detail="未加载模型，请先加载模型")
@@ -212,11 +547,20 @@ async def chat(request: ChatRequest):
     try:
         # 转换消息格式
         messages = [msg.dict() for msg in request.messages]
+        max_new_tokens = resolve_max_new_tokens(request.max_new_tokens)
+        memory_bytes = inference_engine.estimate_kv_bytes(
+            messages, max_new_tokens, max_length=request.max_length
+        )
         
         # 生成响应
-        response = inference_engine.generate_response(
-            messages, 
+        response = await run_inference(
+            http_request,
+            inference_engine.generate_response,
+            messages,
+            max_tokens=max_new_tokens,
+            memory_bytes=memory_bytes,
             max_length=request.max_length,
+            max_new_tokens=max_new_tokens,
             temperature=request.temperature
         )
         
@@ -224,21 +568,57 @@ async def chat(request: ChatRequest):
             "response": response,
             "timestamp": datetime.now().isoformat()
         }
-        
+    
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"聊天接口错误: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/chat/simple")
-async def simple_chat(request: SimpleTextRequest):
+async def simple_chat(request: SimpleTextRequest, http_request: Request):
     """简单聊天接口"""
+    # 简单的工具请求由快速路由直接执行工具，不需要模型；关闭模板回答的请求总是交给模型
+    if intent_router and not request.system_prompt and request.template_answers is not False:
+        loop = asyncio.get_running_loop()
+        routed = await loop.run_in_executor(None, intent_router.handle, request.text)
+        if routed is not None:
+            return {
+                "user_input": routed["user_input"],
+                "assistant_response": routed["assistant_response"],
+                "tool_calls": routed["tool_calls"],
+                "tool_results": routed["tool_results"],
+                "final_response": routed["final_response"],
+                "templated": routed["templated"],
+                "routed": routed["routed"],
+                "timestamp": datetime.now().isoformat()
+            }
+    
     if not inference_engine:
         raise HTTPException(status_code=404, detail="未加载模型，请先加载模型")
     
     try:
-        result = inference_engine.chat(
+        max_new_tokens = resolve_max_new_tokens(request.max_new_tokens)
+        # 调用工具后会进行第二轮生成
+        memory_bytes = inference_engine.estimate_kv_bytes(
+            inference_engine.build_chat_messages(request.text, request.system_prompt),
+            max_new_tokens,
+            generations=2
+        )
+        
+        result = await run_inference(
+            http_request,
+            inference_engine.chat,
             request.text,
-            system_prompt=request.system_prompt
+            default_priority="interactive",
+            max_tokens=2 * max_new_tokens,
+            memory_bytes=memory_bytes,
+            # 只有确定性的贪心生成才能安全地共享结果
+            coalesce_key=request_fingerprint("/chat/simple", request) if not request.temperature else None,
+            system_prompt=request.system_prompt,
+            max_new_tokens=max_new_tokens,
+            temperature=request.temperature,
+            template_answers=request.template_answers is not False
         )
         
         return {
@@ -247,29 +627,98 @@ async def simple_chat(request: SimpleTextRequest):
             "tool_calls": result["tool_calls"],
             "tool_results": result["tool_results"],
             "final_response": result["final_response"],
+            "templated": result["templated"],
+            "cached": result["cached"],
             "timestamp": datetime.now().isoformat()
         }
-        
+    
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"简单聊天接口错误: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/score")
+async def score(request: ScoreRequest, http_request: Request):
+    """候选续写打分：一次批量前向计算各候选的对数似然，默认用于工具选择"""
+    if not inference_engine:
+        raise HTTPException(status_code=404, detail="未加载模型，请先加载模型")
+    
+    if request.messages:
+        messages = [msg.dict() for msg in request.messages]
+    elif request.text:
+        messages = inference_engine.build_chat_messages(request.text, request.system_prompt)
+    else:
+        raise HTTPException(status_code=400, detail="需要提供 messages 或 text")
+    
+    tool_names = None
+    candidates = request.candidates
+    if candidates is None:
+        tool_names = list(tool_registry.tools.keys())
+        candidates = inference_engine.tool_call_candidates()
+    if not candidates:
+        raise HTTPException(status_code=400, detail="候选续写不能为空")
+    
+    try:
+        memory_bytes = inference_engine.estimate_score_bytes(messages, candidates, max_length=request.max_length)
+        scores = await run_inference(
+            http_request,
+            inference_engine.score_candidates,
+            messages,
+            candidates,
+            default_priority="interactive",
+            max_tokens=0,
+            memory_bytes=memory_bytes,
+            max_length=request.max_length
+        )
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"打分接口错误: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    if tool_names is not None:
+        for item, name in zip(scores, tool_names):
+            item["tool"] = name
+    best = max(range(len(scores)), key=lambda index: scores[index]["log_likelihood"])
+    
+    return {
+        "scores": scores,
+        "best": scores[best],
+        "timestamp": datetime.now().isoformat()
+    }
+
 # 工具调用API
 @app.get("/tools")
 async def get_tools():
-    """获取可用工具列表"""
-    return {
-        "tools": list(tool_registry.tools.keys()),
-        "tool_schemas": tool_registry.get_tool_schema()
-    }
+    """获取可用工具列表，响应体在注册工具时才重新序列化"""
+    return Response(content=tool_registry.get_tools_response(), media_type="application/json")
+
+def stream_tool_result(request: ToolCallRequest, pieces):
+    """按片段输出与普通响应格式相同的JSON，result不在内存中拼成完整字符串"""
+    yield (f'{{"tool_name": {json.dumps(request.tool_name, ensure_ascii=False)}, '
+           f'"arguments": {json.dumps(request.arguments, ensure_ascii=False)}, "result": "')
+    for piece in pieces:
+        yield json.dumps(piece, ensure_ascii=False)[1:-1]
+    yield f'", "timestamp": {json.dumps(datetime.now().isoformat())}}}'
 
 @app.post("/tools/execute")
 async def execute_tool(request: ToolCallRequest):
-    """执行工具调用"""
+    """执行工具调用；read_file的大范围读取以分块响应流式返回"""
     try:
-        result = tool_registry.execute_tool(
-            request.tool_name,
-            **request.arguments
+        if request.tool_name == "read_file":
+            loop = asyncio.get_running_loop()
+            pieces = await loop.run_in_executor(tool_registry.io_executor, tool_registry.stream_read_file, request.arguments)
+            if pieces is not None:
+                return StreamingResponse(stream_tool_result(request, pieces), media_type="application/json")
+        
+        # 相同的并发工具调用只执行一次；同步工具在工具注册表的I/O线程池中运行，不阻塞事件循环
+        result = await single_flight.do(
+            request_fingerprint("/tools/execute", request),
+            lambda cancel_group: tool_registry.execute_tool_async(request.tool_name, **request.arguments),
+            label="/tools/execute"
         )
         
         return {
@@ -278,11 +727,36 @@ async def execute_tool(request: ToolCallRequest):
             "result": result,
             "timestamp": datetime.now().isoformat()
         }
-        
+    
     except Exception as e:
         logger.error(f"工具执行错误: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/tools/execute_batch")
+async def execute_tool_batch(request: BatchToolCallRequest):
+    """批量执行工具调用：并发执行、按工具限制并发数、相同调用只执行一次"""
+    if not request.calls:
+        raise HTTPException(status_code=400, detail="工具调用列表不能为空")
+    if len(request.calls) > MAX_BATCH_TOOL_CALLS:
+        raise HTTPException(status_code=400, detail=f"单次最多 {MAX_BATCH_TOOL_CALLS} 个工具调用")
+    
+    start_time = time.perf_counter()
+    calls = [{"name": call.tool_name, "arguments": call.arguments} for call in request.calls]
+    results = await tool_registry.execute_batch_async(calls, timeout=request.timeout)
+    
+    return {
+        "results": results,
+        "total": len(results),
+        "executed": sum(1 for item in results if not item["deduplicated"]),
+        "failed": sum(1 for item in results if item["error"]),
+        "elapsed_ms": round((time.perf_counter() - start_time) * 1000, 3),
+        "timestamp": datetime.now().isoformat()
+    }
+
+# MCP协议端点（Streamable HTTP，POST /mcp），与REST工具接口共用工具注册表
+mcp_server = MCPServer(tool_registry)
+app.include_router(create_http_router(mcp_server))
+
 # 训练管理API
 @app.post("/training/start")
 async def start_training(background_tasks: BackgroundTasks, request: TrainingRequest):
@@ -304,7 +778,7 @@ async def start_training(background_tasks: BackgroundTasks, request: TrainingReq
             "message": "训练已开始",
             "timestamp": datetime.now().isoformat()
         }
-        
+    
     except Exception as e:
         training_status["is_training"] = False
         logger.error(f"启动训练失败: {e}")
@@ -362,7 +836,7 @@ async def run_training_task(config_updates: Optional[Dict[str, Any]] = None):
         training_status["message"] = "训练完成"
         
         logger.info("训练任务完成")
-        
+    
     except Exception as e:
         training_status["is_training"] = False
         training_status["message"] = f"训练失败: {str(e)}"
@@ -396,7 +870,7 @@ async def upload_to_hf(background_tasks: BackgroundTasks):
             "message": "上传任务已开始",
             "timestamp": datetime.now().isoformat()
         }
-        
+    
     except Exception as e:
         logger.error(f"HuggingFace上传失败: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -440,11 +914,11 @@ async def update_config(config_updates: Dict[str, Any]):
             "message": "配置更新成功",
             "timestamp": datetime.now().isoformat()
         }
-        
+    
     except Exception as e:
         logger.error(f"配置更新失败: {e}")
         raise HTTPException(status_code=500, detail=str(e))
-        
+
 @app.get("/system/config")
 async def get_system_config():
     """Get all system configuration and runtime information"""
@@ -462,7 +936,7 @@ async def get_system_config():
                 for path in psutil.disk_partitions()
             }
         }
-
+        
         # Get Docker information
         try:
             docker_client = docker.from_env()
@@ -481,7 +955,7 @@ async def get_system_config():
             }
         except Exception as e:
             docker_info = {"error": str(e)}
-
+        
         # Get application configuration
         app_config = {
             "model_status": {
@@ -496,14 +970,14 @@ async def get_system_config():
             },
             "model_manager_config": model_manager.config if model_manager else None
         }
-
+        
         return JSONResponse({
             "system_info": system_info,
             "docker_info": docker_info,
             "app_config": app_config,
             "timestamp": datetime.now().isoformat()
         })
-
+    
     except Exception as e:
         logger.error(f"Error getting system config: {e}")
         raise HTTPException(status_code=500, detail=str(e))
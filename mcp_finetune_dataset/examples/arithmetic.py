@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+算术表达式引擎
+calculate工具的实现：用ast解析表达式，编译为只含数字常量与四则、乘方运算的模板树，
+在计算之前按数字长度、指数大小与整数结果位数拒绝失控的表达式。
+编译结果按表达式缓存；批量接口把结构相同的表达式按常量列堆叠，用NumPy一次求值。
+"""
+
+import ast
+import math
+import functools
+from typing import Dict, Any, List, Tuple, Union
+
+import numpy as np
+
+Number = Union[int, float]
+
+# 表达式允许的字符，与原eval实现的白名单一致
+ALLOWED_CHARACTERS = frozenset("0123456789+-*/()., ")
+
+DEFAULT_MAX_EXPRESSION_LENGTH = 256
+DEFAULT_MAX_OPERAND_DIGITS = 100
+DEFAULT_MAX_EXPONENT = 10000
+DEFAULT_MAX_RESULT_BITS = 4096
+DEFAULT_CACHE_SIZE = 4096
+
+# 结构相同的表达式达到该数量才向量化，少量表达式逐个求值更快
+VECTORIZE_MIN_GROUP = 16
+
+# 整数中间结果小于该值时int64与float64都能精确表示，向量化结果与Python整数运算一致
+EXACT_INTEGER_BOUND = 2 ** 53
+
+BINARY_OPERATORS = {
+    ast.Add: "+",
+    ast.Sub: "-",
+    ast.Mult: "*",
+    ast.Div: "/",
+    ast.FloorDiv: "//",
+    ast.Pow: "**"
+}
+UNARY_OPERATORS = {ast.UAdd: "+", ast.USub: "-"}
+
+_UNSET = object()
+
+class ExpressionError(ValueError):
+    """表达式不合法或超出计算限制"""
+
+def _result_kind(node: Tuple) -> str:
+    """模板节点的结果类型：int或float，与Python的数值类型提升规则一致"""
+    if node[0] == "num":
+        return node[2]
+    if node[0] == "unary":
+        return _result_kind(node[2])
+    if node[1] == "/":
+        return "float"
+    kinds = (_result_kind(node[2]), _result_kind(node[3]))
+    return "float" if "float" in kinds else "int"
+
+class CompiledExpression:
+    """编译后的表达式
+    
+    template是常量替换为槽位的模板树，结构相同的表达式共享同一模板；constants是各槽位的数值。
+    表达式没有副作用，求值结果（或错误）保存在对象上，缓存命中时不再重复计算。
+    """
+    
+    __slots__ = ("expression", "template", "constants", "_value", "_error")
+    
+    def __init__(self, expression: str, template: Tuple, constants: Tuple[Number, ...]):
+        self.expression = expression
+        self.template = template
+        self.constants = constants
+        self._value = _UNSET
+        self._error = None
+    
+    @property
+    def resolved(self) -> bool:
+        return self._value is not _UNSET or self._error is not None
+
+class ArithmeticEngine:
+    """算术表达式引擎
+    
+    支持整数、小数、括号、+ - * / // ** 与正负号。乘法与乘方在计算前估算整数结果的位数，
+    超过max_result_bits或指数超过max_exponent时直接拒绝，9**9**9这类表达式不会占用CPU和内存。
+    """
+    
+    def __init__(self, max_expression_length: int = DEFAULT_MAX_EXPRESSION_LENGTH,
+                 max_operand_digits: int = DEFAULT_MAX_OPERAND_DIGITS,
+                 max_exponent: int = DEFAULT_MAX_EXPONENT,
+                 max_result_bits: int = DEFAULT_MAX_RESULT_BITS,
+                 cache_size: int = DEFAULT_CACHE_SIZE):
+        self.max_expression_length = max_expression_length
+        self.max_operand_digits = max_operand_digits
+        self.max_exponent = max_exponent
+        self.max_result_bits = max_result_bits
+        self._compile_cached = functools.lru_cache(maxsize=cache_size)(self._compile)
+        self.metrics = {
+            "evaluated": 0,
+            "vectorized": 0,
+            "rejected": 0
+        }
+    
+    def compile(self, expression: str) -> CompiledExpression:
+        """解析并编译表达式，相同的表达式返回缓存的编译结果"""
+        try:
+            return self._compile_cached(expression.strip())
+        except ExpressionError:
+            self.metrics["rejected"] += 1
+            raise
+    
+    def _compile(self, expression: str) -> CompiledExpression:
+        if len(expression) > self.max_expression_length:
+            raise ExpressionError(f"表达式过长（超过{self.max_expression_length}个字符）")
+        if not all(c in ALLOWED_CHARACTERS for c in expression):
+            raise ExpressionError("表达式包含不允许的字符")
+        try:
+            tree = ast.parse(expression, mode="eval")
+        except SyntaxError:
+            raise ExpressionError("表达式语法错误")
+        
+        constants: List[Number] = []
+        template = self._build(tree.body, constants)
+        return CompiledExpression(expression, template, tuple(constants))
+    
+    def _build(self, node: ast.AST, constants: List[Number]) -> Tuple:
+        """把AST转换为模板树，常量依次放入constants"""
+        if isinstance(node, ast.Constant) and type(node.value) in (int, float):
+            if type(node.value) is int and abs(node.value) >= 10 ** self.max_operand_digits:
+                raise ExpressionError(f"数字过长（超过{self.max_operand_digits}位）")
+            constants.append(node.value)
+            return ("num", len(constants) - 1, type(node.value).__name__)
+        if isinstance(node, ast.UnaryOp) and type(node.op) in UNARY_OPERATORS:
+            return ("unary", UNARY_OPERATORS[type(node.op)], self._build(node.operand, constants))
+        if isinstance(node, ast.BinOp) and type(node.op) in BINARY_OPERATORS:
+            left = self._build(node.left, constants)
+            return ("binary", BINARY_OPERATORS[type(node.op)], left, self._build(node.right, constants))
+        raise ExpressionError(f"不支持的表达式: {type(node).__name__}")
+    
+    def _check_bits(self, bits: float):
+        if bits > self.max_result_bits:
+            raise ExpressionError(f"结果超出{self.max_result_bits}位整数上限")
+    
+    def _power(self, base: Number, exponent: Number) -> Number:
+        if abs(exponent) > self.max_exponent and abs(base) not in (0, 1):
+            raise ExpressionError(f"指数过大（超过{self.max_exponent}）")
+        if type(base) is int and type(exponent) is int and exponent > 0 and abs(base) > 1:
+            self._check_bits(exponent * math.log2(abs(base)))
+        result = base ** exponent
+        if isinstance(result, complex):
+            raise ExpressionError("结果不是实数")
+        return result
+    
+    def _apply(self, op: str, left: Number, right: Number) -> Number:
+        if op == "+":
+            return left + right
+        if op == "-":
+            return left - right
+        if op == "*":
+            if type(left) is int and type(right) is int:
+                self._check_bits(left.bit_length() + right.bit_length())
+            return left * right
+        if op == "/":
+            return left / right
+        if op == "//":
+            return left // right
+        return self._power(left, right)
+    
+    def _evaluate_node(self, node: Tuple, constants: Tuple[Number, ...]) -> Number:
+        if node[0] == "num":
+            return constants[node[1]]
+        if node[0] == "unary":
+            value = self._evaluate_node(node[2], constants)
+            return -value if node[1] == "-" else +value
+        return self._apply(node[1], self._evaluate_node(node[2], constants), self._evaluate_node(node[3], constants))
+    
+    def _resolve(self, compiled: CompiledExpression) -> Number:
+        """返回编译结果上保存的值，尚未求值时逐个求值"""
+        if not compiled.resolved:
+            try:
+                compiled._value = self._evaluate_node(compiled.template, compiled.constants)
+                self.metrics["evaluated"] += 1
+            except (ExpressionError, ArithmeticError) as e:
+                compiled._error = (type(e), e.args)
+        if compiled._error is not None:
+            error_type, args = compiled._error
+            raise error_type(*args)
+        return compiled._value
+    
+    def evaluate(self, expression: str) -> Number:
+        """计算表达式，超出限制时抛出ExpressionError，除零等算术错误照常抛出"""
+        return self._resolve(self.compile(expression))
+    
+    def evaluate_batch(self, expressions: List[str]) -> List[Union[Number, Exception]]:
+        """批量计算，结果与逐个调用evaluate一致，出错的表达式对应位置为异常对象
+        
+        尚未求值的表达式按模板分组，成员足够多且能精确向量化的组用NumPy一次求值，
+        其余表达式（含乘方、整数可能超出2**53、除数为零的行）逐个求值。
+        """
+        compiled_items: List[Tuple[int, CompiledExpression]] = []
+        results: List[Union[Number, Exception]] = [None] * len(expressions)
+        groups: Dict[Tuple, Dict[int, CompiledExpression]] = {}
+        for index, expression in enumerate(expressions):
+            try:
+                compiled = self.compile(expression)
+            except ExpressionError as e:
+                results[index] = e
+                continue
+            compiled_items.append((index, compiled))
+            if not compiled.resolved:
+                groups.setdefault(compiled.template, {})[id(compiled)] = compiled
+        
+        for template, members in groups.items():
+            if len(members) >= VECTORIZE_MIN_GROUP and self._vectorizable(template):
+                self._evaluate_vectorized(template, list(members.values()))
+        
+        for index, compiled in compiled_items:
+            try:
+                results[index] = self._resolve(compiled)
+            except (ExpressionError, ArithmeticError) as e:
+                results[index] = e
+        return results
+    
+    def _vectorizable(self, node: Tuple) -> bool:
+        """模板只含+ - * /与整数//时，NumPy的float64/int64运算与Python结果逐位一致"""
+        if node[0] == "num":
+            return True
+        if node[0] == "unary":
+            return self._vectorizable(node[2])
+        if node[1] == "**":
+            return False
+        if node[1] == "//" and _result_kind(node) != "int":
+            return False
+        return self._vectorizable(node[2]) and self._vectorizable(node[3])
+    
+    def _integer_bound(self, node: Tuple, bounds: List[int]) -> int:
+        """整数节点绝对值的上界；任一整数节点可能超出EXACT_INTEGER_BOUND时返回该值"""
+        if node[0] == "num":
+            return bounds[node[1]]
+        if node[0] == "unary":
+            return self._integer_bound(node[2], bounds)
+        left = self._integer_bound(node[2], bounds)
+        right = self._integer_bound(node[3], bounds)
+        if max(left, right) >= EXACT_INTEGER_BOUND:
+            return EXACT_INTEGER_BOUND
+        if _result_kind(node) == "float":
+            return 0
+        if node[1] == "*":
+            bound = left * right
+        elif node[1] == "//":
+            bound = left
+        else:
+            bound = left + right
+        return min(bound, EXACT_INTEGER_BOUND)
+    
+    def _vector_node(self, node: Tuple, columns: List[np.ndarray], invalid: np.ndarray) -> np.ndarray:
+        if node[0] == "num":
+            return columns[node[1]]
+        if node[0] == "unary":
+            value = self._vector_node(node[2], columns, invalid)
+            return -value if node[1] == "-" else value
+        left = self._vector_node(node[2], columns, invalid)
+        right = self._vector_node(node[3], columns, invalid)
+        if node[1] in ("/", "//"):
+            # 除数为零的行交给逐个求值抛出ZeroDivisionError
+            zero = right == 0
+            invalid |= zero
+            right = np.where(zero, 1, right)
+        if node[1] == "+":
+            return left + right
+        if node[1] == "-":
+            return left - right
+        if node[1] == "*":
+            return left * right
+        if node[1] == "/":
+            return np.true_divide(left, right, dtype=np.float64)
+        return np.floor_divide(left, right)
+    
+    def _evaluate_vectorized(self, template: Tuple, members: List[CompiledExpression]):
+        """按常量列堆叠同一模板的表达式并一次求值，结果写回各编译结果"""
+        columns = []
+        bounds = []
+        for slot in range(len(members[0].constants)):
+            values = [member.constants[slot] for member in members]
+            if type(values[0]) is int:
+                bound = max(abs(value) for value in values)
+                if bound >= EXACT_INTEGER_BOUND:
+                    return
+                columns.append(np.array(values, dtype=np.int64))
+            else:
+                bound = 0
+                columns.append(np.array(values, dtype=np.float64))
+            bounds.append(bound)
+        if self._integer_bound(template, bounds) >= EXACT_INTEGER_BOUND:
+            return
+        
+        invalid = np.zeros(len(members), dtype=bool)
+        with np.errstate(all="ignore"):
+            values = self._vector_node(template, columns, invalid)
+        if _result_kind(template) == "int":
+            convert = int
+        else:
+            convert = float
+            invalid |= ~np.isfinite(values)
+        
+        for member, value, skip in zip(members, values.tolist(), invalid.tolist()):
+            if not skip:
+                member._value = convert(value)
+        self.metrics["vectorized"] += int(len(members) - invalid.sum())
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """获取引擎指标"""
+        cache = self._compile_cached.cache_info()
+        return {
+            "cache_size": cache.currsize,
+            "cache_hits": cache.hits,
+            "cache_misses": cache.misses,
+            **self.metrics
+        }
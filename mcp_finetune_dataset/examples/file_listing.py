@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+目录列表缓存
+list_files工具的实现：用os.scandir一次遍历目录，目录项类型取自readdir返回的d_type，不再逐项stat。
+排序后的列表按目录的inode与mtime缓存，目录未变化时重复列出只需一次stat；
+glob过滤结果同样缓存在目录条目上，分页只切片已缓存的列表。
+"""
+
+import os
+import re
+import fnmatch
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+# 一个目录项：(名称, 是否为目录)
+Entry = Tuple[str, bool]
+
+DEFAULT_CACHE_DIRECTORIES = 64
+
+# 每个目录缓存的glob过滤结果数
+MAX_CACHED_PATTERNS = 8
+
+class _Listing:
+    """一个目录的缓存列表"""
+    
+    def __init__(self, signature: Tuple[int, int], entries: Tuple[Entry, ...]):
+        self.signature = signature
+        self.entries = entries
+        self.filtered: "OrderedDict[str, Tuple[Entry, ...]]" = OrderedDict()
+
+def scan_directory(path: str) -> Tuple[Entry, ...]:
+    """遍历目录，按名称排序；符号链接按其指向判断是否为目录"""
+    entries: List[Entry] = []
+    with os.scandir(path) as iterator:
+        for entry in iterator:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            entries.append((entry.name, is_dir))
+    entries.sort()
+    return tuple(entries)
+
+class DirectoryListingCache:
+    """按目录mtime失效的列表缓存
+    
+    目录中增删或重命名文件会更新目录的mtime，签名(inode, mtime_ns)不变时直接复用缓存；
+    只修改已有文件的内容不影响列表。缓存的目录数超过上限时淘汰最久未使用的目录。
+    """
+    
+    def __init__(self, max_directories: int = DEFAULT_CACHE_DIRECTORIES):
+        self.max_directories = max_directories
+        self._listings: "OrderedDict[str, _Listing]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.metrics = {
+            "hits": 0,
+            "misses": 0
+        }
+    
+    def list(self, path: str, pattern: str = "") -> Tuple[Entry, ...]:
+        """返回目录中（匹配glob模式的）排序后的目录项，目录不可访问时抛出OSError"""
+        key = os.path.abspath(path)
+        stat = os.stat(key)
+        signature = (stat.st_ino, stat.st_mtime_ns)
+        
+        with self._lock:
+            listing = self._listings.get(key)
+            if listing is not None and listing.signature == signature:
+                self._listings.move_to_end(key)
+                self.metrics["hits"] += 1
+            else:
+                listing = None
+        
+        if listing is None:
+            self.metrics["misses"] += 1
+            listing = _Listing(signature, scan_directory(key))
+            with self._lock:
+                self._listings[key] = listing
+                self._listings.move_to_end(key)
+                while len(self._listings) > self.max_directories:
+                    self._listings.popitem(last=False)
+        
+        if not pattern:
+            return listing.entries
+        with self._lock:
+            filtered = listing.filtered.get(pattern)
+        if filtered is None:
+            match = re.compile(fnmatch.translate(pattern)).match
+            filtered = tuple(entry for entry in listing.entries if match(entry[0]))
+            with self._lock:
+                listing.filtered[pattern] = filtered
+                while len(listing.filtered) > MAX_CACHED_PATTERNS:
+                    listing.filtered.popitem(last=False)
+        return filtered
+    
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._listings.clear()
+    
+    def snapshot(self) -> Dict[str, int]:
+        """获取缓存指标"""
+        with self._lock:
+            return {"directories": len(self._listings), **self.metrics}
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+按范围读取文件
+read_file工具的实现：按字节偏移/长度或行号范围读取，单次读取的字节数有上限。
+超过mmap_threshold的文件通过mmap按需映射，只有被读取和扫描的页进入内存，
+行号定位按块统计换行符，多GB的日志也不会被整个读入。
+"""
+
+import os
+import mmap
+import codecs
+import contextlib
+from typing import Iterator, Optional, Union
+
+# 单次read_file返回的最大字节数，防止超大结果挤满上下文
+DEFAULT_MAX_READ_BYTES = 64 * 1024
+
+# /tools/execute流式返回时单次读取的最大字节数
+DEFAULT_MAX_STREAM_BYTES = 64 * 1024 * 1024
+
+# 超过该大小的文件使用mmap，较小的文件直接读入
+DEFAULT_MMAP_THRESHOLD = 1024 * 1024
+
+# 流式读取与行号扫描的块大小
+CHUNK_SIZE = 256 * 1024
+
+Buffer = Union[bytes, mmap.mmap]
+
+@contextlib.contextmanager
+def open_buffer(path: str, mmap_threshold: int = DEFAULT_MMAP_THRESHOLD) -> Iterator[Buffer]:
+    """以只读字节缓冲打开文件：大文件为mmap，小文件为bytes，两者都支持切片与find"""
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            yield b""
+        elif size >= mmap_threshold:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                yield buffer
+        else:
+            yield f.read()
+
+def line_start(buffer: Buffer, line: int, position: int = 0, current: int = 1) -> int:
+    """第line行（从1开始）起始的字节偏移，从第current行的起点position开始扫描；超出行数时返回文件大小"""
+    size = len(buffer)
+    remaining = line - current
+    while remaining > 0 and position < size:
+        block = buffer[position:position + CHUNK_SIZE]
+        count = block.count(b"\n")
+        if count < remaining:
+            remaining -= count
+            position += len(block)
+            continue
+        index = -1
+        for _ in range(remaining):
+            index = block.find(b"\n", index + 1)
+        return position + index + 1
+    return min(position, size)
+
+def _char_boundary(buffer: Buffer, end: int) -> int:
+    """截断位置落在UTF-8多字节字符中间时前移到字符边界"""
+    for back in range(min(3, end)):
+        byte = buffer[end - back - 1]
+        if byte & 0xC0 != 0x80:
+            # 找到字符首字节，判断该字符是否完整
+            width = 1 if byte < 0x80 else 2 if byte >= 0xC0 and byte < 0xE0 else 3 if byte < 0xF0 else 4
+            return end if back + 1 >= width else end - back - 1
+    return end
+
+class ReadPlan:
+    """一次读取的字节范围"""
+    
+    def __init__(self, path: str, start: int, end: int, size: int, truncated: bool):
+        self.path = path
+        self.start = start
+        self.end = end
+        self.size = size
+        self.truncated = truncated
+    
+    @property
+    def length(self) -> int:
+        return self.end - self.start
+
+class FileReader:
+    """按范围读取文件
+    
+    offset/length按字节读取，start_line/end_line按行读取（从1开始，包含end_line），
+    范围超过max_bytes时截断，结果注明下一次读取的offset。
+    """
+    
+    def __init__(self, max_bytes: int = DEFAULT_MAX_READ_BYTES, max_stream_bytes: int = DEFAULT_MAX_STREAM_BYTES,
+                 mmap_threshold: int = DEFAULT_MMAP_THRESHOLD):
+        self.max_bytes = max_bytes
+        self.max_stream_bytes = max_stream_bytes
+        self.mmap_threshold = mmap_threshold
+    
+    def plan(self, path: str, offset: int = 0, length: int = 0, start_line: int = 0, end_line: int = 0,
+             max_bytes: Optional[int] = None) -> ReadPlan:
+        """把字节或行号范围解析为字节范围，文件不存在时抛出OSError，结束行小于起始行时抛出ValueError"""
+        if 0 < end_line < start_line:
+            raise ValueError(f"结束行 {end_line} 小于起始行 {start_line}")
+        max_bytes = max_bytes or self.max_bytes
+        with open_buffer(path, self.mmap_threshold) as buffer:
+            size = len(buffer)
+            if start_line > 0 or end_line > 0:
+                first = max(start_line, 1)
+                start = line_start(buffer, first)
+                end = line_start(buffer, end_line + 1, start, first) if end_line >= first else size
+            else:
+                start = min(max(offset, 0), size)
+                end = min(start + length, size) if length > 0 else size
+            
+            truncated = end - start > max_bytes
+            if truncated:
+                boundary = _char_boundary(buffer, start + max_bytes)
+                end = boundary if boundary > start else start + max_bytes
+        return ReadPlan(path, start, end, size, truncated)
+    
+    def iter_text(self, plan: ReadPlan) -> Iterator[str]:
+        """逐块读取并解码范围内的内容"""
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        with open_buffer(plan.path, self.mmap_threshold) as buffer:
+            for position in range(plan.start, plan.end, CHUNK_SIZE):
+                text = decoder.decode(buffer[position:min(position + CHUNK_SIZE, plan.end)])
+                if text:
+                    yield text
+        tail = decoder.decode(b"", final=True)
+        if tail:
+            yield tail
+    
+    def read_text(self, plan: ReadPlan) -> str:
+        """读取范围内的全部内容"""
+        return "".join(self.iter_text(plan))
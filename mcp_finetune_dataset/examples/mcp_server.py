@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MCP服务端
+以MCP协议（JSON-RPC 2.0）对外提供工具注册表：stdio传输每行一条消息，Streamable HTTP传输通过POST /mcp收发。
+tools/list返回注册时缓存的schema；tools/call并发执行，一个连接上可以同时有多个调用在执行，
+响应按完成顺序返回，由JSON-RPC的id对应到请求。
+"""
+
+import os
+import sys
+import json
+import uuid
+import asyncio
+import logging
+import argparse
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, AsyncIterator, Callable, Tuple
+
+# 添加父目录到路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from examples.mcp_tools import MCPToolRegistry, is_tool_error
+
+logger = logging.getLogger(__name__)
+
+MCP_PROTOCOL_VERSION = "2025-03-26"
+SUPPORTED_PROTOCOL_VERSIONS = ("2025-03-26", "2024-11-05")
+
+# JSON-RPC错误码
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+
+# 一个连接上同时执行的请求数上限，达到上限时stdio传输暂停读取
+DEFAULT_MAX_IN_FLIGHT = 64
+
+# 单条消息（stdio的一行）的最大字节数
+MAX_MESSAGE_BYTES = 4 * 1024 * 1024
+
+# 单个JSON-RPC批量请求的最大消息数
+MAX_BATCH_MESSAGES = 256
+
+# Streamable HTTP的会话头与保留的会话数
+SESSION_HEADER = "Mcp-Session-Id"
+MAX_SESSIONS = 1024
+
+class MCPError(Exception):
+    """以JSON-RPC错误响应返回的协议错误"""
+    
+    def __init__(self, code: int, message: str):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+class HTTPResult:
+    """Streamable HTTP请求的处理结果，与具体的Web框架无关"""
+    
+    def __init__(self, status: int, body: Optional[bytes] = None, headers: Optional[Dict[str, str]] = None,
+                 events: Optional[AsyncIterator[bytes]] = None):
+        self.status = status
+        self.body = body
+        self.headers = headers or {}
+        self.events = events
+
+async def _skip_line(reader: asyncio.StreamReader, consumed: int):
+    """丢弃超长消息到下一个换行符为止的剩余部分，避免其后半段被当作一条新消息解析"""
+    while True:
+        await reader.readexactly(consumed)
+        try:
+            await reader.readuntil(b"\n")
+            return
+        except asyncio.IncompleteReadError:
+            return
+        except asyncio.LimitOverrunError as e:
+            consumed = e.consumed
+
+class MCPServer:
+    """MCP协议服务端，传输层只负责收发字节"""
+    
+    def __init__(self, registry: MCPToolRegistry, name: str = "mcp-finetune-tools", version: str = "1.0.0",
+                 max_in_flight: int = DEFAULT_MAX_IN_FLIGHT):
+        self.registry = registry
+        self.server_info = {"name": name, "version": version}
+        self.max_in_flight = max_in_flight
+        self.sessions: "OrderedDict[str, str]" = OrderedDict()
+        self._methods = {
+            "initialize": self._initialize,
+            "ping": self._ping,
+            "tools/list": self._list_tools,
+            "tools/call": self._call_tool
+        }
+        self.metrics = {
+            "requests": 0,
+            "tool_calls": 0,
+            "tool_errors": 0,
+            "protocol_errors": 0,
+            "in_flight": 0,
+            "peak_in_flight": 0
+        }
+    
+    @staticmethod
+    def _response(request_id: Any, result: bytes) -> bytes:
+        return b'{"jsonrpc": "2.0", "id": ' + json.dumps(request_id).encode("utf-8") + b', "result": ' + result + b"}"
+    
+    def _error(self, request_id: Any, code: int, message: str) -> bytes:
+        self.metrics["protocol_errors"] += 1
+        return json.dumps(
+            {"jsonrpc": "2.0", "id": request_id, "error": {"code": code, "message": message}},
+            ensure_ascii=False
+        ).encode("utf-8")
+    
+    async def _initialize(self, params: Dict[str, Any]) -> bytes:
+        requested = params.get("protocolVersion")
+        version = requested if requested in SUPPORTED_PROTOCOL_VERSIONS else MCP_PROTOCOL_VERSION
+        return json.dumps({
+            "protocolVersion": version,
+            "capabilities": {"tools": {"listChanged": False}},
+            "serverInfo": self.server_info
+        }, ensure_ascii=False).encode("utf-8")
+    
+    async def _ping(self, params: Dict[str, Any]) -> bytes:
+        return b"{}"
+    
+    async def _list_tools(self, params: Dict[str, Any]) -> bytes:
+        return self.registry.get_mcp_tool_list()
+    
+    async def _call_tool(self, params: Dict[str, Any]) -> bytes:
+        name = params.get("name")
+        arguments = params.get("arguments") or {}
+        if name not in self.registry.tools:
+            raise MCPError(INVALID_PARAMS, f"未知工具: {name}")
+        if not isinstance(arguments, dict):
+            raise MCPError(INVALID_PARAMS, "arguments必须是JSON对象")
+        
+        self.metrics["tool_calls"] += 1
+        result = await self.registry.execute_tool_async(name, **arguments)
+        # 参数错误、执行错误与熔断作为工具结果返回（isError），由调用方的模型处理
+        is_error = is_tool_error(result)
+        if is_error:
+            self.metrics["tool_errors"] += 1
+        return json.dumps(
+            {"content": [{"type": "text", "text": result}], "isError": is_error},
+            ensure_ascii=False
+        ).encode("utf-8")
+    
+    async def handle_message(self, message: Any) -> Optional[bytes]:
+        """处理一条JSON-RPC消息，返回序列化的响应；通知与客户端发来的响应没有返回值"""
+        if not isinstance(message, dict):
+            return self._error(None, INVALID_REQUEST, "无效的JSON-RPC消息")
+        if "method" not in message:
+            # 客户端对服务端请求的响应，本服务端不发起请求
+            return None
+        request_id = message.get("id")
+        method = message["method"]
+        params = message.get("params") or {}
+        if message.get("jsonrpc") != "2.0" or not isinstance(method, str) or not isinstance(params, dict):
+            return self._error(request_id, INVALID_REQUEST, "无效的JSON-RPC请求")
+        if "id" not in message:
+            # notifications/initialized、notifications/cancelled等通知不需要响应
+            return None
+        
+        handler = self._methods.get(method)
+        if handler is None:
+            return self._error(request_id, METHOD_NOT_FOUND, f"不支持的方法: {method}")
+        
+        self.metrics["requests"] += 1
+        self.metrics["in_flight"] += 1
+        self.metrics["peak_in_flight"] = max(self.metrics["peak_in_flight"], self.metrics["in_flight"])
+        try:
+            return self._response(request_id, await handler(params))
+        except MCPError as e:
+            return self._error(request_id, e.code, e.message)
+        except Exception as e:
+            logger.error(f"处理 {method} 出错: {e}")
+            return self._error(request_id, INTERNAL_ERROR, str(e))
+        finally:
+            self.metrics["in_flight"] -= 1
+    
+    def parse(self, data: bytes) -> Tuple[List[Any], bool]:
+        """解析一条消息或批量消息，返回(消息列表, 是否为批量)"""
+        try:
+            payload = json.loads(data)
+        except ValueError:
+            raise MCPError(PARSE_ERROR, "消息不是合法的JSON")
+        if not isinstance(payload, list):
+            return [payload], False
+        if not payload:
+            raise MCPError(INVALID_REQUEST, "批量请求不能为空")
+        if len(payload) > MAX_BATCH_MESSAGES:
+            raise MCPError(INVALID_REQUEST, f"单次最多 {MAX_BATCH_MESSAGES} 条消息")
+        return payload, True
+    
+    async def handle_payload(self, data: bytes) -> Optional[bytes]:
+        """处理一条消息或批量消息；批量中的请求并发执行，响应数组与请求的顺序一致"""
+        try:
+            messages, is_batch = self.parse(data)
+        except MCPError as e:
+            return self._error(None, e.code, e.message)
+        if not is_batch:
+            return await self.handle_message(messages[0])
+        responses = [response for response in await asyncio.gather(*map(self.handle_message, messages))
+                     if response is not None]
+        return b"[" + b", ".join(responses) + b"]" if responses else None
+    
+    async def serve_stream(self, reader: asyncio.StreamReader, write: Callable[[bytes], None]):
+        """stdio传输：逐行读取消息，不等上一条处理完就读取下一条，响应完成后各写为一行
+        
+        同时执行的消息数达到max_in_flight时暂停读取，输入结束后等待所有执行中的消息完成。
+        """
+        slots = asyncio.Semaphore(self.max_in_flight)
+        pending = set()
+        
+        async def process(line: bytes):
+            try:
+                response = await self.handle_payload(line)
+                if response is not None:
+                    write(response + b"\n")
+            finally:
+                slots.release()
+        
+        while True:
+            try:
+                line = await reader.readuntil(b"\n")
+            except asyncio.IncompleteReadError as e:
+                # 输入结束，最后一行可能没有换行符
+                line = e.partial
+            except asyncio.LimitOverrunError as e:
+                write(self._error(None, INVALID_REQUEST, f"消息超过 {MAX_MESSAGE_BYTES} 字节") + b"\n")
+                await _skip_line(reader, e.consumed)
+                continue
+            if not line:
+                break
+            if not line.strip():
+                continue
+            await slots.acquire()
+            task = asyncio.ensure_future(process(line))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+        if pending:
+            await asyncio.gather(*pending)
+    
+    async def serve_stdio(self):
+        """在标准输入输出上提供服务，日志只能写到标准错误"""
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader(limit=MAX_MESSAGE_BYTES)
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+        output = sys.stdout.buffer
+        
+        def write(data: bytes):
+            output.write(data)
+            output.flush()
+        
+        await self.serve_stream(reader, write)
+    
+    def _new_session(self) -> str:
+        session_id = uuid.uuid4().hex
+        self.sessions[session_id] = session_id
+        while len(self.sessions) > MAX_SESSIONS:
+            self.sessions.popitem(last=False)
+        return session_id
+    
+    async def _stream_events(self, messages: List[Any]) -> AsyncIterator[bytes]:
+        """按完成顺序把响应写为SSE事件"""
+        for future in asyncio.as_completed([self.handle_message(message) for message in messages]):
+            response = await future
+            if response is not None:
+                yield b"event: message\ndata: " + response + b"\n\n"
+    
+    async def handle_http(self, method: str, body: bytes = b"", accept: str = "",
+                          session_id: Optional[str] = None) -> HTTPResult:
+        """Streamable HTTP传输
+        
+        POST的请求全部为通知时返回202；客户端接受text/event-stream且批量中有多个请求时，
+        以SSE按完成顺序返回各响应，否则返回JSON。initialize的响应带上会话头，DELETE结束会话。
+        """
+        if method == "DELETE":
+            if session_id is None or self.sessions.pop(session_id, None) is None:
+                return HTTPResult(404)
+            return HTTPResult(200)
+        if method != "POST":
+            # 不提供服务端主动推送的GET流
+            return HTTPResult(405, headers={"Allow": "POST, DELETE"})
+        if session_id is not None and session_id not in self.sessions:
+            return HTTPResult(404, self._error(None, INVALID_REQUEST, "会话不存在或已过期"))
+        
+        try:
+            messages, is_batch = self.parse(body)
+        except MCPError as e:
+            return HTTPResult(400, self._error(None, e.code, e.message))
+        
+        headers = {}
+        if any(isinstance(message, dict) and message.get("method") == "initialize" for message in messages):
+            headers[SESSION_HEADER] = self._new_session()
+        requests = sum(1 for message in messages if isinstance(message, dict) and "id" in message and "method" in message)
+        if requests == 0:
+            await asyncio.gather(*map(self.handle_message, messages))
+            return HTTPResult(202, headers=headers)
+        
+        if "text/event-stream" in accept and (requests > 1 or "application/json" not in accept):
+            return HTTPResult(200, headers=headers, events=self._stream_events(messages))
+        if not is_batch:
+            return HTTPResult(200, await self.handle_message(messages[0]), headers)
+        return HTTPResult(200, await self.handle_payload(body), headers)
+    
+    def snapshot(self) -> Dict[str, Any]:
+        return {"sessions": len(self.sessions), **self.metrics}
+
+def create_http_router(server: MCPServer, path: str = "/mcp"):
+    """Streamable HTTP传输的FastAPI路由"""
+    from fastapi import APIRouter, Request
+    from fastapi.responses import Response, StreamingResponse
+    
+    router = APIRouter()
+    
+    @router.api_route(path, methods=["GET", "POST", "DELETE"])
+    async def mcp_endpoint(request: Request):
+        result = await server.handle_http(
+            request.method,
+            await request.body(),
+            request.headers.get("accept", ""),
+            request.headers.get(SESSION_HEADER)
+        )
+        if result.events is not None:
+            return StreamingResponse(result.events, status_code=result.status, headers=result.headers,
+                                     media_type="text/event-stream")
+        return Response(result.body, status_code=result.status, headers=result.headers,
+                        media_type="application/json" if result.body is not None else None)
+    
+    return router
+
+def main():
+    parser = argparse.ArgumentParser(description="MCP服务端")
+    parser.add_argument("--transport", type=str, default="stdio", choices=["stdio", "http"], help="传输方式")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="HTTP监听地址")
+    parser.add_argument("--port", type=int, default=8001, help="HTTP监听端口")
+    parser.add_argument("--max_in_flight", type=int, default=DEFAULT_MAX_IN_FLIGHT, help="每个连接同时执行的请求数")
+    args = parser.parse_args()
+    
+    # 标准输出用于协议消息，日志写到标准错误
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+    from examples.mcp_tools import tool_registry
+    server = MCPServer(tool_registry, max_in_flight=args.max_in_flight)
+    
+    if args.transport == "stdio":
+        asyncio.run(server.serve_stdio())
+        return
+    
+    import uvicorn
+    from fastapi import FastAPI
+    
+    app = FastAPI(title="MCP工具服务")
+    app.include_router(create_http_router(server))
+    uvicorn.run(app, host=args.host, port=args.port, log_level="info")
+
+if __name__ == "__main__":
+    main()
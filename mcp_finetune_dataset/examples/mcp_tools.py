@@ -6,18 +6,96 @@ MCP工具定义示例
 """
 
 import json
-import requests
 import os
-from typing import Dict, Any, List
+import asyncio
+import time
+import inspect
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from typing import Dict, Any, List, Iterator, Optional
 from datetime import datetime
 
+from examples.arithmetic import ArithmeticEngine
+from examples.file_listing import DirectoryListingCache
+from examples.file_reader import FileReader, ReadPlan
+from examples.search_backends import SearchBackend, MockSearchBackend, format_search_results
+from examples.resilience import Bulkhead, CircuitBreaker, ToolUnavailableError, DEFAULT_BULKHEAD_WAIT
+from examples.tool_schema import ToolArgumentError, build_tool_schema, compile_validator
+
+# 最终回答模板，可引用工具参数与工具结果{result}，与训练数据的最终回答格式一致
+DEFAULT_ANSWER_TEMPLATES = {
+    "web_search": "根据搜索结果，我为您找到了关于{query}的相关信息：\n\n{result}\n\n希望这些信息对您有帮助！",
+    "get_weather": "{city}的天气信息如下：\n\n{result}\n\n请根据天气情况合理安排出行。",
+    "list_files": "{path}目录的内容：\n\n{result}\n\n您需要对哪个文件进行操作吗？",
+    "write_file": "✅ 文件创建成功！\n\n📄 **文件名**：{filename}\n📝 **内容**：{content}\n\n文件已保存在当前目录中。",
+    "calculate": "🧮 **计算结果**：\n\n{result}\n\n计算完成！"
+}
+GENERIC_ANSWER_TEMPLATE = "操作完成：\n\n{result}"
+
+# 最终回答格式固定的工具，默认直接渲染模板，跳过第二轮生成
+DEFAULT_TEMPLATE_ANSWER_TOOLS = ["get_weather", "calculate", "get_current_time"]
+
+# execute_tool与各工具返回的错误前缀，出错时不渲染模板，交给模型组织回答
+TOOL_ERROR_PREFIXES = (
+    "未知工具", "参数错误", "工具执行错误", "工具暂不可用",
+    "计算错误", "读取文件失败", "无法访问目录", "写入文件失败"
+)
+
+def is_tool_error(result: str) -> bool:
+    """工具结果是否表示执行失败"""
+    return result.startswith(TOOL_ERROR_PREFIXES)
+
+# 同步工具在异步执行时使用的I/O线程数
+DEFAULT_IO_WORKERS = 16
+
+# 批量执行时每个工具的默认并发上限
+DEFAULT_TOOL_CONCURRENCY = 8
+
+# 熔断时用作降级结果的最近成功结果数（每个工具）；有副作用的工具不返回缓存结果
+DEGRADED_CACHE_SIZE = 128
+DEGRADED_CACHE_EXCLUDED_TOOLS = ["write_file"]
+
+# list_files每页的默认与最大条数，避免超大目录的列表挤满上下文
+DEFAULT_LIST_LIMIT = 100
+MAX_LIST_LIMIT = 1000
+
 class MCPToolRegistry:
     """MCP工具注册表"""
     
-    def __init__(self):
+    def __init__(self, io_workers: int = DEFAULT_IO_WORKERS):
         self.tools = {}
+        # 注册时从函数签名生成的schema与参数校验函数
+        self.schemas: Dict[str, Dict[str, Any]] = {}
+        self.validators: Dict[str, Any] = {}
+        self._tools_response: Optional[bytes] = None
+        self._mcp_tool_list: Optional[bytes] = None
+        self.io_workers = io_workers
+        self._io_executor: Optional[ThreadPoolExecutor] = None
+        self.concurrency_limits: Dict[str, int] = {}
+        # 按工具的舱壁与熔断器（examples/resilience.py），以及熔断时作为降级结果的最近成功结果
+        self.bulkheads: Dict[str, Bulkhead] = {}
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self._recent_results: Dict[str, "OrderedDict[str, str]"] = {}
+        self._recent_results_lock = threading.Lock()
+        # 进程隔离执行的工具（scripts/tool_sandbox.py）
+        self.sandbox = None
+        self.sandboxed_tools = set()
+        self.arithmetic = ArithmeticEngine()
+        self.listing_cache = DirectoryListingCache()
+        self.file_reader = FileReader()
+        # web_search的搜索后端（examples/search_backends.py），默认返回固定的示例结果
+        self.search_backend: SearchBackend = MockSearchBackend()
+        self.answer_templates = dict(DEFAULT_ANSWER_TEMPLATES)
+        self.template_answer_tools = set(DEFAULT_TEMPLATE_ANSWER_TOOLS)
         self._register_default_tools()
     
+    def __reduce__(self):
+        """在沙箱工作进程中重建注册表，使注册表方法形式的工具可以pickle；
+        只保留默认工具与read_file的读取上限，舱壁、熔断器、线程池等不跨进程传递"""
+        return _restore_registry, (self.io_workers, self.file_reader)
+    
     def _register_default_tools(self):
         """注册默认工具"""
         self.register_tool("web_search", self.web_search)
@@ -28,112 +106,119 @@ class MCPToolRegistry:
         self.register_tool("calculate", self.calculate)
         self.register_tool("get_current_time", self.get_current_time)
     
-    def register_tool(self, name: str, func):
-        """注册工具"""
+    def register_tool(self, name: str, func, answer_template: Optional[str] = None,
+                      template_answer: bool = False, description: Optional[str] = None):
+        """注册工具，func可以是同步函数或协程函数
+        
+        schema由func的签名、类型注解和docstring（第一行与Args段）生成。
+        
+        Args:
+            answer_template: 最终回答模板，可引用工具参数与{result}
+            template_answer: 是否直接按模板渲染最终回答，跳过第二轮生成
+            description: 工具描述，默认取docstring的第一行
+        """
+        schema = build_tool_schema(name, func, description)
         self.tools[name] = func
+        self.schemas[name] = schema
+        self.validators[name] = compile_validator(schema)
+        self._tools_response = None
+        self._mcp_tool_list = None
+        if answer_template is not None:
+            self.answer_templates[name] = answer_template
+        if template_answer:
+            self.template_answer_tools.add(name)
+    
+    def set_template_answer(self, name: str, enabled: bool):
+        """开启或关闭工具的模板回答"""
+        if enabled:
+            self.template_answer_tools.add(name)
+        else:
+            self.template_answer_tools.discard(name)
+    
+    def configure_template_answers(self, settings: Dict[str, bool]):
+        """按配置逐个工具设置模板回答，如 {"get_weather": True, "calculate": False}"""
+        for name, enabled in settings.items():
+            self.set_template_answer(name, bool(enabled))
+    
+    def format_answer(self, tool_name: str, arguments: Dict[str, Any], result: str) -> str:
+        """按模板渲染单个工具调用的最终回答"""
+        template = self.answer_templates.get(tool_name, GENERIC_ANSWER_TEMPLATE)
+        # 工具参数可能也叫result，以工具结果为准
+        return template.format_map({**arguments, "result": result})
+    
+    def try_format_answer(self, tool_name: str, arguments: Dict[str, Any], result: str) -> Optional[str]:
+        """工具执行成功且参数与模板匹配时渲染最终回答，否则返回None"""
+        if is_tool_error(result):
+            return None
+        try:
+            return self.format_answer(tool_name, arguments, result)
+        except (KeyError, IndexError, TypeError, ValueError):
+            # 参数与模板不匹配，或模板格式错误
+            return None
+    
+    def render_final_answer(self, tool_calls: List[Dict[str, Any]], tool_results: List[str]) -> Optional[str]:
+        """所有工具调用都开启了模板回答且执行成功时渲染最终回答，否则返回None交给模型生成"""
+        if not tool_calls:
+            return None
+        
+        answers = []
+        for tool_call, result in zip(tool_calls, tool_results):
+            if tool_call["name"] not in self.template_answer_tools:
+                return None
+            answer = self.try_format_answer(tool_call["name"], tool_call["arguments"], result)
+            if answer is None:
+                return None
+            answers.append(answer)
+        return "\n\n".join(answers)
     
     def get_tool_schema(self) -> List[Dict]:
-        """获取所有工具的schema定义"""
-        return [
-            {
-                "type": "function",
-                "function": {
-                    "name": "web_search",
-                    "description": "搜索互联网内容",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "query": {
-                                "type": "string",
-                                "description": "搜索查询词"
-                            }
-                        },
-                        "required": ["query"]
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "get_weather",
-                    "description": "获取指定城市的天气信息",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "city": {
-                                "type": "string",
-                                "description": "城市名称"
-                            }
-                        },
-                        "required": ["city"]
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "list_files",
-                    "description": "列出指定目录下的文件",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "path": {
-                                "type": "string",
-                                "description": "目录路径"
-                            }
-                        },
-                        "required": ["path"]
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "write_file",
-                    "description": "写入文件内容",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "filename": {
-                                "type": "string",
-                                "description": "文件名"
-                            },
-                            "content": {
-                                "type": "string",
-                                "description": "文件内容"
-                            }
-                        },
-                        "required": ["filename", "content"]
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "calculate",
-                    "description": "执行数学计算",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "expression": {
-                                "type": "string",
-                                "description": "数学表达式"
-                            }
-                        },
-                        "required": ["expression"]
-                    }
+        """获取所有工具的schema定义（注册时生成并缓存）"""
+        return list(self.schemas.values())
+    
+    def get_tools_response(self) -> bytes:
+        """/tools接口的响应体：tools与tool_schemas序列化后缓存到下一次注册工具，熔断器与舱壁状态每次追加"""
+        if self._tools_response is None:
+            tools = json.dumps(list(self.tools.keys()), ensure_ascii=False)
+            schemas = json.dumps(self.get_tool_schema(), ensure_ascii=False)
+            self._tools_response = f'{{"tools": {tools}, "tool_schemas": {schemas}'.encode("utf-8")
+        status = "".join(
+            f", {json.dumps(key)}: {json.dumps(value, ensure_ascii=False)}"
+            for key, value in self.resilience_snapshot().items()
+        )
+        return self._tools_response + status.encode("utf-8") + b"}"
+    
+    def get_mcp_tool_list(self) -> bytes:
+        """MCP tools/list的result（examples/mcp_server.py）：由schema转换，序列化后缓存到下一次注册工具"""
+        if self._mcp_tool_list is None:
+            self._mcp_tool_list = json.dumps({"tools": [
+                {
+                    "name": name,
+                    "description": schema["function"]["description"],
+                    "inputSchema": schema["function"]["parameters"]
                 }
-            }
-        ]
+                for name, schema in self.schemas.items()
+            ]}, ensure_ascii=False).encode("utf-8")
+        return self._mcp_tool_list
+    
+    def validate_arguments(self, tool_name: str, arguments: Dict[str, Any]):
+        """执行前按schema校验参数，不合法时抛出ToolArgumentError"""
+        self.validators[tool_name](arguments)
     
     def web_search(self, query: str) -> str:
-        """网络搜索工具"""
-        # 这里应该调用真实的搜索API
-        # 为了示例，返回模拟结果
-        return f"搜索结果：关于'{query}'的相关信息...\n1. 相关文章标题1\n2. 相关文章标题2\n3. 相关文章标题3"
+        """搜索互联网内容
+        
+        Args:
+            query: 搜索查询词
+        """
+        # 后端失败时抛出SearchBackendError，计入熔断器
+        return format_search_results(query, self.search_backend.search(query))
     
     def get_weather(self, city: str) -> str:
-        """获取天气信息"""
+        """获取指定城市的天气信息
+        
+        Args:
+            city: 城市名称
+        """
         # 模拟天气数据
         weather_data = {
             "北京": "北京：晴，25°C",
@@ -143,26 +228,43 @@ class MCPToolRegistry:
         }
         return weather_data.get(city, f"{city}：天气信息未知")
     
-    def list_files(self, path: str) -> str:
-        """列出文件"""
+    def list_files(self, path: str, offset: int = 0, limit: int = DEFAULT_LIST_LIMIT, pattern: str = "") -> str:
+        """列出指定目录下的文件
+        
+        Args:
+            path: 目录路径
+            offset: 从第几项开始列出（按名称排序，从0开始）
+            limit: 最多列出的条数，上限1000
+            pattern: 只列出名称匹配该glob模式的文件，如 *.json
+        """
         try:
-            files = os.listdir(path)
-            if not files:
-                return f"目录 {path} 为空"
-            
-            result = f"目录 {path} 下的文件：\n"
-            for file in files:
-                file_path = os.path.join(path, file)
-                if os.path.isdir(file_path):
-                    result += f"📁 {file}/\n"
-                else:
-                    result += f"📄 {file}\n"
-            return result
+            entries = self.listing_cache.list(path, pattern)
         except Exception as e:
             return f"无法访问目录 {path}: {str(e)}"
+        if not entries:
+            return f"目录 {path} 中没有匹配 {pattern} 的文件" if pattern else f"目录 {path} 为空"
+        
+        offset = max(offset, 0)
+        limit = min(max(limit, 1), MAX_LIST_LIMIT)
+        page = entries[offset:offset + limit]
+        if not page:
+            return f"目录 {path} 共 {len(entries)} 项，offset={offset} 之后没有更多文件"
+        
+        lines = [f"目录 {path} 下的文件：" if not pattern else f"目录 {path} 下匹配 {pattern} 的文件："]
+        lines.extend(f"📁 {name}/" if is_dir else f"📄 {name}" for name, is_dir in page)
+        end = offset + len(page)
+        if offset > 0 or end < len(entries):
+            lines.append(f"（第 {offset + 1}-{end} 项，共 {len(entries)} 项"
+                         + (f"，使用 offset={end} 查看后续）" if end < len(entries) else "）"))
+        return "\n".join(lines) + "\n"
     
     def write_file(self, filename: str, content: str) -> str:
-        """写入文件"""
+        """写入文件内容
+        
+        Args:
+            filename: 文件名
+            content: 文件内容
+        """
         try:
             with open(filename, 'w', encoding='utf-8') as f:
                 f.write(content)
@@ -170,42 +272,389 @@ class MCPToolRegistry:
         except Exception as e:
             return f"写入文件失败: {str(e)}"
     
-    def read_file(self, filename: str) -> str:
-        """读取文件"""
+    def read_file(self, filename: str, offset: int = 0, length: int = 0, start_line: int = 0, end_line: int = 0) -> str:
+        """读取文件内容
+        
+        Args:
+            filename: 文件名
+            offset: 从第几个字节开始读取
+            length: 最多读取的字节数，0表示读到文件末尾
+            start_line: 从第几行开始读取（从1开始），设置行号时忽略offset与length
+            end_line: 读取到第几行（包含），0表示读到文件末尾
+        """
         try:
-            with open(filename, 'r', encoding='utf-8') as f:
-                content = f.read()
-            return f"文件 {filename} 内容：\n{content}"
+            plan = self.file_reader.plan(filename, offset, length, start_line, end_line)
+            return "".join(self._iter_read_result(filename, plan))
         except Exception as e:
             return f"读取文件失败: {str(e)}"
     
+    def _iter_read_result(self, filename: str, plan: ReadPlan) -> Iterator[str]:
+        """按片段生成read_file的结果文本；读取整个文件时与逐字读入的格式一致"""
+        if plan.start == 0 and plan.end == plan.size:
+            yield f"文件 {filename} 内容：\n"
+        else:
+            yield f"文件 {filename} 第 {plan.start}-{plan.end} 字节（共 {plan.size} 字节）内容：\n"
+        yield from self.file_reader.iter_text(plan)
+        if plan.truncated:
+            yield f"\n（内容已截断，使用 offset={plan.end} 继续读取）"
+    
+    def stream_read_file(self, arguments: Dict[str, Any]) -> Optional[Iterator[str]]:
+        """读取范围超过max_bytes时返回按块生成结果的迭代器（上限max_stream_bytes），否则返回None按普通调用执行
+        
+        与普通调用一样经过read_file的舱壁与熔断器，名额在迭代结束或迭代器关闭时归还；
+        舱壁已满或熔断时返回只含降级结果的迭代器，read_file在沙箱中执行时不流式返回。
+        """
+        if "read_file" in self.sandboxed_tools:
+            return None
+        try:
+            self.validate_arguments("read_file", arguments)
+        except ToolArgumentError:
+            return None
+        
+        bulkhead = self.bulkheads.get("read_file")
+        breaker = self.breakers.get("read_file")
+        try:
+            if bulkhead is not None and not bulkhead.acquire():
+                raise ToolUnavailableError(f"并发已满（上限{bulkhead.max_concurrent}）")
+            if breaker is not None:
+                try:
+                    breaker.before_call()
+                except ToolUnavailableError:
+                    if bulkhead is not None:
+                        bulkhead.release()
+                    raise
+        except ToolUnavailableError as e:
+            return iter([self._degraded_result("read_file", arguments, e)])
+        
+        options = dict(arguments)
+        filename = options.pop("filename")
+        try:
+            plan = self.file_reader.plan(filename, max_bytes=self.file_reader.max_stream_bytes, **options)
+            streamed = plan.length > self.file_reader.max_bytes
+        except Exception:
+            # 文件错误交给普通调用返回错误信息
+            plan, streamed = None, False
+        if not streamed:
+            if breaker is not None:
+                (breaker.record_failure if plan is None else breaker.record_success)()
+            if bulkhead is not None:
+                bulkhead.release()
+            return None
+        
+        stream = self._guarded_stream(self._iter_read_result(filename, plan), bulkhead, breaker)
+        # 先取出第一个片段，生成器已启动，未迭代完就被丢弃时close同样会归还名额
+        return itertools.chain([next(stream)], stream)
+    
+    @staticmethod
+    def _guarded_stream(pieces: Iterator[str], bulkhead: Optional[Bulkhead],
+                        breaker: Optional[CircuitBreaker]) -> Iterator[str]:
+        """按片段输出，结束时记录熔断器结果并归还舱壁名额"""
+        try:
+            yield from pieces
+        except GeneratorExit:
+            # 客户端断开，已读取的部分正常
+            if breaker is not None:
+                breaker.record_success()
+            raise
+        except Exception:
+            if breaker is not None:
+                breaker.record_failure()
+            raise
+        else:
+            if breaker is not None:
+                breaker.record_success()
+        finally:
+            if bulkhead is not None:
+                bulkhead.release()
+    
     def calculate(self, expression: str) -> str:
-        """数学计算"""
+        """执行数学计算
+        
+        Args:
+            expression: 数学表达式
+        """
         try:
-            # 安全的数学计算
-            allowed_chars = set('0123456789+-*/()., ')
-            if not all(c in allowed_chars for c in expression):
-                return "表达式包含不允许的字符"
-            
-            result = eval(expression)
-            return f"计算结果：{expression} = {result}"
+            result = self.arithmetic.evaluate(expression)
         except Exception as e:
             return f"计算错误: {str(e)}"
+        return f"计算结果：{expression} = {result}"
+    
+    def calculate_batch(self, expressions: List[str]) -> List[str]:
+        """批量数学计算，结果与逐个调用calculate一致，结构相同的表达式用NumPy一次求值"""
+        return [
+            f"计算错误: {str(result)}" if isinstance(result, Exception) else f"计算结果：{expression} = {result}"
+            for expression, result in zip(expressions, self.arithmetic.evaluate_batch(expressions))
+        ]
     
     def get_current_time(self) -> str:
         """获取当前时间"""
         now = datetime.now()
         return f"当前时间：{now.strftime('%Y-%m-%d %H:%M:%S')}"
     
+    @property
+    def io_executor(self) -> ThreadPoolExecutor:
+        """同步工具的专用I/O线程池，避免阻塞事件循环和默认线程池"""
+        if self._io_executor is None:
+            self._io_executor = ThreadPoolExecutor(max_workers=self.io_workers, thread_name_prefix="mcp-tool-io")
+        return self._io_executor
+    
+    def set_search_backend(self, backend: SearchBackend):
+        """替换web_search的搜索后端，并关闭原后端的连接"""
+        previous, self.search_backend = self.search_backend, backend
+        if previous is not backend:
+            previous.close()
+    
+    def enable_sandbox(self, sandbox, tool_names: List[str]):
+        """指定的工具改为在沙箱工作进程中执行"""
+        unknown = [name for name in tool_names if name not in self.tools]
+        if unknown:
+            raise ValueError(f"未注册的工具不能放入沙箱: {', '.join(unknown)}")
+        self.sandbox = sandbox
+        self.sandboxed_tools = set(tool_names)
+    
+    def is_async_tool(self, tool_name: str) -> bool:
+        """工具是否为协程函数"""
+        return inspect.iscoroutinefunction(self.tools.get(tool_name))
+    
     def execute_tool(self, tool_name: str, **kwargs) -> str:
-        """执行工具"""
+        """执行工具（同步接口）
+        
+        协程工具在当前线程的新事件循环中运行，不能在事件循环线程中调用，请改用execute_tool_async。
+        """
         if tool_name not in self.tools:
             return f"未知工具: {tool_name}"
         
         try:
-            return self.tools[tool_name](**kwargs)
+            self.validate_arguments(tool_name, kwargs)
+            return self._call_guarded(tool_name, kwargs)
+        except ToolArgumentError as e:
+            return f"参数错误: {str(e)}"
+        except ToolUnavailableError as e:
+            return self._degraded_result(tool_name, kwargs, e)
         except Exception as e:
             return f"工具执行错误: {str(e)}"
+    
+    def _call_tool(self, tool_name: str, kwargs: Dict[str, Any]) -> str:
+        """在当前线程执行工具：沙箱工具交给工作进程，协程工具在新事件循环中运行"""
+        if tool_name in self.sandboxed_tools:
+            return self.sandbox.run(tool_name, kwargs)
+        if self.is_async_tool(tool_name):
+            return asyncio.run(self.tools[tool_name](**kwargs))
+        return self.tools[tool_name](**kwargs)
+    
+    def _call_guarded(self, tool_name: str, kwargs: Dict[str, Any]) -> str:
+        """经过舱壁与熔断器同步执行工具"""
+        bulkhead = self.bulkheads.get(tool_name)
+        breaker = self.breakers.get(tool_name)
+        if bulkhead is not None and not bulkhead.acquire():
+            raise ToolUnavailableError(f"并发已满（上限{bulkhead.max_concurrent}）")
+        try:
+            if breaker is None:
+                return self._call_tool(tool_name, kwargs)
+            breaker.before_call()
+            try:
+                result = self._call_tool(tool_name, kwargs)
+            except Exception:
+                breaker.record_failure()
+                raise
+            self._record_result(tool_name, kwargs, breaker, result)
+            return result
+        finally:
+            if bulkhead is not None:
+                bulkhead.release()
+    
+    def _call_and_release(self, tool_name: str, kwargs: Dict[str, Any], bulkhead: Optional[Bulkhead]) -> str:
+        try:
+            return self._call_tool(tool_name, kwargs)
+        finally:
+            if bulkhead is not None:
+                bulkhead.release()
+    
+    async def _await_and_release(self, coroutine, bulkhead: Optional[Bulkhead]) -> str:
+        try:
+            return await coroutine
+        finally:
+            if bulkhead is not None:
+                bulkhead.release()
+    
+    async def _invoke_async(self, tool_name: str, **kwargs) -> str:
+        """经过舱壁与熔断器调用工具，异常直接抛出"""
+        self.validate_arguments(tool_name, kwargs)
+        bulkhead = self.bulkheads.get(tool_name)
+        breaker = self.breakers.get(tool_name)
+        if bulkhead is not None and not await bulkhead.acquire_async():
+            raise ToolUnavailableError(f"并发已满（上限{bulkhead.max_concurrent}）")
+        if breaker is not None:
+            try:
+                breaker.before_call()
+            except ToolUnavailableError:
+                if bulkhead is not None:
+                    bulkhead.release()
+                raise
+        
+        if tool_name in self.sandboxed_tools or not self.is_async_tool(tool_name):
+            # 同步工具与等待沙箱工作进程的线程占用I/O线程池，不阻塞事件循环；
+            # 超时后线程仍在运行，执行结束时才归还舱壁名额
+            awaitable = asyncio.get_running_loop().run_in_executor(
+                self.io_executor, self._call_and_release, tool_name, kwargs, bulkhead
+            )
+        else:
+            awaitable = self._await_and_release(self.tools[tool_name](**kwargs), bulkhead)
+        if breaker is None:
+            return await awaitable
+        
+        try:
+            result = await asyncio.wait_for(awaitable, breaker.call_timeout)
+        except asyncio.TimeoutError:
+            breaker.record_failure()
+            raise RuntimeError(f"执行超时（{breaker.call_timeout}秒）")
+        except (Exception, asyncio.CancelledError):
+            # 被外层超时取消同样计为失败，并释放半开状态的试探名额
+            breaker.record_failure()
+            raise
+        self._record_result(tool_name, kwargs, breaker, result)
+        return result
+    
+    async def execute_tool_async(self, tool_name: str, **kwargs) -> str:
+        """执行工具（异步接口）：协程工具直接等待，同步工具交给I/O线程池"""
+        if tool_name not in self.tools:
+            return f"未知工具: {tool_name}"
+        
+        try:
+            return await self._invoke_async(tool_name, **kwargs)
+        except ToolArgumentError as e:
+            return f"参数错误: {str(e)}"
+        except ToolUnavailableError as e:
+            return self._degraded_result(tool_name, kwargs, e)
+        except Exception as e:
+            return f"工具执行错误: {str(e)}"
+    
+    def set_concurrency_limit(self, tool_name: str, limit: int, max_wait: float = DEFAULT_BULKHEAD_WAIT):
+        """设置工具的并发上限（舱壁），对所有执行接口生效；并发已满时最多等待max_wait秒后快速失败"""
+        self.bulkheads[tool_name] = Bulkhead(limit, max_wait)
+        self.concurrency_limits[tool_name] = limit
+    
+    def enable_circuit_breaker(self, tool_name: str, **kwargs):
+        """为工具开启熔断器，参数见CircuitBreaker"""
+        if tool_name not in self.tools:
+            raise ValueError(f"未注册的工具不能开启熔断器: {tool_name}")
+        self.breakers[tool_name] = CircuitBreaker(**kwargs)
+    
+    def _record_result(self, tool_name: str, kwargs: Dict[str, Any], breaker: CircuitBreaker, result: str):
+        """按工具结果更新熔断器：工具自身返回的错误结果计为失败，且不作为降级结果保存"""
+        if isinstance(result, str) and is_tool_error(result):
+            breaker.record_failure()
+            return
+        breaker.record_success()
+        self._remember_result(tool_name, kwargs, result)
+    
+    def _remember_result(self, tool_name: str, kwargs: Dict[str, Any], result: str):
+        """保存最近的成功结果，熔断时作为降级结果"""
+        if tool_name in DEGRADED_CACHE_EXCLUDED_TOOLS or not isinstance(result, str):
+            return
+        key = json.dumps(kwargs, sort_keys=True, ensure_ascii=False)
+        with self._recent_results_lock:
+            results = self._recent_results.setdefault(tool_name, OrderedDict())
+            results[key] = result
+            results.move_to_end(key)
+            while len(results) > DEGRADED_CACHE_SIZE:
+                results.popitem(last=False)
+    
+    def cached_result(self, tool_name: str, kwargs: Dict[str, Any]) -> Optional[str]:
+        """相同参数最近一次的成功结果"""
+        key = json.dumps(kwargs, sort_keys=True, ensure_ascii=False)
+        with self._recent_results_lock:
+            return self._recent_results.get(tool_name, {}).get(key)
+    
+    def _degraded_result(self, tool_name: str, kwargs: Dict[str, Any], error: ToolUnavailableError) -> str:
+        """舱壁已满或熔断时快速返回：有相同参数的缓存结果时返回缓存，否则返回错误说明"""
+        cached = self.cached_result(tool_name, kwargs)
+        if cached is not None:
+            return f"（{tool_name} 暂时不可用，以下为最近一次的结果）\n{cached}"
+        return f"工具暂不可用: {tool_name} {str(error)}"
+    
+    def resilience_snapshot(self) -> Dict[str, Any]:
+        """各工具的熔断器与舱壁状态"""
+        return {
+            "circuit_breakers": {name: breaker.snapshot() for name, breaker in self.breakers.items()},
+            "bulkheads": {name: bulkhead.snapshot() for name, bulkhead in self.bulkheads.items()}
+        }
+    
+    async def execute_batch_async(self, tool_calls: List[Dict[str, Any]],
+                                  timeout: Optional[float] = None) -> List[Dict[str, Any]]:
+        """批量并发执行工具调用
+        
+        相同的调用（工具名与参数都相同）只执行一次，每个工具的并发数不超过其并发上限。
+        返回与调用顺序一致的结果，每项包含result或error、耗时及是否为重复调用。
+        
+        Args:
+            timeout: 单个调用的超时（秒）
+        """
+        semaphores: Dict[str, asyncio.Semaphore] = {}
+        
+        async def run(tool_name: str, arguments: Dict[str, Any]) -> Dict[str, Any]:
+            if tool_name not in self.tools:
+                return {"result": None, "error": f"未知工具: {tool_name}", "elapsed_ms": 0.0}
+            if tool_name not in semaphores:
+                semaphores[tool_name] = asyncio.Semaphore(
+                    self.concurrency_limits.get(tool_name, DEFAULT_TOOL_CONCURRENCY)
+                )
+            
+            async with semaphores[tool_name]:
+                start_time = time.perf_counter()
+                try:
+                    result = await asyncio.wait_for(self._invoke_async(tool_name, **arguments), timeout)
+                    # 工具自身返回的错误结果同样作为该调用的错误
+                    if is_tool_error(result):
+                        outcome = {"result": None, "error": result}
+                    else:
+                        outcome = {"result": result, "error": None}
+                except asyncio.TimeoutError:
+                    outcome = {"result": None, "error": f"工具执行超时（{timeout}秒）"}
+                except ToolArgumentError as e:
+                    outcome = {"result": None, "error": f"参数错误: {str(e)}"}
+                except ToolUnavailableError as e:
+                    degraded = self._degraded_result(tool_name, arguments, e)
+                    if is_tool_error(degraded):
+                        outcome = {"result": None, "error": degraded}
+                    else:
+                        outcome = {"result": degraded, "error": None}
+                except Exception as e:
+                    outcome = {"result": None, "error": f"工具执行错误: {str(e)}"}
+                outcome["elapsed_ms"] = round((time.perf_counter() - start_time) * 1000, 3)
+                return outcome
+        
+        # 按工具名与规范化参数去重
+        keys = [json.dumps([call["name"], call["arguments"]], sort_keys=True, ensure_ascii=False) for call in tool_calls]
+        unique: Dict[str, asyncio.Task] = {}
+        for key, call in zip(keys, tool_calls):
+            if key not in unique:
+                unique[key] = asyncio.ensure_future(run(call["name"], call["arguments"]))
+        await asyncio.gather(*unique.values())
+        
+        results = []
+        seen = set()
+        for key, call in zip(keys, tool_calls):
+            results.append({
+                "tool_name": call["name"],
+                "arguments": call["arguments"],
+                **unique[key].result(),
+                "deduplicated": key in seen
+            })
+            seen.add(key)
+        return results
+    
+    async def execute_tools_async(self, tool_calls: List[Dict[str, Any]]) -> List[str]:
+        """并发执行多个工具调用，结果与调用顺序一致"""
+        return list(await asyncio.gather(*(
+            self.execute_tool_async(tool_call["name"], **tool_call["arguments"]) for tool_call in tool_calls
+        )))
+
+def _restore_registry(io_workers: int, file_reader: FileReader) -> MCPToolRegistry:
+    """在工作进程中重建工具注册表（MCPToolRegistry.__reduce__）"""
+    registry = MCPToolRegistry(io_workers)
+    registry.file_reader = file_reader
+    return registry
 
 # 全局工具注册表实例
 tool_registry = MCPToolRegistry()
\ No newline at end of file
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+工具舱壁与熔断器
+舱壁限制单个工具同时执行的调用数，并发已满时短暂等待后快速失败，慢速工具不会占满I/O线程池；
+熔断器在连续失败或超时达到阈值后打开，冷却期内直接拒绝调用，冷却结束后放行一次试探调用，
+成功则关闭，失败则重新打开。
+"""
+
+import time
+import asyncio
+import threading
+from typing import Dict, Any, Optional
+
+# 舱壁已满时默认最多等待的秒数
+DEFAULT_BULKHEAD_WAIT = 1.0
+
+# 异步调用等待舱壁时的轮询间隔；舱壁由线程与多个事件循环共享，不能使用asyncio.Semaphore
+BULKHEAD_POLL_INTERVAL = 0.01
+
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_TIMEOUT = 30.0
+
+class ToolUnavailableError(Exception):
+    """舱壁已满或熔断器打开，调用被快速拒绝"""
+
+class Bulkhead:
+    """单个工具的并发上限"""
+    
+    def __init__(self, max_concurrent: int, max_wait: float = DEFAULT_BULKHEAD_WAIT):
+        if max_concurrent < 1:
+            raise ValueError("并发上限必须至少为1")
+        self.max_concurrent = max_concurrent
+        self.max_wait = max_wait
+        self._semaphore = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self.active = 0
+        self.rejected = 0
+    
+    def _acquired(self) -> bool:
+        with self._lock:
+            self.active += 1
+        return True
+    
+    def _reject(self) -> bool:
+        with self._lock:
+            self.rejected += 1
+        return False
+    
+    def acquire(self) -> bool:
+        """同步获取执行名额，等待超过max_wait时返回False"""
+        if self._semaphore.acquire(timeout=self.max_wait):
+            return self._acquired()
+        return self._reject()
+    
+    async def acquire_async(self) -> bool:
+        """异步获取执行名额，等待期间不阻塞事件循环"""
+        deadline = time.monotonic() + self.max_wait
+        while not self._semaphore.acquire(blocking=False):
+            if time.monotonic() >= deadline:
+                return self._reject()
+            await asyncio.sleep(BULKHEAD_POLL_INTERVAL)
+        return self._acquired()
+    
+    def release(self):
+        with self._lock:
+            self.active -= 1
+        self._semaphore.release()
+    
+    def snapshot(self) -> Dict[str, Any]:
+        return {"max_concurrent": self.max_concurrent, "active": self.active, "rejected": self.rejected}
+
+class CircuitBreaker:
+    """单个工具的熔断器：closed → open → half_open → closed/open"""
+    
+    def __init__(self, failure_threshold: int = DEFAULT_FAILURE_THRESHOLD, reset_timeout: float = DEFAULT_RESET_TIMEOUT,
+                 call_timeout: Optional[float] = None):
+        """
+        Args:
+            failure_threshold: 连续失败（异常、超时或工具返回错误结果）达到该次数后打开
+            reset_timeout: 打开后经过该秒数放行一次试探调用
+            call_timeout: 异步调用的超时（秒），超时计为失败
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.call_timeout = call_timeout
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+        self.metrics = {
+            "successes": 0,
+            "failures": 0,
+            "rejected": 0,
+            "opened": 0
+        }
+    
+    def before_call(self):
+        """调用前检查，熔断器打开时抛出ToolUnavailableError"""
+        with self._lock:
+            if self.state == "closed":
+                return
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = "half_open"
+            if self.state == "half_open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return
+            self.metrics["rejected"] += 1
+            retry_in = max(self.reset_timeout - (time.monotonic() - self.opened_at), 0.0)
+        raise ToolUnavailableError(f"熔断中，约 {retry_in:.0f} 秒后重试")
+    
+    def record_success(self):
+        with self._lock:
+            self.metrics["successes"] += 1
+            self.consecutive_failures = 0
+            self.state = "closed"
+            self._trial_in_flight = False
+    
+    def record_failure(self):
+        with self._lock:
+            self.metrics["failures"] += 1
+            self.consecutive_failures += 1
+            self._trial_in_flight = False
+            if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.metrics["opened"] += 1
+                self.state = "open"
+                self.opened_at = time.monotonic()
+    
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "failure_threshold": self.failure_threshold,
+                "reset_timeout": self.reset_timeout,
+                "call_timeout": self.call_timeout,
+                **self.metrics
+            }
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+web_search后端
+MockSearchBackend返回固定的示例结果（默认，与训练数据一致）；HTTPSearchBackend调用JSON搜索接口，
+所有调用共享一个保持连接的HTTP连接池，并限制并发数、按抖动退避重试可恢复的错误、限制响应大小。
+"""
+
+import json
+import time
+import random
+import logging
+import threading
+from abc import ABC, abstractmethod
+from typing import Dict, Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_RESULTS = 3
+
+# 可重试的HTTP状态码
+RETRYABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+
+class SearchBackendError(Exception):
+    """搜索后端调用失败"""
+
+def format_search_results(query: str, results: List[Dict[str, Any]]) -> str:
+    """把搜索结果格式化为工具结果文本"""
+    if not results:
+        return f"搜索结果：没有找到关于'{query}'的相关信息"
+    lines = [f"搜索结果：关于'{query}'的相关信息..."]
+    for index, item in enumerate(results, 1):
+        line = f"{index}. {item.get('title', '')}"
+        if item.get("url"):
+            line += f" - {item['url']}"
+        if item.get("snippet"):
+            line += f"\n   {item['snippet']}"
+        lines.append(line)
+    return "\n".join(lines)
+
+class SearchBackend(ABC):
+    """搜索后端接口：search返回[{title, url, snippet}]，失败时抛出SearchBackendError"""
+    
+    name = "base"
+    
+    @abstractmethod
+    def search(self, query: str, max_results: int = DEFAULT_MAX_RESULTS) -> List[Dict[str, Any]]:
+        """同步搜索；异步调用由工具注册表在其I/O线程池中执行"""
+    
+    def close(self):
+        """释放连接等资源"""
+    
+    def snapshot(self) -> Dict[str, Any]:
+        return {"backend": self.name}
+
+class MockSearchBackend(SearchBackend):
+    """固定的示例结果，不访问网络"""
+    
+    name = "mock"
+    
+    def search(self, query: str, max_results: int = DEFAULT_MAX_RESULTS) -> List[Dict[str, Any]]:
+        return [{"title": f"相关文章标题{index}"} for index in range(1, max_results + 1)]
+
+class HTTPSearchBackend(SearchBackend):
+    """JSON搜索接口后端
+    
+    请求 GET {url}?{query_param}=查询词&{count_param}=条数，响应为 {"results": [{"title", "url", "snippet"}]}。
+    所有调用共享同一个requests连接池：注册表的工具会在多个事件循环（每次asyncio.run一个）中执行，
+    绑定事件循环的异步客户端无法跨调用复用连接，异步调用由注册表在I/O线程池中执行同步接口。
+    """
+    
+    name = "http"
+    
+    def __init__(self, url: str, api_key: Optional[str] = None, timeout: float = 5.0,
+                 max_connections: int = 16, max_concurrency: int = 8, retries: int = 2,
+                 backoff: float = 0.2, max_backoff: float = 2.0, max_response_bytes: int = 1024 * 1024,
+                 query_param: str = "q", count_param: str = "count"):
+        """
+        Args:
+            max_connections: 连接池中保持的最大连接数
+            max_concurrency: 同时进行的搜索请求数，超出的请求等待timeout秒后失败
+            retries: 连接错误、超时与429/5xx响应的重试次数
+            backoff: 第一次重试的基础等待秒数，之后指数增长并加入±50%的随机抖动
+            max_response_bytes: 响应体的最大字节数，超出时放弃读取
+        """
+        import requests
+        from requests.adapters import HTTPAdapter
+        
+        self.url = url
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_response_bytes = max_response_bytes
+        self.query_param = query_param
+        self.count_param = count_param
+        self.max_concurrency = max_concurrency
+        
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_connections, pool_block=True)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        if api_key:
+            self.session.headers["Authorization"] = f"Bearer {api_key}"
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._metrics_lock = threading.Lock()
+        self.metrics = {
+            "requests": 0,
+            "retries": 0,
+            "failures": 0,
+            "oversized": 0
+        }
+    
+    def _count(self, key: str):
+        with self._metrics_lock:
+            self.metrics[key] += 1
+    
+    def _read_body(self, response) -> bytes:
+        """按块读取响应体，超过max_response_bytes时抛出SearchBackendError"""
+        length = response.headers.get("Content-Length")
+        if length and length.isdigit() and int(length) > self.max_response_bytes:
+            self._count("oversized")
+            raise SearchBackendError(f"搜索响应超过 {self.max_response_bytes} 字节")
+        chunks = []
+        size = 0
+        for chunk in response.iter_content(chunk_size=64 * 1024):
+            size += len(chunk)
+            if size > self.max_response_bytes:
+                self._count("oversized")
+                raise SearchBackendError(f"搜索响应超过 {self.max_response_bytes} 字节")
+            chunks.append(chunk)
+        return b"".join(chunks)
+    
+    def _sleep_before_retry(self, attempt: int):
+        delay = min(self.backoff * 2 ** attempt, self.max_backoff)
+        time.sleep(delay * random.uniform(0.5, 1.5))
+    
+    def _request(self, params: Dict[str, Any]) -> Any:
+        """发送请求并解析JSON，可重试的错误按退避重试，最后一次仍失败时抛出SearchBackendError"""
+        import requests
+        
+        for attempt in range(self.retries + 1):
+            last = attempt == self.retries
+            self._count("requests")
+            try:
+                with self.session.get(self.url, params=params, timeout=self.timeout, stream=True) as response:
+                    status = response.status_code
+                    if status == 200:
+                        body = self._read_body(response)
+                    elif status not in RETRYABLE_STATUS_CODES or last:
+                        raise SearchBackendError(f"搜索接口返回 HTTP {status}")
+                    else:
+                        body = None
+                error = f"HTTP {status}"
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if last:
+                    raise SearchBackendError(f"搜索接口不可用: {e}")
+                body, error = None, type(e).__name__
+            
+            if body is not None:
+                try:
+                    return json.loads(body)
+                except ValueError:
+                    raise SearchBackendError("搜索响应不是合法的JSON")
+            logger.debug(f"搜索请求失败（{error}），第{attempt + 1}次重试")
+            self._count("retries")
+            self._sleep_before_retry(attempt)
+        raise SearchBackendError("搜索失败")
+    
+    def search(self, query: str, max_results: int = DEFAULT_MAX_RESULTS) -> List[Dict[str, Any]]:
+        if not self._semaphore.acquire(timeout=self.timeout):
+            raise SearchBackendError(f"搜索并发已满（上限{self.max_concurrency}）")
+        try:
+            data = self._request({self.query_param: query, self.count_param: max_results})
+        except SearchBackendError:
+            self._count("failures")
+            raise
+        finally:
+            self._semaphore.release()
+        
+        results = data.get("results") if isinstance(data, dict) else None
+        if not isinstance(results, list):
+            self._count("failures")
+            raise SearchBackendError("搜索响应缺少results列表")
+        return [
+            {key: str(item.get(key, "")) for key in ("title", "url", "snippet")}
+            for item in results[:max_results] if isinstance(item, dict)
+        ]
+    
+    def close(self):
+        self.session.close()
+    
+    def snapshot(self) -> Dict[str, Any]:
+        with self._metrics_lock:
+            return {"backend": self.name, "url": self.url, "max_concurrency": self.max_concurrency, **self.metrics}
+
+def create_search_backend(config: Dict[str, Any]) -> SearchBackend:
+    """按配置（config.yaml的tools.web_search段）创建搜索后端"""
+    backend = config.get("backend", "mock")
+    if backend == "mock":
+        return MockSearchBackend()
+    if backend == "http":
+        if not config.get("url"):
+            raise ValueError("http搜索后端需要配置url")
+        return HTTPSearchBackend(
+            config["url"],
+            api_key=config.get("api_key"),
+            timeout=config.get("timeout_seconds", 5.0),
+            max_connections=config.get("max_connections", 16),
+            max_concurrency=config.get("max_concurrency", 8),
+            retries=config.get("retries", 2),
+            backoff=config.get("backoff_seconds", 0.2),
+            max_response_bytes=config.get("max_response_bytes", 1024 * 1024)
+        )
+    raise ValueError(f"未知的搜索后端: {backend}，可选: mock, http")
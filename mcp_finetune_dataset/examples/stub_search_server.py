@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地搜索桩服务
+实现HTTPSearchBackend使用的JSON搜索接口（GET /search?q=查询词&count=条数），用于测试与基准测试，不访问外网。
+支持HTTP/1.1保持连接，可配置响应延迟、响应大小，并可注入失败响应。
+"""
+
+import json
+import time
+import logging
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from typing import Dict, Any
+
+logger = logging.getLogger(__name__)
+
+class _SearchHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # 响应头与响应体分两次写出，保持连接时Nagle算法与延迟确认会让每个响应多等约40毫秒
+    disable_nagle_algorithm = True
+    
+    def setup(self):
+        super().setup()
+        self.server.stub.count("connections")
+    
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+    
+    def _send(self, status: int, body: bytes):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def do_GET(self):
+        stub = self.server.stub
+        stub.count("requests")
+        url = urlparse(self.path)
+        if url.path != "/search":
+            self._send(404, b'{"error": "not found"}')
+            return
+        
+        params = parse_qs(url.query)
+        query = params.get("q", [""])[0]
+        try:
+            count = int(params.get("count", ["3"])[0])
+        except ValueError:
+            count = 3
+        if stub.latency:
+            time.sleep(stub.latency)
+        if stub.take_failure():
+            self._send(503, b'{"error": "unavailable"}')
+            return
+        self._send(200, json.dumps({"results": stub.results(query, count)}, ensure_ascii=False).encode("utf-8"))
+
+class _StubHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    
+    def handle_error(self, request, client_address):
+        # 客户端放弃读取超大响应时会重置连接，不打印堆栈
+        logger.debug(f"连接 {client_address} 异常断开")
+
+class StubSearchServer:
+    """在后台线程中运行的搜索桩服务，可作为上下文管理器使用"""
+    
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0, snippet_bytes: int = 0):
+        """
+        Args:
+            port: 监听端口，0表示随机分配
+            latency: 每个请求的响应延迟（秒）
+            snippet_bytes: 每条结果摘要的填充字节数，用于测试响应大小上限
+        """
+        self.latency = latency
+        self.snippet_bytes = snippet_bytes
+        self._failures = 0
+        self._lock = threading.Lock()
+        self.metrics = {
+            "connections": 0,
+            "requests": 0,
+            "failures": 0
+        }
+        self.httpd = _StubHTTPServer((host, port), _SearchHandler)
+        self.httpd.stub = self
+        self._thread = None
+    
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/search"
+    
+    def count(self, key: str):
+        with self._lock:
+            self.metrics[key] += 1
+    
+    def fail_next(self, count: int):
+        """接下来的count个请求返回503"""
+        with self._lock:
+            self._failures = count
+    
+    def take_failure(self) -> bool:
+        with self._lock:
+            if self._failures <= 0:
+                return False
+            self._failures -= 1
+            self.metrics["failures"] += 1
+            return True
+    
+    def results(self, query: str, count: int):
+        padding = "x" * self.snippet_bytes
+        return [
+            {
+                "title": f"{query} 相关文章{index}",
+                "url": f"https://example.com/{index}",
+                "snippet": f"关于{query}的第{index}条结果{padding}"
+            }
+            for index in range(1, count + 1)
+        ]
+    
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self.metrics)
+    
+    def start(self) -> "StubSearchServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="stub-search", daemon=True)
+        self._thread.start()
+        return self
+    
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+    
+    def __enter__(self) -> "StubSearchServer":
+        return self.start()
+    
+    def __exit__(self, *exc_info):
+        self.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description="本地搜索桩服务")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="监听地址")
+    parser.add_argument("--port", type=int, default=8765, help="监听端口")
+    parser.add_argument("--latency", type=float, default=0.0, help="每个请求的响应延迟（秒）")
+    parser.add_argument("--snippet_bytes", type=int, default=0, help="每条结果摘要的填充字节数")
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO)
+    server = StubSearchServer(args.host, args.port, args.latency, args.snippet_bytes)
+    logger.info(f"搜索桩服务: {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+工具schema与参数校验
+注册工具时从函数签名、类型注解和docstring生成function calling格式的schema，
+并预先编译参数校验函数，工具调用的参数在执行前校验，不合法时不进入工具函数。
+"""
+
+import inspect
+import typing
+from typing import Dict, Any, Callable, Optional, Tuple
+
+# Python类型到JSON Schema类型
+JSON_TYPES = {
+    str: "string",
+    int: "integer",
+    float: "number",
+    bool: "boolean",
+    list: "array",
+    dict: "object"
+}
+
+# JSON Schema类型对应的Python类型；bool是int的子类，单独排除
+PYTHON_TYPES = {
+    "string": (str,),
+    "integer": (int,),
+    "number": (int, float),
+    "boolean": (bool,),
+    "array": (list, tuple),
+    "object": (dict,)
+}
+
+TYPE_NAMES = {
+    "string": "字符串",
+    "integer": "整数",
+    "number": "数字",
+    "boolean": "布尔值",
+    "array": "数组",
+    "object": "对象"
+}
+
+class ToolArgumentError(ValueError):
+    """工具调用参数不符合schema"""
+
+def _json_type(annotation) -> Tuple[Optional[str], bool]:
+    """注解对应的JSON类型及是否允许None；无法映射的注解返回None，不做类型校验"""
+    nullable = False
+    origin = typing.get_origin(annotation)
+    if origin is typing.Union:
+        members = [arg for arg in typing.get_args(annotation) if arg is not type(None)]
+        nullable = len(members) < len(typing.get_args(annotation))
+        if len(members) != 1:
+            return None, nullable
+        annotation = members[0]
+        origin = typing.get_origin(annotation)
+    return JSON_TYPES.get(origin or annotation), nullable
+
+def parse_docstring(func: Callable) -> Tuple[str, Dict[str, str]]:
+    """docstring的第一行作为工具描述，Args段中的"参数名: 说明"作为参数描述"""
+    lines = inspect.cleandoc(func.__doc__ or "").splitlines()
+    description = lines[0].strip() if lines else ""
+    parameters = {}
+    in_args = False
+    for line in lines[1:]:
+        stripped = line.strip()
+        if stripped in ("Args:", "参数:"):
+            in_args = True
+        elif in_args and stripped.endswith(":") and not line.startswith(" "):
+            in_args = False
+        elif in_args and ":" in stripped:
+            name, text = stripped.split(":", 1)
+            parameters[name.strip()] = text.strip()
+    return description, parameters
+
+def build_tool_schema(name: str, func: Callable, description: Optional[str] = None) -> Dict[str, Any]:
+    """从函数签名生成工具schema；没有默认值的参数为必需参数，**kwargs允许额外参数"""
+    doc_description, parameter_descriptions = parse_docstring(func)
+    signature = inspect.signature(func)
+    try:
+        hints = typing.get_type_hints(func)
+    except Exception:
+        hints = {}
+    
+    properties = {}
+    required = []
+    additional = False
+    for parameter in signature.parameters.values():
+        if parameter.kind == inspect.Parameter.VAR_KEYWORD:
+            additional = True
+            continue
+        if parameter.kind in (inspect.Parameter.VAR_POSITIONAL, inspect.Parameter.POSITIONAL_ONLY):
+            continue
+        
+        json_type, nullable = _json_type(hints.get(parameter.name, parameter.annotation))
+        prop: Dict[str, Any] = {}
+        if json_type is not None:
+            prop["type"] = [json_type, "null"] if nullable else json_type
+        if parameter.name in parameter_descriptions:
+            prop["description"] = parameter_descriptions[parameter.name]
+        if parameter.default is inspect.Parameter.empty:
+            required.append(parameter.name)
+        elif parameter.default is None or isinstance(parameter.default, (str, int, float, bool)):
+            prop["default"] = parameter.default
+        properties[parameter.name] = prop
+    
+    parameters: Dict[str, Any] = {"type": "object", "properties": properties, "required": required}
+    if not additional:
+        parameters["additionalProperties"] = False
+    return {
+        "type": "function",
+        "function": {
+            "name": name,
+            "description": description or doc_description or name,
+            "parameters": parameters
+        }
+    }
+
+def compile_validator(schema: Dict[str, Any]) -> Callable[[Dict[str, Any]], None]:
+    """把schema的parameters编译为校验函数，参数不合法时抛出ToolArgumentError"""
+    parameters = schema["function"]["parameters"]
+    required = frozenset(parameters["required"])
+    allowed = None if parameters.get("additionalProperties", True) else frozenset(parameters["properties"])
+    
+    checks = []
+    for name, prop in parameters["properties"].items():
+        json_type = prop.get("type")
+        if json_type is None:
+            continue
+        nullable = isinstance(json_type, list)
+        json_type = json_type[0] if nullable else json_type
+        checks.append((name, PYTHON_TYPES[json_type], json_type in ("integer", "number"), nullable,
+                       f"参数 {name} 应为{TYPE_NAMES[json_type]}"))
+    checks = tuple(checks)
+    
+    def validate(arguments: Dict[str, Any]):
+        if not isinstance(arguments, dict):
+            raise ToolArgumentError("参数必须是JSON对象")
+        missing = required.difference(arguments)
+        if missing:
+            raise ToolArgumentError(f"缺少必需参数: {', '.join(sorted(missing))}")
+        if allowed is not None:
+            unknown = arguments.keys() - allowed
+            if unknown:
+                raise ToolArgumentError(f"未知参数: {', '.join(sorted(unknown))}")
+        for name, types, numeric, nullable, message in checks:
+            if name not in arguments:
+                continue
+            value = arguments[name]
+            if value is None and nullable:
+                continue
+            if not isinstance(value, types) or (numeric and isinstance(value, bool)):
+                raise ToolArgumentError(message)
+    
+    return validate
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+推理后端基准测试
+比较torch、ONNX Runtime以及ONNX Runtime int8量化后端在CPU上的生成速度。
+未指定模型时使用本地随机初始化的小模型，无需下载。
+"""
+
+import os
+import sys
+import json
+import logging
+import argparse
+import tempfile
+from typing import Dict, Any, List
+
+import torch
+
+# 添加父目录到路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from scripts.inference import MCPInference
+from scripts.benchmark_compile import build_tiny_model
+
+logger = logging.getLogger(__name__)
+
+def create_tiny_model_dir(output_dir: str, vocab_size: int = 512, **model_kwargs) -> str:
+    """保存随机初始化的小模型和配套的词级分词器，供各后端加载"""
+    from tokenizers import Tokenizer, models, pre_tokenizers
+    from transformers import PreTrainedTokenizerFast
+    
+    model = build_tiny_model(vocab_size=vocab_size, **model_kwargs)
+    model.save_pretrained(output_dir, safe_serialization=True)
+    
+    vocab = {"<pad>": 0, "<s>": 1, "</s>": 2}
+    vocab.update({f"w{index}": index for index in range(3, vocab_size)})
+    word_level = Tokenizer(models.WordLevel(vocab, unk_token="<pad>"))
+    word_level.pre_tokenizer = pre_tokenizers.Whitespace()
+    tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=word_level, pad_token="<pad>", bos_token="<s>", eos_token="</s>"
+    )
+    tokenizer.save_pretrained(output_dir)
+    return output_dir
+
+def random_prompts(vocab_size: int, prompt_length: int, count: int, seed: int = 0) -> List[torch.Tensor]:
+    """生成随机提示token"""
+    generator = torch.Generator().manual_seed(seed)
+    return [torch.randint(3, vocab_size, (1, prompt_length), generator=generator) for _ in range(count)]
+
+def generate_greedy(inference: MCPInference, prompt_ids: torch.Tensor, max_new_tokens: int) -> Dict[str, Any]:
+    """贪心生成，返回新token与统计"""
+    stats: Dict[str, Any] = {}
+    new_ids = inference._generate_ids(
+        prompt_ids, torch.ones_like(prompt_ids),
+        max_new_tokens=max_new_tokens, temperature=0, stats=stats
+    )
+    return {"ids": new_ids.tolist(), **stats}
+
+def benchmark_backend(inference: MCPInference, prompts: List[torch.Tensor], max_new_tokens: int) -> Dict[str, Any]:
+    """预热一次后按生成token总数与总耗时计算tokens/s"""
+    generate_greedy(inference, prompts[0], max_new_tokens)
+    
+    generated_tokens = 0
+    elapsed = 0.0
+    outputs = []
+    for prompt_ids in prompts:
+        result = generate_greedy(inference, prompt_ids, max_new_tokens)
+        generated_tokens += result["generated_tokens"]
+        elapsed += result["elapsed"]
+        outputs.append(result["ids"])
+    
+    return {
+        "tokens_per_second": round(generated_tokens / elapsed, 2),
+        "generated_tokens": generated_tokens,
+        "outputs": outputs
+    }
+
+def token_agreement(reference: List[List[int]], candidate: List[List[int]]) -> float:
+    """逐位置比较生成的token，返回一致比例"""
+    matched = total = 0
+    for expected, actual in zip(reference, candidate):
+        total += max(len(expected), len(actual))
+        matched += sum(1 for a, b in zip(expected, actual) if a == b)
+    return matched / total if total else 1.0
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    
+    parser = argparse.ArgumentParser(description="torch与ONNX Runtime后端的CPU生成速度对比")
+    parser.add_argument("--model_path", type=str, help="模型路径，默认使用随机初始化的小模型")
+    parser.add_argument("--base_model", type=str, help="基础模型名称（LoRA模型需要）")
+    parser.add_argument("--backends", type=str, default="torch,onnx,onnx-int8", help="逗号分隔的后端列表")
+    parser.add_argument("--prompt-length", type=int, default=64, help="提示token数")
+    parser.add_argument("--max-new-tokens", type=int, default=64, help="每次生成的token数")
+    parser.add_argument("--repeats", type=int, default=5, help="计时的提示数")
+    parser.add_argument("--threads", type=int, default=None, help="torch与ONNX Runtime线程数")
+    parser.add_argument("--output", type=str, help="结果JSON输出路径")
+    
+    args = parser.parse_args()
+    
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    
+    temp_dir = None
+    model_path = args.model_path
+    if not model_path:
+        temp_dir = tempfile.TemporaryDirectory()
+        model_path = create_tiny_model_dir(temp_dir.name)
+    
+    results = {}
+    reference = None
+    for name in args.backends.split(","):
+        backend, _, variant = name.strip().partition("-")
+        options = {"quantize": True} if variant == "int8" else {}
+        if backend == "onnx" and args.threads:
+            options["num_threads"] = args.threads
+        
+        inference = MCPInference(model_path, args.base_model, backend=backend, backend_options=options)
+        vocab_size = inference.backend.config.vocab_size
+        prompts = random_prompts(vocab_size, args.prompt_length, args.repeats)
+        result = benchmark_backend(inference, prompts, args.max_new_tokens)
+        
+        outputs = result.pop("outputs")
+        if reference is None:
+            reference = outputs
+        result["token_agreement"] = round(token_agreement(reference, outputs), 4)
+        results[name] = result
+    
+    print(f"{'后端':<12} {'tokens/s':>10} {'相对速度':>10} {'token一致率':>12}")
+    baseline = next(iter(results.values()))["tokens_per_second"]
+    for name, result in results.items():
+        print(f"{name:<12} {result['tokens_per_second']:>10} "
+              f"{result['tokens_per_second'] / baseline:>9.2f}x {result['token_agreement']:>12}")
+    
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    
+    if temp_dir is not None:
+        temp_dir.cleanup()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+编译推理基准测试
+在本地随机初始化的小模型上比较eager与编译解码步在CPU上的生成速度（tokens/s），
+无需下载模型。第二次运行时可观察编译缓存对首次调用耗时的影响。
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+from typing import Dict, Any, List
+
+import torch
+from transformers import LlamaConfig, LlamaForCausalLM
+
+# 添加父目录到路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from scripts.compiled_inference import CompiledGenerator
+
+logger = logging.getLogger(__name__)
+
+def build_tiny_model(vocab_size: int = 2048, hidden_size: int = 256, num_layers: int = 4,
+                     num_heads: int = 4, num_kv_heads: int = 2, seed: int = 0) -> LlamaForCausalLM:
+    """创建随机初始化的小型Llama模型"""
+    torch.manual_seed(seed)
+    config = LlamaConfig(
+        vocab_size=vocab_size,
+        hidden_size=hidden_size,
+        intermediate_size=hidden_size * 4,
+        num_hidden_layers=num_layers,
+        num_attention_heads=num_heads,
+        num_key_value_heads=num_kv_heads,
+        max_position_embeddings=4096,
+        pad_token_id=0,
+        bos_token_id=1,
+        eos_token_id=2
+    )
+    return LlamaForCausalLM(config).eval()
+
+def run_generate(model, inputs: Dict[str, torch.Tensor], generate_kwargs: Dict[str, Any],
+                 stopping_criteria: List, pad_token_id: int) -> int:
+    """贪心生成一次，返回生成的token数"""
+    with torch.no_grad():
+        outputs = model.generate(
+            **inputs,
+            **generate_kwargs,
+            do_sample=False,
+            # 关闭EOS提前停止，保证每次生成相同数量的token
+            eos_token_id=None,
+            pad_token_id=pad_token_id,
+            stopping_criteria=stopping_criteria
+        )
+    return outputs.shape[-1] - inputs["input_ids"].shape[-1]
+
+def benchmark(model, prompt_ids: torch.Tensor, max_new_tokens: int, repeats: int,
+              generator: CompiledGenerator = None) -> Dict[str, Any]:
+    """测量首次调用耗时与稳定后的生成速度"""
+    inputs = {"input_ids": prompt_ids, "attention_mask": torch.ones_like(prompt_ids)}
+    generate_kwargs = {"max_new_tokens": max_new_tokens}
+    criteria = []
+    if generator is not None:
+        inputs, generate_kwargs, budget = generator.prepare(inputs, max_new_tokens)
+        criteria.append(budget)
+    
+    start_time = time.perf_counter()
+    run_generate(model, inputs, generate_kwargs, criteria, model.config.pad_token_id)
+    first_call = time.perf_counter() - start_time
+    
+    total_tokens = 0
+    start_time = time.perf_counter()
+    for _ in range(repeats):
+        total_tokens += run_generate(model, inputs, generate_kwargs, criteria, model.config.pad_token_id)
+    elapsed = time.perf_counter() - start_time
+    
+    return {
+        "first_call_seconds": round(first_call, 3),
+        "tokens_per_second": round(total_tokens / elapsed, 2),
+        "generated_tokens": total_tokens // repeats
+    }
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    
+    parser = argparse.ArgumentParser(description="eager与编译解码步的CPU生成速度对比")
+    parser.add_argument("--prompt-length", type=int, default=100, help="提示token数")
+    parser.add_argument("--max-new-tokens", type=int, default=64, help="每次生成的token数")
+    parser.add_argument("--repeats", type=int, default=5, help="计时的生成次数")
+    parser.add_argument("--threads", type=int, default=None, help="torch线程数")
+    parser.add_argument("--hidden-size", type=int, default=256, help="模型隐藏层大小")
+    parser.add_argument("--num-layers", type=int, default=4, help="模型层数")
+    parser.add_argument("--cache-dir", type=str, default="./cache/torch_compile_benchmark", help="编译产物缓存目录")
+    parser.add_argument("--mode", type=str, default="default", help="torch.compile模式")
+    parser.add_argument("--output", type=str, help="结果JSON输出路径")
+    
+    args = parser.parse_args()
+    
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    
+    model = build_tiny_model(hidden_size=args.hidden_size, num_layers=args.num_layers)
+    prompt_ids = torch.randint(3, model.config.vocab_size, (1, args.prompt_length))
+    
+    print(f"模型: {args.num_layers}层, 隐藏层 {args.hidden_size}, 提示 {args.prompt_length} tokens, "
+          f"生成 {args.max_new_tokens} tokens, 线程 {torch.get_num_threads()}")
+    
+    eager = benchmark(model, prompt_ids, args.max_new_tokens, args.repeats)
+    
+    generator = CompiledGenerator(
+        model,
+        model.config.pad_token_id,
+        cache_dir=args.cache_dir,
+        mode=args.mode,
+        prompt_buckets=[bucket for bucket in (128, 256, 512) if bucket >= args.prompt_length] or None,
+        new_token_buckets=[max(args.max_new_tokens, 64)]
+    )
+    compiled = benchmark(model, prompt_ids, args.max_new_tokens, args.repeats, generator)
+    generator.save_artifacts()
+    
+    results = {
+        "eager": eager,
+        "compiled": compiled,
+        "speedup": round(compiled["tokens_per_second"] / eager["tokens_per_second"], 2),
+        "artifacts_loaded": generator.metrics["artifacts_loaded"],
+        "torch_version": torch.__version__
+    }
+    
+    print(f"{'模式':<10} {'首次调用(s)':>12} {'tokens/s':>12}")
+    for name in ("eager", "compiled"):
+        print(f"{name:<10} {results[name]['first_call_seconds']:>12} {results[name]['tokens_per_second']:>12}")
+    print(f"加速比: {results['speedup']}x (编译缓存{'已命中' if results['artifacts_loaded'] else '未命中'})")
+    
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MCP服务端负载测试
+stdio：启动 examples/mcp_server.py 子进程，在同一连接上分别以窗口1（逐个等待响应）和窗口W（流水线）发送tools/call；
+http：对运行中的Streamable HTTP端点（如 http://127.0.0.1:8000/mcp）并发发送单个调用和批量调用。
+输出每秒调用数与延迟分位数。
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List
+
+logger = logging.getLogger(__name__)
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "examples", "mcp_server.py")
+
+def summarize(latencies: List[float], calls: int, elapsed: float) -> Dict[str, float]:
+    latencies = sorted(latencies)
+    return {
+        "calls_per_second": round(calls / elapsed, 1),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 3),
+        "p99_ms": round(latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)] * 1000, 3)
+    }
+
+def call_message(request_id: int, tool: str, arguments: Dict[str, Any]) -> bytes:
+    return json.dumps({
+        "jsonrpc": "2.0", "id": request_id, "method": "tools/call",
+        "params": {"name": tool, "arguments": arguments}
+    }, ensure_ascii=False).encode("utf-8")
+
+async def benchmark_stdio(calls: int, windows: List[int], tool: str, arguments: Dict[str, Any]) -> Dict[str, Any]:
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, SERVER_SCRIPT, "--transport", "stdio", "--max_in_flight", str(max(windows)),
+        stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL
+    )
+    process.stdin.write(json.dumps({"jsonrpc": "2.0", "id": 0, "method": "initialize",
+                                    "params": {"protocolVersion": "2025-03-26"}}).encode("utf-8") + b"\n")
+    await process.stdout.readline()
+    process.stdin.write(b'{"jsonrpc": "2.0", "method": "notifications/initialized"}\n')
+    
+    results = {}
+    next_id = 1
+    for window in windows:
+        sent_at: Dict[int, float] = {}
+        latencies: List[float] = []
+        slots = asyncio.Semaphore(window)
+        
+        async def receive():
+            for _ in range(calls):
+                response = json.loads(await process.stdout.readline())
+                latencies.append(time.perf_counter() - sent_at.pop(response["id"]))
+                if response.get("error") or response["result"]["isError"]:
+                    raise RuntimeError(f"工具调用失败: {response}")
+                slots.release()
+        
+        receiver = asyncio.ensure_future(receive())
+        start = time.perf_counter()
+        for request_id in range(next_id, next_id + calls):
+            await slots.acquire()
+            sent_at[request_id] = time.perf_counter()
+            process.stdin.write(call_message(request_id, tool, arguments) + b"\n")
+            await process.stdin.drain()
+        await receiver
+        results[f"window_{window}"] = summarize(latencies, calls, time.perf_counter() - start)
+        next_id += calls
+    
+    process.stdin.close()
+    await process.wait()
+    return results
+
+def benchmark_http(url: str, calls: int, concurrency: int, batch_size: int, tool: str,
+                   arguments: Dict[str, Any]) -> Dict[str, Any]:
+    import requests
+    
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=concurrency)
+    session.mount("http://", adapter)
+    headers = {"Content-Type": "application/json", "Accept": "application/json"}
+    initialized = session.post(url, headers=headers, data=json.dumps({
+        "jsonrpc": "2.0", "id": 0, "method": "initialize", "params": {"protocolVersion": "2025-03-26"}
+    }))
+    initialized.raise_for_status()
+    session_id = initialized.headers.get("Mcp-Session-Id")
+    if session_id:
+        headers["Mcp-Session-Id"] = session_id
+    
+    results = {}
+    for size in sorted({1, batch_size}):
+        latencies: List[float] = []
+        
+        def post(first_id: int):
+            messages = [call_message(first_id + offset, tool, arguments) for offset in range(size)]
+            body = messages[0] if size == 1 else b"[" + b",".join(messages) + b"]"
+            start = time.perf_counter()
+            response = session.post(url, headers=headers, data=body)
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+        
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(post, range(1, calls + 1, size)))
+        results[f"batch_{size}"] = summarize(latencies, len(latencies) * size, time.perf_counter() - start)
+    session.close()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="MCP服务端负载测试")
+    parser.add_argument("--transport", type=str, default="stdio", choices=["stdio", "http"], help="传输方式")
+    parser.add_argument("--url", type=str, default="http://127.0.0.1:8000/mcp", help="Streamable HTTP端点")
+    parser.add_argument("--calls", type=int, default=5000, help="每轮的工具调用数")
+    parser.add_argument("--window", type=int, default=32, help="stdio流水线中未完成的调用数")
+    parser.add_argument("--concurrency", type=int, default=8, help="HTTP并发连接数")
+    parser.add_argument("--batch_size", type=int, default=32, help="HTTP批量请求中的调用数")
+    parser.add_argument("--tool", type=str, default="calculate", help="调用的工具")
+    parser.add_argument("--arguments", type=str, default='{"expression": "2 + 3 * 4"}', help="工具参数（JSON）")
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO)
+    arguments = json.loads(args.arguments)
+    if args.transport == "stdio":
+        results = asyncio.run(benchmark_stdio(args.calls, [1, args.window], args.tool, arguments))
+    else:
+        results = benchmark_http(args.url, args.calls, args.concurrency, args.batch_size, args.tool, arguments)
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+if __name__ == "__main__":
+    main()
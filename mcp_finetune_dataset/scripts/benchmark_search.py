@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+web_search后端基准测试
+对本地搜索桩服务并发发送搜索请求，比较每次调用新建连接与HTTPSearchBackend连接池的吞吐、延迟和建立的连接数。
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Callable, List
+
+import requests
+
+# 添加父目录到路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from examples.search_backends import HTTPSearchBackend
+from examples.stub_search_server import StubSearchServer
+
+logger = logging.getLogger(__name__)
+
+def run_load(search: Callable[[str], Any], requests_count: int, concurrency: int) -> Dict[str, float]:
+    """并发执行requests_count次搜索，返回吞吐与延迟分位数"""
+    latencies: List[float] = []
+    
+    def timed(index: int):
+        start = time.perf_counter()
+        search(f"query {index}")
+        latencies.append(time.perf_counter() - start)
+    
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(timed, range(requests_count)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "requests_per_second": round(requests_count / elapsed, 1),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+        "p99_ms": round(latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)] * 1000, 2)
+    }
+
+def benchmark(requests_count: int, concurrency: int, latency: float) -> Dict[str, Any]:
+    results = {}
+    with StubSearchServer(latency=latency) as server:
+        def per_call(query: str):
+            response = requests.get(server.url, params={"q": query, "count": 3}, timeout=5)
+            response.raise_for_status()
+            return response.json()
+        
+        before = server.snapshot()["connections"]
+        results["per_call"] = run_load(per_call, requests_count, concurrency)
+        results["per_call"]["connections"] = server.snapshot()["connections"] - before
+        
+        backend = HTTPSearchBackend(server.url, max_connections=concurrency, max_concurrency=concurrency)
+        before = server.snapshot()["connections"]
+        results["pooled"] = run_load(backend.search, requests_count, concurrency)
+        results["pooled"]["connections"] = server.snapshot()["connections"] - before
+        backend.close()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="web_search后端基准测试")
+    parser.add_argument("--requests", type=int, default=2000, help="搜索请求数")
+    parser.add_argument("--concurrency", type=int, default=8, help="并发数")
+    parser.add_argument("--latency", type=float, default=0.0, help="桩服务的响应延迟（秒）")
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO)
+    results = benchmark(args.requests, args.concurrency, args.latency)
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+编译推理路径
+使用静态KV缓存和torch.compile编译解码步，降低批大小为1时每个解码步的框架开销。
+提示长度按桶对齐，使编译后的图可以复用；编译产物缓存在磁盘上，重启后无需重新编译。
+"""
+
+import os
+import time
+import bisect
+import logging
+from typing import Dict, Any, List, Optional, Sequence, Tuple
+
+import torch
+from transformers import StoppingCriteria
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = "./cache/torch_compile"
+DEFAULT_PROMPT_BUCKETS = [256, 512, 1024, 2048]
+DEFAULT_NEW_TOKEN_BUCKETS = [128, 512, 2048]
+
+# torch.compiler可移植缓存（mega-cache）文件名
+ARTIFACTS_FILENAME = "compile_artifacts.bin"
+
+def bucket_length(length: int, buckets: Sequence[int]) -> int:
+    """向上取整到最近的桶；超过最大桶时按最大桶的整数倍取整"""
+    index = bisect.bisect_left(buckets, length)
+    if index < len(buckets):
+        return buckets[index]
+    largest = buckets[-1]
+    return -(-length // largest) * largest
+
+def configure_compile_cache(cache_dir: str):
+    """开启Inductor的FX图缓存并将缓存目录指向cache_dir
+    
+    需在首次编译前调用。
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", os.path.join(cache_dir, "inductor"))
+    os.environ.setdefault("TORCHINDUCTOR_FX_GRAPH_CACHE", "1")
+    os.environ.setdefault("TORCHINDUCTOR_AUTOGRAD_CACHE", "1")
+    
+    import torch._inductor.config as inductor_config
+    inductor_config.fx_graph_cache = True
+
+class TokenBudgetStoppingCriteria(StoppingCriteria):
+    """生成token数达到实际请求上限时停止
+    
+    静态缓存按桶分配，generate的max_new_tokens取桶大小，由此条件按请求的真实上限截止。
+    """
+    
+    def __init__(self, prompt_length: int, max_new_tokens: int):
+        self.prompt_length = prompt_length
+        self.max_new_tokens = max_new_tokens
+    
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        done = input_ids.shape[-1] - self.prompt_length >= self.max_new_tokens
+        return torch.full((input_ids.shape[0],), done, dtype=torch.bool, device=input_ids.device)
+
+class CompiledGenerator:
+    """静态KV缓存 + 编译解码步
+    
+    预填充阶段按eager执行，只有单token的解码步走编译后的forward。提示左填充到
+    提示长度桶，max_new_tokens取生成长度桶，静态缓存的长度因此只有有限几种，
+    每种对应一张编译图。
+    """
+    
+    def __init__(self, model, pad_token_id: int, cache_dir: str = DEFAULT_CACHE_DIR,
+                 mode: str = "default",
+                 prompt_buckets: Optional[List[int]] = None,
+                 new_token_buckets: Optional[List[int]] = None):
+        self.model = model
+        self.pad_token_id = pad_token_id
+        self.cache_dir = cache_dir
+        self.mode = mode
+        self.prompt_buckets = sorted(prompt_buckets or DEFAULT_PROMPT_BUCKETS)
+        self.new_token_buckets = sorted(new_token_buckets or DEFAULT_NEW_TOKEN_BUCKETS)
+        self.artifacts_path = os.path.join(cache_dir, ARTIFACTS_FILENAME)
+        self.metrics = {
+            "artifacts_loaded": False,
+            "warmup_seconds": None,
+            "compiled_calls": 0
+        }
+        
+        configure_compile_cache(cache_dir)
+        self._raise_recompile_limit()
+        self.load_artifacts()
+        self._compile_decode_step()
+    
+    def _raise_recompile_limit(self):
+        """每种静态缓存长度对应一张图，重编译上限需覆盖所有桶组合"""
+        import torch._dynamo.config as dynamo_config
+        
+        needed = len(self.prompt_buckets) * len(self.new_token_buckets) + 2
+        for name in ("recompile_limit", "cache_size_limit"):
+            if hasattr(dynamo_config, name):
+                setattr(dynamo_config, name, max(getattr(dynamo_config, name), needed))
+                break
+    
+    def _compile_decode_step(self):
+        """替换模型forward：解码步走编译版本，预填充保持eager"""
+        # PeftModel的generate最终调用底层模型，LoRA层已注入底层模块
+        target = self.model.get_base_model() if hasattr(self.model, "get_base_model") else self.model
+        eager_forward = target.forward
+        compiled_forward = torch.compile(eager_forward, mode=self.mode, dynamic=False)
+        metrics = self.metrics
+        
+        def forward(*args, **kwargs):
+            input_ids = kwargs.get("input_ids", args[0] if args else None)
+            if input_ids is not None and input_ids.shape[-1] == 1:
+                metrics["compiled_calls"] += 1
+                return compiled_forward(*args, **kwargs)
+            return eager_forward(*args, **kwargs)
+        
+        target.forward = forward
+        logger.info(f"已编译解码步 (mode={self.mode})，提示长度桶: {self.prompt_buckets}，"
+                    f"生成长度桶: {self.new_token_buckets}")
+    
+    def prepare(self, inputs: Dict[str, torch.Tensor], max_new_tokens: int
+                ) -> Tuple[Dict[str, torch.Tensor], Dict[str, Any], TokenBudgetStoppingCriteria]:
+        """将输入左填充到提示长度桶，返回generate参数和token预算停止条件"""
+        input_ids = inputs["input_ids"]
+        attention_mask = inputs["attention_mask"]
+        prompt_length = input_ids.shape[-1]
+        padded_length = bucket_length(prompt_length, self.prompt_buckets)
+        
+        pad = padded_length - prompt_length
+        if pad:
+            input_ids = torch.nn.functional.pad(input_ids, (pad, 0), value=self.pad_token_id)
+            attention_mask = torch.nn.functional.pad(attention_mask, (pad, 0), value=0)
+        
+        generate_kwargs = {
+            "max_new_tokens": bucket_length(max_new_tokens, self.new_token_buckets),
+            "cache_implementation": "static"
+        }
+        budget = TokenBudgetStoppingCriteria(padded_length, max_new_tokens)
+        return {"input_ids": input_ids, "attention_mask": attention_mask}, generate_kwargs, budget
+    
+    def warmup(self, prompt_lengths: Optional[List[int]] = None, max_new_tokens: Optional[List[int]] = None):
+        """按桶组合各生成一次以触发编译，完成后保存编译产物"""
+        device = next(self.model.parameters()).device
+        start_time = time.perf_counter()
+        
+        for prompt_bucket in prompt_lengths or self.prompt_buckets:
+            for new_bucket in max_new_tokens or self.new_token_buckets:
+                input_ids = torch.full((1, prompt_bucket), self.pad_token_id, dtype=torch.long, device=device)
+                inputs, generate_kwargs, _ = self.prepare(
+                    {"input_ids": input_ids, "attention_mask": torch.ones_like(input_ids)}, new_bucket
+                )
+                # 只需生成两个token即可编译该缓存长度下的解码步
+                budget = TokenBudgetStoppingCriteria(inputs["input_ids"].shape[-1], 2)
+                with torch.no_grad():
+                    self.model.generate(
+                        **inputs,
+                        **generate_kwargs,
+                        do_sample=False,
+                        pad_token_id=self.pad_token_id,
+                        stopping_criteria=[budget]
+                    )
+        
+        self.metrics["warmup_seconds"] = time.perf_counter() - start_time
+        logger.info(f"编译预热完成，耗时 {self.metrics['warmup_seconds']:.1f}s")
+        self.save_artifacts()
+    
+    def load_artifacts(self) -> bool:
+        """加载上次保存的可移植编译缓存"""
+        if not os.path.exists(self.artifacts_path) or not hasattr(torch.compiler, "load_cache_artifacts"):
+            return False
+        try:
+            with open(self.artifacts_path, "rb") as f:
+                torch.compiler.load_cache_artifacts(f.read())
+            self.metrics["artifacts_loaded"] = True
+            logger.info(f"已加载编译缓存: {self.artifacts_path}")
+            return True
+        except Exception as e:
+            # 缓存与当前torch版本不兼容时重新编译
+            logger.warning(f"编译缓存加载失败，将重新编译: {e}")
+            return False
+    
+    def save_artifacts(self) -> bool:
+        """保存可移植编译缓存，供重启后加载"""
+        if not hasattr(torch.compiler, "save_cache_artifacts"):
+            return False
+        artifacts = torch.compiler.save_cache_artifacts()
+        if artifacts is None:
+            return False
+        with open(self.artifacts_path, "wb") as f:
+            f.write(artifacts[0])
+        logger.info(f"编译缓存已保存: {self.artifacts_path}")
+        return True
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """获取编译路径状态"""
+        return {
+            "mode": self.mode,
+            "cache_dir": self.cache_dir,
+            "prompt_buckets": self.prompt_buckets,
+            "new_token_buckets": self.new_token_buckets,
+            **self.metrics
+        }
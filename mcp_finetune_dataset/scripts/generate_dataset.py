@@ -8,7 +8,7 @@ import json
 import random
 import sys
 import os
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 
 # 添加父目录到路径
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -23,10 +23,10 @@ class MCPDatasetGenerator:
         # 定义各种用户请求模板
         self.request_templates = {
             "web_search": [
-                "请帮我搜索关于{topic}的信息",
-                "我想了解{topic}的最新动态",
-                "搜索一下{topic}相关内容",
-                "查找{topic}的资料"
+                "请帮我搜索关于{query}的信息",
+                "我想了解{query}的最新动态",
+                "搜索一下{query}相关内容",
+                "查找{query}的资料"
             ],
             "get_weather": [
                 "请帮我查看{city}的天气",
@@ -63,8 +63,9 @@ class MCPDatasetGenerator:
             "expressions": ["125 * 37", "256 + 128", "1024 / 8", "15 * 15", "100 - 25"]
         }
     
-    def generate_conversation(self, tool_name: str, params: Dict[str, Any]) -> Dict[str, Any]:
-        """生成单个对话样本"""
+    def generate_conversation(self, tool_name: str, params: Dict[str, Any],
+                              tool_result: Optional[str] = None) -> Dict[str, Any]:
+        """生成单个对话样本，tool_result为空时执行工具获取结果"""
         
         # 生成用户请求
         template = random.choice(self.request_templates[tool_name])
@@ -84,7 +85,8 @@ class MCPDatasetGenerator:
         }
         
         # 执行工具获取结果
-        tool_result = tool_registry.execute_tool(tool_name, **params)
+        if tool_result is None:
+            tool_result = tool_registry.execute_tool(tool_name, **params)
         
         # 生成最终助手响应
         final_response = self._generate_final_response(tool_name, params, tool_result)
@@ -131,19 +133,8 @@ class MCPDatasetGenerator:
         return descriptions.get(tool_name, "处理您的请求")
     
     def _generate_final_response(self, tool_name: str, params: Dict[str, Any], tool_result: str) -> str:
-        """生成最终响应"""
-        if tool_name == "web_search":
-            return f"根据搜索结果，我为您找到了关于{params['query']}的相关信息：\n\n{tool_result}\n\n希望这些信息对您有帮助！"
-        elif tool_name == "get_weather":
-            return f"{params['city']}的天气信息如下：\n\n{tool_result}\n\n请根据天气情况合理安排出行。"
-        elif tool_name == "list_files":
-            return f"{params['path']}目录的内容：\n\n{tool_result}\n\n您需要对哪个文件进行操作吗？"
-        elif tool_name == "write_file":
-            return f"✅ 文件创建成功！\n\n📄 **文件名**：{params['filename']}\n📝 **内容**：{params['content']}\n\n文件已保存在当前目录中。"
-        elif tool_name == "calculate":
-            return f"🧮 **计算结果**：\n\n{tool_result}\n\n计算完成！"
-        else:
-            return f"操作完成：\n\n{tool_result}"
+        """生成最终响应，使用工具注册表的回答模板，与推理时的模板回答保持一致"""
+        return tool_registry.format_answer(tool_name, params, tool_result)
     
     def generate_dataset(self, num_samples: int = 100) -> List[Dict[str, Any]]:
         """生成完整数据集"""
@@ -160,11 +151,18 @@ class MCPDatasetGenerator:
             ("calculate", lambda: {"expression": random.choice(self.example_data["expressions"])})
         ]
         
+        samples = []
         for i in range(num_samples):
             tool_name, param_generator = random.choice(tools_and_params)
-            params = param_generator()
-            
-            conversation = self.generate_conversation(tool_name, params)
+            samples.append((tool_name, param_generator()))
+        
+        # calculate样本的结果批量计算
+        expressions = [params["expression"] for tool_name, params in samples if tool_name == "calculate"]
+        calculations = iter(tool_registry.calculate_batch(expressions))
+        
+        for tool_name, params in samples:
+            tool_result = next(calculations) if tool_name == "calculate" else None
+            conversation = self.generate_conversation(tool_name, params, tool_result)
             dataset.append(conversation)
         
         return dataset
@@ -6,90 +6,320 @@ MCP模型推理脚本
 """
 
 import json
+import time
+import asyncio
+import importlib
 import torch
 import yaml
-from transformers import AutoTokenizer, AutoModelForCausalLM
+from transformers import AutoTokenizer, AutoModelForCausalLM, StoppingCriteria, StoppingCriteriaList
 from peft import PeftModel
 import logging
 from typing import Dict, Any, List, Optional
 import sys
 import os
+import threading
+from abc import ABC, abstractmethod
 
 # 添加父目录到路径
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from examples.mcp_tools import tool_registry
+from scripts.kv_cache_estimator import KVCacheEstimator
+from scripts.shared_weights import load_model_shared, has_safetensors
+from scripts.compiled_inference import CompiledGenerator
+from scripts.low_memory_loading import build_load_kwargs, placement_report, log_placement_report
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+DEFAULT_SYSTEM_PROMPT = "你是一个能够正确调用MCP工具的AI助手。当用户需要获取信息或执行操作时，你应该选择合适的MCP工具并正确调用。"
+
+# 工具选择打分的默认候选续写，与训练数据中工具调用的格式一致
+TOOL_CALL_CANDIDATE = "<|tool_call|>\n{name}("
+
+def expand_past_key_values(past_key_values, batch_size: int):
+    """将批大小为1的KV缓存扩展到batch_size，各行共享同一份提示缓存"""
+    if hasattr(past_key_values, "batch_repeat_interleave"):
+        past_key_values.batch_repeat_interleave(batch_size)
+        return past_key_values
+    # 旧版元组格式：expand不复制内存
+    return tuple(
+        tuple(tensor.expand(batch_size, *tensor.shape[1:]) for tensor in layer)
+        for layer in past_key_values
+    )
+
+class CancellationStoppingCriteria(StoppingCriteria):
+    """取消令牌停止条件
+    
+    每个解码步检查一次取消事件，客户端断开后在下一个解码步终止生成。
+    """
+    
+    def __init__(self, cancel_event: threading.Event, prompt_length: int):
+        self.cancel_event = cancel_event
+        self.prompt_length = prompt_length
+        self.cancelled = False
+        self.generated_tokens = 0
+    
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        self.generated_tokens = input_ids.shape[-1] - self.prompt_length
+        if self.cancel_event.is_set():
+            self.cancelled = True
+        return torch.full((input_ids.shape[0],), self.cancelled, dtype=torch.bool, device=input_ids.device)
+
+class InferenceBackend(ABC):
+    """推理后端接口
+    
+    后端负责加载模型和分词器，并提供与transformers的generate一致的生成接口；
+    提示编码、取消、统计和工具调用由MCPInference在后端之上完成。
+    """
+    
+    name = None
+    # 是否支持torch.compile编译路径
+    supports_compile = False
+    
+    def __init__(self, model_path: str, base_model_name: Optional[str] = None, **options):
+        self.model_path = model_path
+        self.base_model_name = base_model_name
+        self.options = options
+        self.model = None
+        self.tokenizer = None
+    
+    @abstractmethod
+    def load(self):
+        """加载模型和分词器，设置self.model与self.tokenizer"""
+    
+    @property
+    def config(self):
+        """模型配置"""
+        return self.model.config
+    
+    @property
+    def dtype(self) -> torch.dtype:
+        """KV缓存的数据类型"""
+        return self.model.dtype
+    
+    @property
+    def device(self) -> torch.device:
+        """输入张量所在的设备"""
+        return self.model.device
+    
+    def generate(self, **kwargs) -> torch.Tensor:
+        """生成，参数与返回值同transformers的generate"""
+        return self.model.generate(**kwargs)
+    
+    def forward(self, **kwargs):
+        """单次前向计算，返回带logits与past_key_values的模型输出"""
+        return self.model(**kwargs)
+    
+    def describe(self) -> Dict[str, Any]:
+        """后端信息"""
+        return {"backend": self.name}
+    
+    @staticmethod
+    def resolve_base_model(model_path: str, base_model_name: Optional[str]) -> Optional[str]:
+        """LoRA模型返回适配器配置中的基础模型名称，完整模型返回None"""
+        adapter_config_path = os.path.join(model_path, "adapter_config.json")
+        if not os.path.exists(adapter_config_path):
+            return None
+        
+        with open(adapter_config_path, 'r') as f:
+            adapter_config = json.load(f)
+            base_model = adapter_config.get('base_model_name_or_path', base_model_name)
+        
+        if not base_model:
+            raise ValueError("无法确定基础模型名称，请提供base_model_name参数")
+        return base_model
+
+class TorchBackend(InferenceBackend):
+    """transformers/PEFT后端
+    
+    选项:
+        shared_weights: 内存映射safetensors权重
+        cpu_dtype: CPU上的权重数据类型，如bfloat16，默认float32
+        max_memory_mb: CPU内存预算，超出部分的层卸载到磁盘
+        offload_folder: 磁盘卸载目录
+    """
+    
+    name = "torch"
+    
+    def load(self):
+        shared_weights = self.options.get("shared_weights", False)
+        base_model = self.resolve_base_model(self.model_path, self.base_model_name)
+        is_lora_model = base_model is not None
+        
+        if shared_weights and is_lora_model:
+            logger.warning("共享权重模式需要合并后的完整模型，LoRA模型将按常规方式加载。"
+                           "可使用 scripts/shared_weights.py --export-merged 导出合并模型")
+        
+        if shared_weights and not is_lora_model and has_safetensors(self.model_path):
+            logger.info("以共享权重模式加载完整微调模型")
+            self.tokenizer = AutoTokenizer.from_pretrained(self.model_path)
+            self.model = load_model_shared(self.model_path)
+        
+        elif is_lora_model:
+            logger.info("检测到LoRA模型，加载基础模型和适配器")
+            
+            # 加载基础模型
+            self.tokenizer = AutoTokenizer.from_pretrained(base_model)
+            load_kwargs = self._load_kwargs(base_model)
+            base_model_obj = AutoModelForCausalLM.from_pretrained(base_model, **load_kwargs)
+            
+            # 加载LoRA适配器，基础模型有层卸载到磁盘时适配器也需使用卸载目录
+            adapter_kwargs = {}
+            if "offload_folder" in load_kwargs:
+                adapter_kwargs["offload_folder"] = load_kwargs["offload_folder"]
+            self.model = PeftModel.from_pretrained(base_model_obj, self.model_path, **adapter_kwargs)
+        
+        else:
+            logger.info("加载完整微调模型")
+            self.tokenizer = AutoTokenizer.from_pretrained(self.model_path)
+            self.model = AutoModelForCausalLM.from_pretrained(self.model_path, **self._load_kwargs(self.model_path))
+        
+        self.load_report = placement_report(self.model)
+        log_placement_report(self.load_report)
+    
+    def _load_kwargs(self, model_path: str) -> Dict[str, Any]:
+        """按数据类型与内存预算生成from_pretrained参数"""
+        return build_load_kwargs(
+            model_path,
+            cpu_dtype=self.options.get("cpu_dtype"),
+            max_memory_mb=self.options.get("max_memory_mb"),
+            offload_folder=self.options.get("offload_folder")
+        )
+    
+    @property
+    def offloaded(self) -> bool:
+        """是否有权重卸载到磁盘"""
+        report = getattr(self, "load_report", None)
+        return bool(report and report["offloaded_bytes"])
+    
+    @property
+    def supports_compile(self) -> bool:
+        # 磁盘卸载的层由accelerate钩子按需读入，无法编译
+        return not self.offloaded
+    
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "backend": self.name,
+            "shared_weights": self.options.get("shared_weights", False),
+            "load_report": getattr(self, "load_report", None)
+        }
+
+# 已注册的推理后端
+INFERENCE_BACKENDS = {"torch": TorchBackend}
+
+# 依赖可选组件的后端，首次使用时导入对应模块完成注册
+OPTIONAL_BACKENDS = {"onnx": "scripts.onnx_backend"}
+
+def register_backend(backend_class):
+    """注册推理后端，可用作类装饰器"""
+    INFERENCE_BACKENDS[backend_class.name] = backend_class
+    return backend_class
+
+def get_backend(name: str):
+    """按名称获取推理后端类"""
+    if name not in INFERENCE_BACKENDS and name in OPTIONAL_BACKENDS:
+        importlib.import_module(OPTIONAL_BACKENDS[name])
+    if name not in INFERENCE_BACKENDS:
+        available = sorted(set(INFERENCE_BACKENDS) | set(OPTIONAL_BACKENDS))
+        raise ValueError(f"未知的推理后端: {name}，可选: {', '.join(available)}")
+    return INFERENCE_BACKENDS[name]
+
 class MCPInference:
     """MCP模型推理器"""
     
-    def __init__(self, model_path: str, base_model_name: Optional[str] = None):
+    def __init__(self, model_path: str, base_model_name: Optional[str] = None, shared_weights: bool = False,
+                 compile_config: Optional[Dict[str, Any]] = None, backend: str = "torch",
+                 backend_options: Optional[Dict[str, Any]] = None):
+        """
+        Args:
+            shared_weights: 通过内存映射safetensors加载权重，多个工作进程共享只读权重页
+            compile_config: 编译推理配置（config.yaml的inference.compile段），enabled为真时
+                使用静态KV缓存并编译解码步
+            backend: 推理后端名称，torch或onnx
+            backend_options: 传给推理后端的选项
+        """
         # 处理相对路径
         if not os.path.isabs(model_path):
             script_dir = os.path.dirname(os.path.abspath(__file__))
             project_dir = os.path.dirname(script_dir)
             model_path = os.path.join(project_dir, model_path)
-            
+        
         self.model_path = model_path
         self.base_model_name = base_model_name
+        self.shared_weights = shared_weights
+        self.compile_config = compile_config or {}
+        self.backend_name = backend
+        self.backend_options = backend_options or {}
+        self.backend = None
         self.model = None
         self.tokenizer = None
+        self.kv_estimator = None
+        self.compiled_generator = None
+        # 语义缓存（scripts/semantic_cache.py）与工具预执行（scripts/speculative_tools.py），由调用方按配置设置
+        self.semantic_cache = None
+        self.speculator = None
         self.load_model()
     
     def load_model(self):
         """加载模型和分词器"""
-        logger.info(f"加载模型: {self.model_path}")
+        logger.info(f"加载模型: {self.model_path} (后端: {self.backend_name})")
         
         try:
-            # 检查是否是LoRA模型
-            adapter_config_path = os.path.join(self.model_path, "adapter_config.json")
-            is_lora_model = os.path.exists(adapter_config_path)
-            
-            if is_lora_model:
-                logger.info("检测到LoRA模型，加载基础模型和适配器")
-                
-                # 读取适配器配置获取基础模型名称
-                with open(adapter_config_path, 'r') as f:
-                    adapter_config = json.load(f)
-                    base_model = adapter_config.get('base_model_name_or_path', self.base_model_name)
-                
-                if not base_model:
-                    raise ValueError("无法确定基础模型名称，请提供base_model_name参数")
-                
-                # 加载基础模型
-                self.tokenizer = AutoTokenizer.from_pretrained(base_model)
-                base_model_obj = AutoModelForCausalLM.from_pretrained(
-                    base_model,
-                    torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32,
-                    device_map="auto" if torch.cuda.is_available() else None
-                )
-                
-                # 加载LoRA适配器
-                self.model = PeftModel.from_pretrained(base_model_obj, self.model_path)
-                
-            else:
-                logger.info("加载完整微调模型")
-                self.tokenizer = AutoTokenizer.from_pretrained(self.model_path)
-                self.model = AutoModelForCausalLM.from_pretrained(
-                    self.model_path,
-                    torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32,
-                    device_map="auto" if torch.cuda.is_available() else None
-                )
+            backend_class = get_backend(self.backend_name)
+            self.backend = backend_class(
+                self.model_path,
+                self.base_model_name,
+                shared_weights=self.shared_weights,
+                **self.backend_options
+            )
+            self.backend.load()
+            self.model = self.backend.model
+            self.tokenizer = self.backend.tokenizer
             
             # 设置pad token
             if self.tokenizer.pad_token is None:
                 self.tokenizer.pad_token = self.tokenizer.eos_token
             
-            logger.info("模型加载成功")
+            # KV缓存估算器，用于API服务的内存准入控制
+            self.kv_estimator = KVCacheEstimator.from_config(self.backend.config, self.backend.dtype)
             
+            if self.compile_config.get("enabled") and not self.backend.supports_compile:
+                logger.warning(f"{self.backend_name}后端不支持编译推理，忽略compile配置")
+            elif self.compile_config.get("enabled"):
+                self.compiled_generator = CompiledGenerator(
+                    self.model,
+                    self.tokenizer.pad_token_id,
+                    cache_dir=self.compile_config.get("cache_dir", "./cache/torch_compile"),
+                    mode=self.compile_config.get("mode", "default"),
+                    prompt_buckets=self.compile_config.get("prompt_buckets"),
+                    new_token_buckets=self.compile_config.get("new_token_buckets")
+                )
+                if self.compile_config.get("warmup"):
+                    self.compiled_generator.warmup()
+            
+            logger.info("模型加载成功")
+        
         except Exception as e:
             logger.error(f"模型加载失败: {e}")
             raise
     
-    def generate_response(self, messages: List[Dict[str, str]], max_length: int = 2048, temperature: float = 0.7) -> str:
-        """生成响应"""
+    def generate_response(self, messages: List[Dict[str, str]], max_length: int = 2048, temperature: float = 0.7,
+                          max_new_tokens: int = 512,
+                          cancel_event: Optional[threading.Event] = None,
+                          stats: Optional[Dict[str, Any]] = None) -> str:
+        """生成响应
+        
+        Args:
+            temperature: 生成温度，小于等于0时使用贪心解码
+            max_new_tokens: 最多生成的token数
+            cancel_event: 取消令牌，被设置后生成在下一个解码步终止
+            stats: 可选的统计字典，累加生成token数、取消情况和耗时
+        """
+        # 已取消的请求不再占用模型
+        if cancel_event is not None and cancel_event.is_set():
+            self._record_stats(stats, cancelled=True, saved_tokens=max_new_tokens)
+            return ""
+        
         # 格式化输入
         formatted_input = self.format_messages(messages)
         
@@ -101,29 +331,219 @@ class MCPInference:
             max_length=max_length
         )
         
-        if torch.cuda.is_available():
-            inputs = {k: v.cuda() for k, v in inputs.items()}
+        new_token_ids = self._generate_ids(
+            inputs['input_ids'],
+            inputs['attention_mask'],
+            max_new_tokens=max_new_tokens,
+            temperature=temperature,
+            cancel_event=cancel_event,
+            stats=stats
+        )
+        if new_token_ids is None:
+            return ""
+        
+        # 只解码新生成的部分
+        response = self.tokenizer.decode(new_token_ids, skip_special_tokens=True).strip()
+        
+        return response
+    
+    def _generate_ids(self, input_ids: torch.Tensor, attention_mask: torch.Tensor,
+                      max_new_tokens: int = 512, temperature: float = 0.7,
+                      cancel_event: Optional[threading.Event] = None,
+                      stats: Optional[Dict[str, Any]] = None) -> Optional[torch.Tensor]:
+        """在模型上生成，返回新生成的token id；被取消时返回None"""
+        inputs = {"input_ids": input_ids, "attention_mask": attention_mask}
+        device = self.backend.device
+        if device.type != "cpu":
+            inputs = {k: v.to(device) for k, v in inputs.items()}
+        
+        criteria = []
+        generate_kwargs = {"max_new_tokens": max_new_tokens}
+        if self.compiled_generator is not None:
+            # 编译路径：提示填充到长度桶，静态缓存按桶分配，由token预算按真实上限截止
+            inputs, generate_kwargs, budget = self.compiled_generator.prepare(inputs, max_new_tokens)
+            criteria.append(budget)
+        
+        prompt_length = inputs['input_ids'].shape[-1]
+        cancellation = None
+        if cancel_event is not None:
+            cancellation = CancellationStoppingCriteria(cancel_event, prompt_length)
+            criteria.append(cancellation)
+        stopping_criteria = StoppingCriteriaList(criteria) if criteria else None
+        
+        # temperature为0时使用贪心解码，结果确定
+        sampling_kwargs = {"do_sample": False}
+        if temperature is not None and temperature > 0:
+            sampling_kwargs = {"do_sample": True, "temperature": temperature}
         
         # 生成响应
+        start_time = time.perf_counter()
         with torch.no_grad():
-            outputs = self.model.generate(
+            outputs = self.backend.generate(
                 **inputs,
-                max_new_tokens=512,
-                temperature=temperature,
-                do_sample=True,
+                **generate_kwargs,
+                **sampling_kwargs,
                 pad_token_id=self.tokenizer.eos_token_id,
                 eos_token_id=self.tokenizer.eos_token_id,
-                repetition_penalty=1.1
+                repetition_penalty=1.1,
+                stopping_criteria=stopping_criteria
+            )
+        elapsed = time.perf_counter() - start_time
+        
+        generated_tokens = outputs.shape[-1] - prompt_length
+        if cancellation is not None and cancellation.cancelled:
+            logger.info(f"客户端已断开，生成在 {generated_tokens} 个token后终止")
+            self._record_stats(
+                stats,
+                cancelled=True,
+                aborted_tokens=generated_tokens,
+                saved_tokens=max_new_tokens - generated_tokens,
+                elapsed=elapsed
             )
+            return None
+        self._record_stats(stats, prompt_tokens=input_ids.shape[-1], generated_tokens=generated_tokens, elapsed=elapsed)
         
-        # 解码输出
-        generated_text = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
+        return outputs[0, prompt_length:]
+    
+    @staticmethod
+    def tool_call_candidates() -> List[str]:
+        """每个已注册工具的工具调用开头"""
+        return [TOOL_CALL_CANDIDATE.format(name=name) for name in tool_registry.tools]
+    
+    def score_candidates(self, messages: List[Dict[str, str]], candidates: Optional[List[str]] = None,
+                         max_length: int = 2048, cancel_event: Optional[threading.Event] = None,
+                         stats: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """计算各候选续写在对话之后的对数似然
         
-        # 提取新生成的部分
-        input_text = self.tokenizer.decode(inputs['input_ids'][0], skip_special_tokens=True)
-        response = generated_text[len(input_text):].strip()
+        所有候选在一次批量前向中打分，提示只预填充一次。默认候选为每个已注册工具的
+        工具调用开头，工具选择只需一次预填充而不是逐token解码。
         
-        return response
+        Returns:
+            与candidates顺序一致的结果，probability为候选间按对数似然归一化的概率，可作为置信度
+        """
+        if candidates is None:
+            candidates = self.tool_call_candidates()
+        if not candidates:
+            raise ValueError("候选续写不能为空")
+        if cancel_event is not None and cancel_event.is_set():
+            self._record_stats(stats, cancelled=True)
+            return []
+        
+        prompt_ids = self.tokenizer(
+            self.format_messages(messages),
+            return_tensors="pt",
+            truncation=True,
+            max_length=max_length
+        )["input_ids"][0]
+        candidate_ids = [
+            torch.tensor(self.tokenizer(candidate, add_special_tokens=False)["input_ids"], dtype=torch.long)
+            for candidate in candidates
+        ]
+        if any(len(ids) == 0 for ids in candidate_ids):
+            raise ValueError("候选续写编码后不能为空")
+        
+        token_log_probs = self._score_ids(prompt_ids, candidate_ids, stats=stats)
+        
+        log_likelihoods = torch.tensor([float(log_probs.sum()) for log_probs in token_log_probs])
+        probabilities = torch.softmax(log_likelihoods, dim=0)
+        return [
+            {
+                "candidate": candidate,
+                "log_likelihood": float(log_likelihoods[index]),
+                "mean_log_likelihood": float(log_likelihoods[index]) / len(candidate_ids[index]),
+                "tokens": len(candidate_ids[index]),
+                "probability": float(probabilities[index])
+            }
+            for index, candidate in enumerate(candidates)
+        ]
+    
+    def _score_ids(self, prompt_ids: torch.Tensor, candidate_ids: List[torch.Tensor],
+                   stats: Optional[Dict[str, Any]] = None) -> List[torch.Tensor]:
+        """计算每个候选逐token的对数概率
+        
+        提示除最后一个token外预填充一次，KV缓存扩展到候选数；各候选以提示的最后一个
+        token开头、右填充成一个批次做一次前向，第一个位置的logits即预测候选首token。
+        批次中每行至少两个token，不会进入编译推理的单token解码路径。
+        """
+        device = self.backend.device
+        num_candidates = len(candidate_ids)
+        prefix_ids = prompt_ids[:-1].unsqueeze(0)
+        rows = [torch.cat([prompt_ids[-1:], ids]) for ids in candidate_ids]
+        width = max(len(row) for row in rows)
+        
+        batch_ids = torch.full((num_candidates, width), self.tokenizer.pad_token_id, dtype=torch.long)
+        candidate_mask = torch.zeros((num_candidates, width), dtype=torch.long)
+        for index, row in enumerate(rows):
+            batch_ids[index, :len(row)] = row
+            candidate_mask[index, :len(row)] = 1
+        attention_mask = torch.cat(
+            [torch.ones((num_candidates, prefix_ids.shape[-1]), dtype=torch.long), candidate_mask], dim=1
+        )
+        
+        start_time = time.perf_counter()
+        with torch.no_grad():
+            past_key_values = None
+            if prefix_ids.shape[-1]:
+                prefill = self.backend.forward(input_ids=prefix_ids.to(device), use_cache=True)
+                past_key_values = expand_past_key_values(prefill.past_key_values, num_candidates)
+            logits = self.backend.forward(
+                input_ids=batch_ids.to(device),
+                attention_mask=attention_mask.to(device),
+                past_key_values=past_key_values,
+                use_cache=True
+            ).logits
+            
+            log_probs = torch.log_softmax(logits[:, :-1].float(), dim=-1)
+            token_log_probs = log_probs.gather(-1, batch_ids[:, 1:].to(device).unsqueeze(-1)).squeeze(-1).cpu()
+        elapsed = time.perf_counter() - start_time
+        
+        self._record_stats(stats, prompt_tokens=len(prompt_ids), scored_tokens=int(candidate_mask.sum()) - num_candidates,
+                           elapsed=elapsed)
+        return [token_log_probs[index, :len(ids)] for index, ids in enumerate(candidate_ids)]
+    
+    def count_tokens(self, messages: List[Dict[str, str]], max_length: int = 2048) -> int:
+        """计算消息格式化后的提示token数（与generate_response一致地截断）"""
+        input_ids = self.tokenizer(self.format_messages(messages))["input_ids"]
+        return min(len(input_ids), max_length)
+    
+    def estimate_kv_bytes(self, messages: List[Dict[str, str]], max_new_tokens: int = 512,
+                          max_length: int = 2048, generations: int = 1) -> int:
+        """估算生成所需的KV缓存峰值字节数
+        
+        Args:
+            generations: 生成轮数，chat()在调用工具后会进行第二轮生成，
+                其提示包含第一轮生成的内容
+        """
+        prompt_tokens = self.count_tokens(messages, max_length)
+        return self.kv_estimator.estimate(prompt_tokens + (generations - 1) * max_new_tokens, max_new_tokens)
+    
+    def estimate_score_bytes(self, messages: List[Dict[str, str]], candidates: List[str],
+                             max_length: int = 2048) -> int:
+        """估算候选打分的KV缓存峰值字节数，提示缓存按候选数扩展"""
+        prompt_tokens = self.count_tokens(messages, max_length)
+        candidate_tokens = max(len(self.tokenizer(candidate, add_special_tokens=False)["input_ids"])
+                               for candidate in candidates)
+        return self.kv_estimator.estimate(prompt_tokens, candidate_tokens, batch_size=len(candidates))
+    
+    def build_chat_messages(self, user_input: str, system_prompt: Optional[str] = None) -> List[Dict[str, str]]:
+        """构建chat()使用的初始消息"""
+        if system_prompt is None:
+            system_prompt = DEFAULT_SYSTEM_PROMPT
+        
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_input}
+        ]
+    
+    @staticmethod
+    def _record_stats(stats: Optional[Dict[str, Any]], cancelled: bool = False, **counters):
+        """累加生成统计"""
+        if stats is None:
+            return
+        if cancelled:
+            stats["cancelled"] = True
+        for key, value in counters.items():
+            stats[key] = stats.get(key, 0) + value
     
     def format_messages(self, messages: List[Dict[str, str]]) -> str:
         """格式化消息"""
@@ -171,54 +591,104 @@ class MCPInference:
         
         return tool_calls
     
-    def execute_tool_calls(self, tool_calls: List[Dict[str, Any]]) -> List[str]:
-        """执行工具调用"""
-        results = []
+    def execute_tool_calls(self, tool_calls: List[Dict[str, Any]], speculation=None,
+                           stats: Optional[Dict[str, Any]] = None) -> List[str]:
+        """执行工具调用
         
-        for tool_call in tool_calls:
-            tool_name = tool_call["name"]
-            arguments = tool_call["arguments"]
-            
-            try:
-                result = tool_registry.execute_tool(tool_name, **arguments)
-                results.append(result)
-                logger.info(f"工具调用成功: {tool_name} -> {result[:100]}...")
-            except Exception as e:
-                error_msg = f"工具调用失败: {tool_name}, 错误: {str(e)}"
-                results.append(error_msg)
-                logger.error(error_msg)
+        Args:
+            speculation: 预执行（scripts/speculative_tools.py），与预测一致的调用直接使用预执行结果
+        """
+        results: List[Optional[str]] = []
+        pending = []
+        
+        for index, tool_call in enumerate(tool_calls):
+            result = None
+            if not isinstance(tool_call["arguments"], dict):
+                result = f"工具调用失败: {tool_call['name']}, 错误: 参数必须是JSON对象"
+                logger.error(result)
+            elif speculation is not None:
+                result = self.speculator.resolve(speculation, tool_call)
+                if result is not None:
+                    self._record_stats(stats, speculative_hits=1)
+            if result is None:
+                pending.append(index)
+            results.append(result)
+        
+        # 其余调用并发执行：协程工具直接等待，同步工具在工具注册表的I/O线程池中运行
+        if pending:
+            pending_results = asyncio.run(tool_registry.execute_tools_async([tool_calls[index] for index in pending]))
+            for index, result in zip(pending, pending_results):
+                results[index] = result
+                logger.info(f"工具调用完成: {tool_calls[index]['name']} -> {result[:100]}...")
         
         return results
     
-    def chat(self, user_input: str, system_prompt: Optional[str] = None) -> Dict[str, Any]:
-        """聊天接口"""
-        if system_prompt is None:
-            system_prompt = "你是一个能够正确调用MCP工具的AI助手。当用户需要获取信息或执行操作时，你应该选择合适的MCP工具并正确调用。"
-        
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_input}
-        ]
+    def chat(self, user_input: str, system_prompt: Optional[str] = None,
+             max_new_tokens: int = 512, temperature: float = 0.7,
+             cancel_event: Optional[threading.Event] = None,
+             stats: Optional[Dict[str, Any]] = None,
+             template_answers: bool = True) -> Dict[str, Any]:
+        """聊天接口
         
-        # 生成初始响应
-        response = self.generate_response(messages)
+        template_answers为True时，工具调用均开启了模板回答的请求直接按模板渲染最终回答，
+        跳过第二轮生成；为False时总是由模型生成最终回答，用于对比两者的质量。
+        """
+        messages = self.build_chat_messages(user_input, system_prompt)
         
-        # 解析工具调用
-        tool_calls = self.parse_tool_calls(response)
+        # 语义缓存只用于默认系统提示词的请求，命中时复用工具调用，跳过第一轮生成
+        use_cache = self.semantic_cache is not None and system_prompt is None
+        cached = self.semantic_cache.lookup(user_input) if use_cache else None
+        speculation = None
+        if cached is not None:
+            response = cached["assistant_response"]
+            tool_calls = cached["tool_calls"]
+        else:
+            # 预测可能调用的只读工具，在生成期间提前执行
+            if self.speculator is not None:
+                speculation = self.speculator.start(user_input)
+            
+            # 生成初始响应
+            response = self.generate_response(messages, max_new_tokens=max_new_tokens, temperature=temperature,
+                                              cancel_event=cancel_event, stats=stats)
+            
+            # 解析工具调用
+            tool_calls = self.parse_tool_calls(response)
+            if use_cache:
+                self.semantic_cache.store(user_input, response, tool_calls)
         
         result = {
             "user_input": user_input,
             "assistant_response": response,
             "tool_calls": tool_calls,
             "tool_results": [],
-            "final_response": response
+            "final_response": response,
+            "templated": False,
+            "cached": cached is not None
         }
         
+        # 客户端已断开时不再执行工具和生成最终响应
+        if cancel_event is not None and cancel_event.is_set():
+            if speculation is not None:
+                self.speculator.finish(speculation)
+            return result
+        
         # 如果有工具调用，执行并生成最终响应
+        tool_results = self.execute_tool_calls(tool_calls, speculation, stats=stats) if tool_calls else []
+        if speculation is not None:
+            self.speculator.finish(speculation)
+        
         if tool_calls:
-            tool_results = self.execute_tool_calls(tool_calls)
             result["tool_results"] = tool_results
             
+            # 最终回答格式固定的工具直接渲染模板
+            templated_answer = tool_registry.render_final_answer(tool_calls, tool_results) if template_answers else None
+            if templated_answer is not None:
+                result["final_response"] = templated_answer
+                result["templated"] = True
+                if stats is not None:
+                    stats["templated_answers"] = stats.get("templated_answers", 0) + 1
+                return result
+            
             # 构建包含工具结果的消息
             messages.append({"role": "assistant", "content": response})
             
@@ -229,17 +699,19 @@ class MCPInference:
                 })
             
             # 生成最终响应
-            final_response = self.generate_response(messages)
+            final_response = self.generate_response(messages, max_new_tokens=max_new_tokens, temperature=temperature,
+                                                    cancel_event=cancel_event, stats=stats)
             result["final_response"] = final_response
         
         return result
 
-def test_model(model_path: str, base_model_name: Optional[str] = None):
+def test_model(model_path: str, base_model_name: Optional[str] = None,
+               backend_options: Optional[Dict[str, Any]] = None):
     """测试模型"""
     logger.info("开始测试MCP模型")
     
     # 创建推理器
-    inference = MCPInference(model_path, base_model_name)
+    inference = MCPInference(model_path, base_model_name, backend_options=backend_options)
     
     # 测试用例
     test_cases = [
@@ -271,7 +743,7 @@ def test_model(model_path: str, base_model_name: Optional[str] = None):
                 
                 print(f"工具结果: {result['tool_results']}")
                 print(f"最终响应: {result['final_response']}")
-            
+        
         except Exception as e:
             print(f"测试失败: {e}")
         
@@ -284,12 +756,20 @@ if __name__ == "__main__":
     parser.add_argument("--model_path", type=str, required=True, help="模型路径")
     parser.add_argument("--base_model", type=str, help="基础模型名称（LoRA模型需要）")
     parser.add_argument("--interactive", action="store_true", help="交互式模式")
+    parser.add_argument("--cpu_dtype", type=str, choices=["float32", "bfloat16"], help="CPU上的权重数据类型")
+    parser.add_argument("--max_memory_mb", type=int, help="CPU内存预算（MB），超出部分的层卸载到磁盘")
+    parser.add_argument("--offload_folder", type=str, help="磁盘卸载目录")
     
     args = parser.parse_args()
+    backend_options = {
+        "cpu_dtype": args.cpu_dtype,
+        "max_memory_mb": args.max_memory_mb,
+        "offload_folder": args.offload_folder
+    }
     
     if args.interactive:
         # 交互式模式
-        inference = MCPInference(args.model_path, args.base_model)
+        inference = MCPInference(args.model_path, args.base_model, backend_options=backend_options)
         
         print("MCP模型交互式测试")
         print("输入 'quit' 退出")
@@ -309,9 +789,9 @@ if __name__ == "__main__":
                 
                 if result['tool_calls']:
                     print(f"\n[调用了 {len(result['tool_calls'])} 个工具]")
-                
+            
             except Exception as e:
                 print(f"\n错误: {e}")
     else:
         # 批量测试模式
-        test_model(args.model_path, args.base_model)
\ No newline at end of file
+        test_model(args.model_path, args.base_model, backend_options)
\ No newline at end of file
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+推理请求调度器
+按优先级调度推理任务，根据实测生成速度拒绝无法按期完成的请求
+"""
+
+import time
+import heapq
+import asyncio
+import logging
+import functools
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional, Callable
+
+logger = logging.getLogger(__name__)
+
+# 优先级类别，数值越大越先调度
+PRIORITY_CLASSES = {
+    "batch": 0,
+    "normal": 1,
+    "interactive": 2
+}
+
+class DeadlineExceeded(Exception):
+    """请求截止时间已过或无法在截止时间前完成"""
+
+class AdmissionRejected(Exception):
+    """请求所需内存超过预算，无法被接纳"""
+
+def parse_priority(value: Optional[str], default: str = "normal") -> int:
+    """解析优先级，支持类别名称或整数"""
+    if value is None or value == "":
+        return PRIORITY_CLASSES[default]
+    value = value.strip().lower()
+    if value in PRIORITY_CLASSES:
+        return PRIORITY_CLASSES[value]
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"未知的优先级: {value}，可选: {', '.join(PRIORITY_CLASSES)}")
+
+def parse_deadline(value: Optional[str]) -> Optional[float]:
+    """将相对截止时间（毫秒）转换为单调时钟上的绝对时间"""
+    if value is None or value == "":
+        return None
+    try:
+        budget_ms = float(value)
+    except ValueError:
+        raise ValueError(f"无效的截止时间: {value}")
+    return time.monotonic() + budget_ms / 1000.0
+
+class _Job:
+    """调度队列中的推理任务"""
+    
+    def __init__(self, func: Callable[[], Any], priority: int, seq: int,
+                 deadline: Optional[float], max_tokens: int, memory_bytes: int,
+                 cancel_event: Optional[threading.Event], stats: Optional[Dict[str, Any]],
+                 future: asyncio.Future):
+        self.func = func
+        self.priority = priority
+        self.seq = seq
+        self.deadline = deadline
+        self.max_tokens = max_tokens
+        self.memory_bytes = memory_bytes
+        self.cancel_event = cancel_event
+        self.stats = stats if stats is not None else {}
+        self.future = future
+        self.enqueued_at = time.monotonic()
+        self.started_at = None
+    
+    def __lt__(self, other: "_Job") -> bool:
+        # 高优先级在前，同优先级先到先服务
+        return (-self.priority, self.seq) < (-other.priority, other.seq)
+
+class InferenceScheduler:
+    """优先级推理调度器
+    
+    任务在asyncio事件循环中排队，由固定大小的线程池执行。调度时会丢弃
+    已过期或已取消的任务，并根据生成速度的滑动平均估算任务耗时，
+    不启动注定无法在截止时间前完成的任务。设置内存预算后，只有在运行中
+    任务的KV缓存总量加上新任务的占用不超过预算时才启动新任务。
+    """
+    
+    def __init__(self, max_workers: int = 1, memory_budget_bytes: Optional[int] = None,
+                 ewma_alpha: float = 0.2):
+        self.max_workers = max_workers
+        self.memory_budget_bytes = memory_budget_bytes or None
+        self.ewma_alpha = ewma_alpha
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="inference")
+        self._queue = []
+        self._seq = itertools.count()
+        self._running = 0
+        self._reserved_bytes = 0
+        self.tokens_per_second = None
+        self.tokens_per_job = None
+        self.metrics = {
+            "submitted": 0,
+            "completed": 0,
+            "failed": 0,
+            "expired": 0,
+            "rejected_deadline": 0,
+            "dropped_cancelled": 0,
+            "rejected_memory": 0,
+            "served_by_priority": {}
+        }
+    
+    async def submit(self, func: Callable[[], Any], priority: int = PRIORITY_CLASSES["normal"],
+                     deadline: Optional[float] = None, max_tokens: int = 512,
+                     memory_bytes: int = 0,
+                     cancel_event: Optional[threading.Event] = None,
+                     stats: Optional[Dict[str, Any]] = None) -> Any:
+        """提交任务并等待结果
+        
+        Args:
+            func: 在推理线程中执行的无参函数
+            priority: 优先级，数值越大越先调度
+            deadline: 单调时钟上的绝对截止时间
+            max_tokens: 任务最多生成的token数，用于估算耗时
+            memory_bytes: 任务运行期间占用的KV缓存字节数
+            cancel_event: 取消令牌，已取消的排队任务不会启动
+            stats: 由推理函数填写的统计字典，完成后用于更新生成速度
+        
+        Raises:
+            DeadlineExceeded: 任务已过期或无法在截止时间前完成
+            AdmissionRejected: 任务所需内存超过总预算
+        """
+        if self.memory_budget_bytes is not None and memory_bytes > self.memory_budget_bytes:
+            self.metrics["rejected_memory"] += 1
+            raise AdmissionRejected(
+                f"请求需要 {memory_bytes / 1024**2:.1f}MB KV缓存，超过内存预算 "
+                f"{self.memory_budget_bytes / 1024**2:.1f}MB"
+            )
+        
+        loop = asyncio.get_running_loop()
+        job = _Job(func, priority, next(self._seq), deadline, max_tokens, memory_bytes,
+                   cancel_event, stats, loop.create_future())
+        self.metrics["submitted"] += 1
+        heapq.heappush(self._queue, job)
+        self._dispatch()
+        
+        timeout = None
+        if deadline is not None:
+            timeout = max(0.0, deadline - time.monotonic())
+        
+        try:
+            return await asyncio.wait_for(asyncio.shield(job.future), timeout)
+        except asyncio.TimeoutError:
+            # 截止时间已到：排队中的任务在调度时被丢弃，运行中的任务通过取消令牌终止
+            if not job.future.done():
+                job.future.set_exception(DeadlineExceeded("请求已超过截止时间"))
+                job.future.exception()
+                self.metrics["expired"] += 1
+            if cancel_event is not None:
+                cancel_event.set()
+            raise DeadlineExceeded("请求已超过截止时间")
+    
+    def estimate_seconds(self, job: _Job) -> Optional[float]:
+        """根据实测生成速度估算任务耗时"""
+        if not self.tokens_per_second:
+            return None
+        expected_tokens = job.max_tokens
+        if self.tokens_per_job is not None:
+            expected_tokens = min(expected_tokens, self.tokens_per_job)
+        return expected_tokens / self.tokens_per_second
+    
+    def _dispatch(self):
+        """在有空闲工作线程时启动队首任务"""
+        loop = asyncio.get_running_loop()
+        
+        while self._running < self.max_workers and self._queue:
+            job = heapq.heappop(self._queue)
+            
+            if job.future.done():
+                continue
+            
+            if job.cancel_event is not None and job.cancel_event.is_set():
+                self.metrics["dropped_cancelled"] += 1
+                job.stats["cancelled"] = True
+                job.stats["saved_tokens"] = job.stats.get("saved_tokens", 0) + job.max_tokens
+                job.future.set_result(None)
+                continue
+            
+            now = time.monotonic()
+            if job.deadline is not None:
+                if now >= job.deadline:
+                    self.metrics["expired"] += 1
+                    job.future.set_exception(DeadlineExceeded("请求在队列中已过期"))
+                    continue
+                
+                estimate = self.estimate_seconds(job)
+                if estimate is not None and now + estimate > job.deadline:
+                    self.metrics["rejected_deadline"] += 1
+                    job.future.set_exception(DeadlineExceeded(
+                        f"预计耗时 {estimate:.2f}s，无法在截止时间前完成"
+                    ))
+                    continue
+            
+            # 内存不足时按优先级顺序等待，避免大请求被小请求持续插队
+            if (self.memory_budget_bytes is not None
+                    and self._reserved_bytes + job.memory_bytes > self.memory_budget_bytes):
+                heapq.heappush(self._queue, job)
+                break
+            
+            job.started_at = now
+            self._running += 1
+            self._reserved_bytes += job.memory_bytes
+            worker_future = loop.run_in_executor(self.executor, job.func)
+            worker_future.add_done_callback(functools.partial(self._on_done, job))
+    
+    def _on_done(self, job: _Job, worker_future: asyncio.Future):
+        """任务完成回调，更新生成速度并继续调度"""
+        self._running -= 1
+        self._reserved_bytes -= job.memory_bytes
+        
+        if worker_future.exception() is not None:
+            self.metrics["failed"] += 1
+            if not job.future.done():
+                job.future.set_exception(worker_future.exception())
+        else:
+            self.metrics["completed"] += 1
+            served = self.metrics["served_by_priority"]
+            served[job.priority] = served.get(job.priority, 0) + 1
+            self._update_rates(job)
+            if not job.future.done():
+                job.future.set_result(worker_future.result())
+        
+        self._dispatch()
+    
+    def _update_rates(self, job: _Job):
+        """用任务统计更新生成速度的滑动平均"""
+        generated = job.stats.get("generated_tokens", 0)
+        elapsed = job.stats.get("elapsed", 0)
+        if job.stats.get("cancelled") or generated <= 0 or elapsed <= 0:
+            return
+        
+        rate = generated / elapsed
+        if self.tokens_per_second is None:
+            self.tokens_per_second = rate
+            self.tokens_per_job = generated
+        else:
+            alpha = self.ewma_alpha
+            self.tokens_per_second = alpha * rate + (1 - alpha) * self.tokens_per_second
+            self.tokens_per_job = alpha * generated + (1 - alpha) * self.tokens_per_job
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """获取调度器状态"""
+        return {
+            "queued": len(self._queue),
+            "running": self._running,
+            "max_workers": self.max_workers,
+            "reserved_bytes": self._reserved_bytes,
+            "memory_budget_bytes": self.memory_budget_bytes,
+            "tokens_per_second": self.tokens_per_second,
+            "tokens_per_job": self.tokens_per_job,
+            **self.metrics
+        }
@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+意图快速路由
+在模型之前识别简单的工具请求（如"获取当前时间"、"北京天气怎么样"），直接构造工具调用、
+执行并渲染回答，跳过两轮模型生成。识别分两级：由训练数据请求模板编译的正则，
+以及在模板数据上训练的字符n-gram朴素贝叶斯分类器。置信度不足时交给模型处理。
+"""
+
+import os
+import re
+import sys
+import math
+import logging
+import itertools
+from collections import Counter
+from typing import Dict, Any, List, Optional, Callable
+
+# 添加父目录到路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from examples.mcp_tools import tool_registry
+from scripts.generate_dataset import MCPDatasetGenerator
+
+logger = logging.getLogger(__name__)
+
+# 非工具请求的类别
+NO_TOOL = "__none__"
+
+# 训练数据未覆盖的工具请求模板
+SUPPLEMENTARY_TEMPLATES = {
+    "get_current_time": [
+        "获取当前时间",
+        "现在几点了",
+        "现在几点",
+        "告诉我现在的时间",
+        "当前时间是多少",
+        "请问现在是什么时间",
+        "今天几号"
+    ]
+}
+
+# 不需要调用工具的请求，作为分类器的负样本
+NEGATIVE_EXAMPLES = [
+    "你好",
+    "你是谁",
+    "谢谢你的帮助",
+    "给我讲个笑话",
+    "帮我写一首关于春天的诗",
+    "解释一下什么是机器学习",
+    "如何学习Python编程",
+    "推荐几本好书",
+    "你能做什么",
+    "把这段话翻译成英文",
+    "总结一下我们刚才的对话",
+    "帮我写一封请假邮件",
+    "天气好的时候适合做什么运动",
+    "时间管理有什么好方法"
+]
+
+# 默认允许快速路由的工具；write_file有副作用，默认交给模型确认
+DEFAULT_ROUTABLE_TOOLS = ["get_current_time", "get_weather", "calculate", "web_search", "list_files"]
+
+ARITHMETIC_PATTERN = re.compile(r"[\d\.\s\+\-\*/\(\)×÷]*\d[\d\.\s]*[\+\-\*/×÷][\d\.\s\+\-\*/\(\)×÷]*\d[\d\.\s\)]*")
+TIME_WORDS = r"(?:今天|明天|现在|最近)"
+WEATHER_CITY_PATTERN = re.compile(rf"([一-龥]{{2,6}}?)市?{TIME_WORDS}?的?天气")
+CITY_PATTERN = re.compile(r"^[一-龥A-Za-z]{2,12}$")
+PATH_PATTERN = re.compile(r"^[\w\./\-~]+$")
+
+# 结尾的标点不影响意图
+TRAILING_PUNCTUATION = "。！？!?.，, "
+
+def normalize_text(text: str) -> str:
+    """统一全角标点并去掉首尾空白与结尾标点"""
+    text = text.strip().replace("：", ":").replace("？", "?").replace("，", ",")
+    return text.rstrip(TRAILING_PUNCTUATION)
+
+def _normalize_expression(expression: str) -> str:
+    return expression.replace("×", "*").replace("÷", "/").strip()
+
+def _validate_arguments(tool_name: str, arguments: Dict[str, str]) -> Optional[Dict[str, str]]:
+    """校验并规范化模板中提取的参数，不合法时返回None"""
+    arguments = {key: value.strip() for key, value in arguments.items()}
+    if any(not value for value in arguments.values()):
+        return None
+    
+    if tool_name == "calculate":
+        expression = _normalize_expression(arguments["expression"])
+        if not ARITHMETIC_PATTERN.fullmatch(expression):
+            return None
+        return {"expression": expression}
+    if tool_name == "get_weather":
+        city = re.sub(rf"{TIME_WORDS}$", "", arguments["city"]).rstrip("市")
+        return {"city": city} if CITY_PATTERN.match(city) else None
+    if tool_name == "list_files":
+        return arguments if PATH_PATTERN.match(arguments["path"]) else None
+    return arguments
+
+def _extract_calculate(text: str) -> Optional[Dict[str, str]]:
+    match = ARITHMETIC_PATTERN.search(text)
+    return _validate_arguments("calculate", {"expression": match.group(0)}) if match else None
+
+def _extract_weather(text: str) -> Optional[Dict[str, str]]:
+    match = WEATHER_CITY_PATTERN.search(text)
+    return _validate_arguments("get_weather", {"city": match.group(1)}) if match else None
+
+# 分类器命中后从原文提取参数的方法；不在此表中的工具只能经正则模板路由
+ARGUMENT_EXTRACTORS: Dict[str, Callable[[str], Optional[Dict[str, str]]]] = {
+    "get_current_time": lambda text: {},
+    "calculate": _extract_calculate,
+    "get_weather": _extract_weather
+}
+
+def compile_template(template: str) -> re.Pattern:
+    """将请求模板编译为正则，{参数}转为命名分组"""
+    parts = re.split(r"\{(\w+)\}", normalize_text(template))
+    pattern = ""
+    for index, part in enumerate(parts):
+        # 奇数位置是参数名
+        pattern += f"(?P<{part}>.+?)" if index % 2 else re.escape(part)
+    return re.compile(f"^{pattern}$")
+
+def char_ngrams(text: str, n_values=(1, 2)) -> List[str]:
+    """字符n-gram特征，参数值用数字归一化后仍保留形态"""
+    text = re.sub(r"\d+", "0", normalize_text(text).lower())
+    features = []
+    for n in n_values:
+        features.extend(text[i:i + n] for i in range(len(text) - n + 1))
+    return features
+
+class NaiveBayesClassifier:
+    """字符n-gram多项式朴素贝叶斯"""
+    
+    def __init__(self, alpha: float = 0.5):
+        self.alpha = alpha
+        self.class_counts: Counter = Counter()
+        self.feature_counts: Dict[str, Counter] = {}
+        self.vocabulary = set()
+    
+    def fit(self, samples: List[str], labels: List[str]):
+        for text, label in zip(samples, labels):
+            features = char_ngrams(text)
+            self.class_counts[label] += 1
+            self.feature_counts.setdefault(label, Counter()).update(features)
+            self.vocabulary.update(features)
+        self._totals = {label: sum(counts.values()) for label, counts in self.feature_counts.items()}
+        return self
+    
+    def predict_proba(self, text: str) -> Dict[str, float]:
+        """各类别的后验概率"""
+        features = [feature for feature in char_ngrams(text) if feature in self.vocabulary]
+        total_samples = sum(self.class_counts.values())
+        vocabulary_size = len(self.vocabulary)
+        
+        log_scores = {}
+        for label, count in self.class_counts.items():
+            counts = self.feature_counts[label]
+            denominator = self._totals[label] + self.alpha * vocabulary_size
+            score = math.log(count / total_samples)
+            for feature in features:
+                score += math.log((counts.get(feature, 0) + self.alpha) / denominator)
+            log_scores[label] = score
+        
+        peak = max(log_scores.values())
+        exp_scores = {label: math.exp(score - peak) for label, score in log_scores.items()}
+        normalizer = sum(exp_scores.values())
+        return {label: value / normalizer for label, value in exp_scores.items()}
+
+class IntentRouter:
+    """意图快速路由器
+    
+    route()返回路由决策（工具名、参数、置信度、来源），handle()在置信时执行工具并返回
+    与MCPInference.chat相同结构的结果，否则返回None交给模型。
+    """
+    
+    def __init__(self, threshold: float = 0.9, tools: Optional[List[str]] = None,
+                 registry=None, request_templates: Optional[Dict[str, List[str]]] = None):
+        self.threshold = threshold
+        self.registry = registry or tool_registry
+        self.tools = set(tools or DEFAULT_ROUTABLE_TOOLS)
+        self.dataset_generator = MCPDatasetGenerator()
+        
+        templates = dict(request_templates or self.dataset_generator.request_templates)
+        templates.update(SUPPLEMENTARY_TEMPLATES)
+        self.patterns = [
+            (tool_name, compile_template(template))
+            for tool_name, tool_templates in templates.items()
+            for template in tool_templates
+        ]
+        self.classifier = self._train_classifier(templates)
+        self.metrics = {
+            "requests": 0,
+            "routed": 0,
+            "fallthrough": 0,
+            "low_confidence": 0,
+            "by_tool": {},
+            "by_stage": {}
+        }
+    
+    def _train_classifier(self, templates: Dict[str, List[str]]) -> NaiveBayesClassifier:
+        """用示例数据填充请求模板训练分类器"""
+        example_values = {
+            "query": self.dataset_generator.example_data["topics"],
+            "city": self.dataset_generator.example_data["cities"],
+            "path": self.dataset_generator.example_data["paths"],
+            "filename": self.dataset_generator.example_data["filenames"],
+            "content": self.dataset_generator.example_data["contents"],
+            "expression": self.dataset_generator.example_data["expressions"]
+        }
+        
+        samples, labels = [], []
+        for tool_name, tool_templates in templates.items():
+            for template in tool_templates:
+                names = re.findall(r"\{(\w+)\}", template)
+                combinations = itertools.product(*(example_values[name] for name in names))
+                for values in itertools.islice(combinations, 10):
+                    samples.append(template.format(**dict(zip(names, values))))
+                    labels.append(tool_name)
+        
+        samples.extend(NEGATIVE_EXAMPLES)
+        labels.extend([NO_TOOL] * len(NEGATIVE_EXAMPLES))
+        return NaiveBayesClassifier().fit(samples, labels)
+    
+    def route(self, user_input: str) -> Optional[Dict[str, Any]]:
+        """识别意图，置信且参数完整时返回路由决策"""
+        text = normalize_text(user_input)
+        if not text:
+            return None
+        
+        # 第一级：请求模板完全匹配
+        for tool_name, pattern in self.patterns:
+            match = pattern.match(text)
+            if match and tool_name in self.tools:
+                arguments = _validate_arguments(tool_name, match.groupdict())
+                if arguments is not None:
+                    return {"name": tool_name, "arguments": arguments, "confidence": 1.0, "stage": "template"}
+        
+        # 第二级：分类器 + 参数提取
+        probabilities = self.classifier.predict_proba(text)
+        tool_name, confidence = max(probabilities.items(), key=lambda item: item[1])
+        if tool_name == NO_TOOL or tool_name not in self.tools or tool_name not in ARGUMENT_EXTRACTORS:
+            return None
+        if confidence < self.threshold:
+            self.metrics["low_confidence"] += 1
+            return None
+        
+        arguments = ARGUMENT_EXTRACTORS[tool_name](text)
+        if arguments is None:
+            return None
+        return {"name": tool_name, "arguments": arguments, "confidence": round(confidence, 4), "stage": "classifier"}
+    
+    def render(self, tool_name: str, arguments: Dict[str, Any], tool_result: str) -> Optional[str]:
+        """按工具注册表的回答模板渲染最终回答；工具执行失败或参数与模板不匹配时返回None"""
+        return self.registry.try_format_answer(tool_name, arguments, tool_result)
+    
+    def handle(self, user_input: str) -> Optional[Dict[str, Any]]:
+        """快速路由：执行工具并渲染回答；不置信时返回None"""
+        self.metrics["requests"] += 1
+        decision = self.route(user_input)
+        if decision is None:
+            self.metrics["fallthrough"] += 1
+            return None
+        
+        tool_name = decision["name"]
+        tool_result = self.registry.execute_tool(tool_name, **decision["arguments"])
+        final_response = self.render(tool_name, decision["arguments"], tool_result)
+        if final_response is None:
+            # 执行失败或无法按模板渲染时交给模型处理
+            self.metrics["fallthrough"] += 1
+            return None
+        self.metrics["routed"] += 1
+        by_tool = self.metrics["by_tool"]
+        by_tool[tool_name] = by_tool.get(tool_name, 0) + 1
+        by_stage = self.metrics["by_stage"]
+        by_stage[decision["stage"]] = by_stage.get(decision["stage"], 0) + 1
+        logger.info(f"快速路由: {tool_name}({decision['arguments']}) 置信度 {decision['confidence']}")
+        
+        tool_call = {"name": tool_name, "arguments": decision["arguments"]}
+        return {
+            "user_input": user_input,
+            "assistant_response": "",
+            "tool_calls": [tool_call],
+            "tool_results": [tool_result],
+            "final_response": final_response,
+            "templated": True,
+            "routed": decision
+        }
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """获取路由指标"""
+        routed_rate = self.metrics["routed"] / self.metrics["requests"] if self.metrics["requests"] else 0.0
+        return {
+            "threshold": self.threshold,
+            "tools": sorted(self.tools),
+            "routed_rate": round(routed_rate, 4),
+            **self.metrics
+        }
+
+def evaluate(router: IntentRouter, num_samples: int = 200, seed: int = 0) -> Dict[str, Any]:
+    """用训练数据的请求模板随机生成请求，评估路由的覆盖率与准确率
+    
+    只做路由判断不执行工具，避免write_file等工具产生副作用。
+    """
+    import random
+    
+    rng = random.Random(seed)
+    example_data = router.dataset_generator.example_data
+    example_values = {
+        "query": example_data["topics"],
+        "city": example_data["cities"],
+        "path": example_data["paths"],
+        "filename": example_data["filenames"],
+        "content": example_data["contents"],
+        "expression": example_data["expressions"]
+    }
+    templates = router.dataset_generator.request_templates
+    
+    routed = correct = 0
+    for _ in range(num_samples):
+        expected = rng.choice(list(templates))
+        template = rng.choice(templates[expected])
+        names = re.findall(r"\{(\w+)\}", template)
+        user_message = template.format(**{name: rng.choice(example_values[name]) for name in names})
+        decision = router.route(user_message)
+        if decision is not None:
+            routed += 1
+            correct += decision["name"] == expected
+    
+    negatives_routed = sum(1 for text in NEGATIVE_EXAMPLES if router.route(text) is not None)
+    return {
+        "samples": num_samples,
+        "coverage": round(routed / num_samples, 4),
+        "precision": round(correct / routed, 4) if routed else None,
+        "negatives_routed": negatives_routed
+    }
+
+if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="意图快速路由")
+    parser.add_argument("text", nargs="*", help="要路由的请求")
+    parser.add_argument("--threshold", type=float, default=0.9, help="分类器置信度阈值")
+    parser.add_argument("--eval", type=int, metavar="N", help="在N条生成数据上评估覆盖率与准确率")
+    
+    args = parser.parse_args()
+    router = IntentRouter(threshold=args.threshold)
+    
+    for text in args.text:
+        print(f"{text} -> {router.route(text)}")
+    if args.eval:
+        print(evaluate(router, args.eval))
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+KV缓存内存估算器
+根据模型配置估算每个推理请求的KV缓存占用，用于内存感知的准入控制
+"""
+
+import logging
+from typing import Dict, Any
+
+logger = logging.getLogger(__name__)
+
+# 各数据类型的字节数
+DTYPE_BYTES = {
+    "float64": 8,
+    "float32": 4,
+    "float16": 2,
+    "bfloat16": 2,
+    "int8": 1,
+    "uint8": 1
+}
+
+def dtype_num_bytes(dtype: Any) -> int:
+    """获取数据类型的字节数，支持torch.dtype和字符串"""
+    name = str(dtype).replace("torch.", "")
+    if name not in DTYPE_BYTES:
+        raise ValueError(f"不支持的数据类型: {dtype}")
+    return DTYPE_BYTES[name]
+
+class KVCacheEstimator:
+    """KV缓存大小估算器
+    
+    每个token在每一层缓存一份K和一份V，大小为
+    2 * 层数 * KV头数 * 头维度 * 数据类型字节数。
+    """
+    
+    def __init__(self, num_layers: int, num_kv_heads: int, head_dim: int, dtype_bytes: int):
+        self.num_layers = num_layers
+        self.num_kv_heads = num_kv_heads
+        self.head_dim = head_dim
+        self.dtype_bytes = dtype_bytes
+    
+    @classmethod
+    def from_config(cls, config: Any, dtype: Any = None) -> "KVCacheEstimator":
+        """从模型配置创建估算器
+        
+        读取与ModelManager.get_model_info相同的字段：层数、注意力头数、隐藏层大小，
+        以及GQA模型的num_key_value_heads。dtype未指定时使用配置中的torch_dtype。
+        """
+        num_layers = getattr(config, "num_hidden_layers")
+        num_heads = getattr(config, "num_attention_heads")
+        hidden_size = getattr(config, "hidden_size")
+        num_kv_heads = getattr(config, "num_key_value_heads", None) or num_heads
+        head_dim = getattr(config, "head_dim", None) or hidden_size // num_heads
+        
+        if dtype is None:
+            dtype = getattr(config, "torch_dtype", None) or "float32"
+        
+        return cls(num_layers, num_kv_heads, head_dim, dtype_num_bytes(dtype))
+    
+    @property
+    def bytes_per_token(self) -> int:
+        """每个token的KV缓存字节数"""
+        return 2 * self.num_layers * self.num_kv_heads * self.head_dim * self.dtype_bytes
+    
+    def estimate(self, prompt_tokens: int, max_new_tokens: int, batch_size: int = 1) -> int:
+        """估算一次生成的KV缓存峰值字节数"""
+        return batch_size * (prompt_tokens + max_new_tokens) * self.bytes_per_token
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """导出估算参数"""
+        return {
+            "num_layers": self.num_layers,
+            "num_kv_heads": self.num_kv_heads,
+            "head_dim": self.head_dim,
+            "dtype_bytes": self.dtype_bytes,
+            "bytes_per_token": self.bytes_per_token
+        }
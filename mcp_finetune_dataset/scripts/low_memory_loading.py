@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+低内存模型加载
+CPU上以bfloat16加载权重，超出内存预算的层按accelerate设备映射卸载到磁盘，
+并在加载后报告常驻内存与磁盘卸载的权重大小。
+"""
+
+import os
+import logging
+from typing import Dict, Any, Optional
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OFFLOAD_FOLDER = "./cache/offload"
+
+# 配置中的数据类型名称
+TORCH_DTYPES = {
+    "float32": torch.float32,
+    "float16": torch.float16,
+    "bfloat16": torch.bfloat16
+}
+
+def resolve_torch_dtype(cpu_dtype: Optional[str] = None) -> torch.dtype:
+    """确定加载数据类型：CUDA上使用float16，CPU上使用配置的cpu_dtype（默认float32）"""
+    if torch.cuda.is_available():
+        return torch.float16
+    name = cpu_dtype or "float32"
+    if name not in TORCH_DTYPES:
+        raise ValueError(f"不支持的数据类型: {name}，可选: {', '.join(TORCH_DTYPES)}")
+    return TORCH_DTYPES[name]
+
+def plan_device_map(model_path: str, dtype: torch.dtype, max_memory_bytes: int,
+                    trust_remote_code: bool = False) -> Dict[str, Any]:
+    """在meta设备上构建模型，按内存预算规划CPU与磁盘的设备映射
+    
+    accelerate按模块顺序填充CPU预算，放不下的解码层映射到disk。
+    """
+    from accelerate import init_empty_weights, infer_auto_device_map
+    from transformers import AutoConfig, AutoModelForCausalLM
+    
+    config = AutoConfig.from_pretrained(model_path, trust_remote_code=trust_remote_code)
+    with init_empty_weights():
+        model = AutoModelForCausalLM.from_config(config, trust_remote_code=trust_remote_code)
+    model.tie_weights()
+    
+    return infer_auto_device_map(
+        model,
+        max_memory={"cpu": max_memory_bytes},
+        no_split_module_classes=model._no_split_modules or [],
+        dtype=dtype
+    )
+
+def build_load_kwargs(model_path: str, cpu_dtype: Optional[str] = None, max_memory_mb: Optional[int] = None,
+                      offload_folder: Optional[str] = None, device: str = "auto",
+                      trust_remote_code: bool = False) -> Dict[str, Any]:
+    """生成from_pretrained的加载参数
+    
+    CUDA上保持float16与device_map=device；CPU上使用cpu_dtype，设置max_memory_mb时
+    超出预算的层卸载到offload_folder。
+    """
+    dtype = resolve_torch_dtype(cpu_dtype)
+    if torch.cuda.is_available():
+        return {"torch_dtype": dtype, "device_map": device}
+    
+    kwargs = {"torch_dtype": dtype, "device_map": None, "low_cpu_mem_usage": True}
+    if not max_memory_mb:
+        return kwargs
+    
+    device_map = plan_device_map(model_path, dtype, int(max_memory_mb * 1024**2), trust_remote_code)
+    kwargs["device_map"] = device_map
+    if "disk" in device_map.values():
+        offload_folder = offload_folder or DEFAULT_OFFLOAD_FOLDER
+        os.makedirs(offload_folder, exist_ok=True)
+        kwargs["offload_folder"] = offload_folder
+        kwargs["offload_state_dict"] = True
+        offloaded = sum(1 for target in device_map.values() if target == "disk")
+        logger.info(f"内存预算 {max_memory_mb}MB 不足以容纳全部权重，{offloaded} 个模块将卸载到磁盘: {offload_folder}")
+    return kwargs
+
+def placement_report(model) -> Dict[str, Any]:
+    """统计常驻内存与磁盘卸载的权重字节数
+    
+    磁盘卸载的参数保留在meta设备上，前向计算时由accelerate的钩子按层读入。
+    """
+    resident_bytes = 0
+    offloaded_bytes = 0
+    for tensor in list(model.parameters()) + list(model.buffers()):
+        size = tensor.numel() * tensor.element_size()
+        if tensor.device.type == "meta":
+            offloaded_bytes += size
+        else:
+            resident_bytes += size
+    
+    device_map = getattr(model, "hf_device_map", None) or {}
+    offloaded_modules = [name for name, target in device_map.items() if target == "disk"]
+    
+    return {
+        "dtype": str(model.dtype).replace("torch.", ""),
+        "resident_bytes": resident_bytes,
+        "offloaded_bytes": offloaded_bytes,
+        "offloaded_modules": len(offloaded_modules),
+        "total_modules": len(device_map)
+    }
+
+def log_placement_report(report: Dict[str, Any]):
+    """输出加载报告"""
+    to_gb = lambda value: value / 1024**3
+    message = (f"模型加载报告: {report['dtype']}，常驻内存 {to_gb(report['resident_bytes']):.2f}GB，"
+               f"磁盘卸载 {to_gb(report['offloaded_bytes']):.2f}GB")
+    if report["offloaded_modules"]:
+        message += f"（{report['offloaded_modules']}/{report['total_modules']} 个模块，推理速度会下降）"
+    logger.info(message)
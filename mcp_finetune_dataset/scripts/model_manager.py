@@ -6,6 +6,7 @@
 """
 
 import os
+import sys
 import yaml
 import torch
 import logging
@@ -20,6 +21,10 @@ from huggingface_hub import snapshot_download, login
 import requests
 from tqdm import tqdm
 
+# 添加父目录到路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from scripts.low_memory_loading import build_load_kwargs, placement_report, log_placement_report
+
 logger = logging.getLogger(__name__)
 
 class ModelManager:
@@ -50,7 +55,10 @@ class ModelManager:
             "model": {
                 "name": "Qwen/Qwen2-7B-Instruct",
                 "max_length": 2048,
-                "device": "auto"
+                "device": "auto",
+                "cpu_dtype": "bfloat16",
+                "max_memory_mb": None,
+                "offload_folder": "./cache/offload"
             },
             "training": {
                 "num_epochs": 3,
@@ -72,6 +80,54 @@ class ModelManager:
                 "log_dir": "./logs",
                 "save_steps": 500,
                 "logging_steps": 10
+            },
+            "inference": {
+                "max_new_tokens": 512,
+                "max_new_tokens_limit": 2048,
+                "kv_cache_budget_mb": 4096,
+                "shared_weights": False,
+                "model_server_socket": None,
+                "scheduler": {
+                    "max_workers": 1
+                },
+                "backend": "torch",
+                "onnx": {
+                    "onnx_dir": None,
+                    "quantize": False,
+                    "num_threads": None
+                },
+                "compile": {
+                    "enabled": False,
+                    "mode": "default",
+                    "cache_dir": "./cache/torch_compile",
+                    "warmup": False,
+                    "prompt_buckets": [256, 512, 1024, 2048],
+                    "new_token_buckets": [128, 512, 2048]
+                },
+                "template_answers": {
+                    "get_weather": True,
+                    "calculate": True,
+                    "get_current_time": True
+                },
+                "semantic_cache": {
+                    "enabled": False,
+                    "embedder": "model",
+                    "model_name": None,
+                    "threshold": None,
+                    "ttl_seconds": 600,
+                    "max_entries": 10000,
+                    "excluded_tools": ["write_file"]
+                },
+                "speculative_tools": {
+                    "enabled": False,
+                    "threshold": 0.6,
+                    "tools": ["web_search", "get_weather", "list_files", "read_file", "calculate", "get_current_time"]
+                },
+                "router": {
+                    "enabled": False,
+                    "threshold": 0.9,
+                    "tools": ["get_current_time", "get_weather", "calculate", "web_search", "list_files"]
+                }
             }
         }
     
@@ -148,17 +204,24 @@ class ModelManager:
                 use_fast=False
             )
             
-            # 加载模型
-            device_map = self.config["model"].get("device", "auto")
-            torch_dtype = torch.float16 if torch.cuda.is_available() else torch.float32
+            # 加载模型：CPU上按cpu_dtype加载，设置max_memory_mb时超出预算的层卸载到磁盘
+            model_config = self.config["model"]
+            load_kwargs = build_load_kwargs(
+                model_path,
+                cpu_dtype=model_config.get("cpu_dtype"),
+                max_memory_mb=model_config.get("max_memory_mb"),
+                offload_folder=model_config.get("offload_folder"),
+                device=model_config.get("device", "auto"),
+                trust_remote_code=True
+            )
+            load_kwargs["low_cpu_mem_usage"] = True
             
             model = AutoModelForCausalLM.from_pretrained(
                 model_path,
-                torch_dtype=torch_dtype,
-                device_map=device_map if torch.cuda.is_available() else None,
                 trust_remote_code=True,
-                low_cpu_mem_usage=True
+                **load_kwargs
             )
+            log_placement_report(placement_report(model))
             
             # 设置pad token
             if tokenizer.pad_token is None:
@@ -184,6 +247,8 @@ class ModelManager:
                 "hidden_size": getattr(config, 'hidden_size', 'Unknown'),
                 "num_layers": getattr(config, 'num_hidden_layers', 'Unknown'),
                 "num_attention_heads": getattr(config, 'num_attention_heads', 'Unknown'),
+                "num_key_value_heads": getattr(config, 'num_key_value_heads', 'Unknown'),
+                "torch_dtype": str(getattr(config, 'torch_dtype', 'Unknown')),
                 "max_position_embeddings": getattr(config, 'max_position_embeddings', 'Unknown')
             }
             
@@ -0,0 +1,514 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+独立模型服务进程
+由一个进程持有MCPInference，多个API工作进程通过本地Unix套接字与其通信。
+token id以原始int32数组传输，不经过JSON序列化；API进程只加载分词器。
+"""
+
+import os
+import sys
+import json
+import time
+import select
+import signal
+import socket
+import struct
+import logging
+import threading
+from types import SimpleNamespace
+from typing import Dict, Any, List, Optional, Union
+
+import torch
+from transformers import AutoTokenizer
+
+# 添加父目录到路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from scripts.inference import MCPInference
+from scripts.kv_cache_estimator import KVCacheEstimator
+from scripts.replica_pool import parse_cpu_list, pin_current_process
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOCKET_PATH = "/tmp/mcp_model_server.sock"
+
+# 协议帧：固定长度头 + 原始负载
+MAGIC = b"MCPS"
+# magic, 操作码, 负载长度(元素数或字节数), max_new_tokens, temperature
+REQUEST_HEADER = struct.Struct("<4sBxxxIIf")
+# magic, 状态码, 负载长度, 生成token数, 耗时
+RESPONSE_HEADER = struct.Struct("<4sBxxxIIf")
+
+OP_GENERATE = 1
+OP_INFO = 2
+# 打分请求负载: [候选数, 提示长度, 各候选长度..., 提示token..., 各候选token...]，响应为float32对数概率
+OP_SCORE = 3
+
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+# token id以小端int32传输
+TOKEN_DTYPE = torch.int32
+TOKEN_SIZE = 4
+# 打分结果以float32传输，与token id等宽
+SCORE_DTYPE = torch.float32
+
+# 请求负载上限，在分配接收缓冲区之前检查：生成请求不超过模型的max_position_embeddings，
+# 打分请求包含多个候选，不超过MAX_REQUEST_TOKENS（4MiB）
+MAX_REQUEST_TOKENS = 1024 * 1024
+MAX_INFO_BYTES = 64 * 1024
+
+def _recv_exact(sock: socket.socket, size: int) -> bytearray:
+    """接收指定长度的数据到预分配缓冲区"""
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:], size - received)
+        if count == 0:
+            raise ConnectionError("连接已关闭")
+        received += count
+    return buffer
+
+def _send_frame(sock: socket.socket, header: bytes, payload=None):
+    """发送帧，负载通过分散写直接从张量内存发送"""
+    buffers = [header]
+    if payload is not None and len(payload):
+        buffers.append(payload)
+    total = sum(len(memoryview(buf).cast("B")) for buf in buffers)
+    sent = sock.sendmsg(buffers)
+    if sent < total:
+        # 分散写未能一次写完时补发剩余部分
+        remaining = b"".join(bytes(memoryview(buf).cast("B")) for buf in buffers)[sent:]
+        sock.sendall(remaining)
+
+def _tensor_buffer(tensor: torch.Tensor) -> memoryview:
+    """获取int32张量的内存视图（连续张量不复制）"""
+    return memoryview(tensor.to(TOKEN_DTYPE).contiguous().numpy()).cast("B")
+
+class SocketCancelEvent:
+    """以客户端连接状态作为取消令牌
+    
+    客户端取消请求时直接关闭连接，生成的停止条件每步检查连接是否已关闭。
+    """
+    
+    def __init__(self, conn: socket.socket):
+        self.conn = conn
+        self._closed = False
+    
+    def is_set(self) -> bool:
+        if self._closed:
+            return True
+        try:
+            readable, _, _ = select.select([self.conn], [], [], 0)
+            if readable and self.conn.recv(1, socket.MSG_PEEK) == b"":
+                self._closed = True
+        except OSError:
+            self._closed = True
+        return self._closed
+    
+    def set(self):
+        self._closed = True
+
+class ModelServer:
+    """模型服务进程
+    
+    每个连接一个线程，同一时间只有一个请求在模型上生成。
+    """
+    
+    def __init__(self, inference: MCPInference, socket_path: str = DEFAULT_SOCKET_PATH):
+        self.inference = inference
+        self.socket_path = socket_path
+        self._model_lock = threading.Lock()
+        max_positions = getattr(inference.backend.config, "max_position_embeddings", None)
+        self.max_prompt_tokens = min(max_positions or MAX_REQUEST_TOKENS, MAX_REQUEST_TOKENS)
+    
+    def payload_limit(self, op: int) -> int:
+        """操作码对应的最大负载长度（元素数或字节数）"""
+        if op == OP_GENERATE:
+            return self.max_prompt_tokens
+        if op == OP_SCORE:
+            return MAX_REQUEST_TOKENS
+        return MAX_INFO_BYTES
+    
+    def server_info(self) -> Dict[str, Any]:
+        """API进程初始化所需的模型信息"""
+        backend = self.inference.backend
+        return {
+            "model_path": self.inference.model_path,
+            "base_model_name": self.inference.base_model_name,
+            "tokenizer_path": self.inference.tokenizer.name_or_path,
+            "shared_weights": self.inference.shared_weights,
+            "backend": backend.describe(),
+            "dtype": str(backend.dtype),
+            "config": backend.config.to_dict(),
+            "pid": os.getpid()
+        }
+    
+    def serve_forever(self):
+        """监听Unix套接字并处理请求"""
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.socket_path)
+        server.listen(128)
+        logger.info(f"模型服务已启动: {self.socket_path}")
+        
+        try:
+            while True:
+                conn, _ = server.accept()
+                threading.Thread(target=self._handle_connection, args=(conn,), daemon=True).start()
+        finally:
+            server.close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+    
+    def _handle_connection(self, conn: socket.socket):
+        """处理一个连接上的连续请求"""
+        try:
+            while True:
+                try:
+                    header = _recv_exact(conn, REQUEST_HEADER.size)
+                except ConnectionError:
+                    return
+                
+                magic, op, length, max_new_tokens, temperature = REQUEST_HEADER.unpack(header)
+                if magic != MAGIC:
+                    logger.error("收到无效的请求帧，关闭连接")
+                    return
+                
+                if length > self.payload_limit(op):
+                    # 负载未读取，连接上的后续数据无法再按帧解析
+                    logger.error(f"请求负载过长（操作码 {op}，长度 {length}），关闭连接")
+                    body = f"请求负载过长: {length}，上限 {self.payload_limit(op)}".encode("utf-8")
+                    try:
+                        _send_frame(conn, RESPONSE_HEADER.pack(MAGIC, STATUS_ERROR, len(body), 0, 0.0), body)
+                    except OSError:
+                        pass
+                    return
+                
+                payload = _recv_exact(conn, length * TOKEN_SIZE if op in (OP_GENERATE, OP_SCORE) else length)
+                
+                try:
+                    if op == OP_GENERATE:
+                        self._handle_generate(conn, payload, max_new_tokens, temperature)
+                    elif op == OP_SCORE:
+                        self._handle_score(conn, payload)
+                    elif op == OP_INFO:
+                        body = json.dumps(self.server_info()).encode("utf-8")
+                        _send_frame(conn, RESPONSE_HEADER.pack(MAGIC, STATUS_OK, len(body), 0, 0.0), body)
+                    else:
+                        raise ValueError(f"未知操作码: {op}")
+                except (ConnectionError, BrokenPipeError):
+                    return
+                except Exception as e:
+                    logger.error(f"请求处理失败: {e}")
+                    body = str(e).encode("utf-8")
+                    _send_frame(conn, RESPONSE_HEADER.pack(MAGIC, STATUS_ERROR, len(body), 0, 0.0), body)
+        finally:
+            conn.close()
+    
+    def _handle_generate(self, conn: socket.socket, payload: bytearray, max_new_tokens: int, temperature: float):
+        """在模型上生成并返回新token"""
+        # 直接在接收缓冲区上构造张量
+        input_ids = torch.frombuffer(payload, dtype=TOKEN_DTYPE).to(torch.long).unsqueeze(0)
+        attention_mask = torch.ones_like(input_ids)
+        cancel_event = SocketCancelEvent(conn)
+        stats: Dict[str, Any] = {}
+        
+        with self._model_lock:
+            if cancel_event.is_set():
+                return
+            new_ids = self.inference._generate_ids(
+                input_ids,
+                attention_mask,
+                max_new_tokens=max_new_tokens,
+                temperature=temperature,
+                cancel_event=cancel_event,
+                stats=stats
+            )
+        
+        if new_ids is None:
+            # 客户端已断开，无需响应
+            raise ConnectionError("客户端已取消请求")
+        
+        body = _tensor_buffer(new_ids.cpu())
+        header = RESPONSE_HEADER.pack(MAGIC, STATUS_OK, len(new_ids), stats.get("generated_tokens", 0),
+                                      stats.get("elapsed", 0.0))
+        _send_frame(conn, header, body)
+    
+    def _handle_score(self, conn: socket.socket, payload: bytearray):
+        """对候选续写打分并返回逐token的对数概率"""
+        values = torch.frombuffer(payload, dtype=TOKEN_DTYPE).to(torch.long)
+        num_candidates, prompt_length = int(values[0]), int(values[1])
+        lengths = values[2:2 + num_candidates].tolist()
+        offset = 2 + num_candidates
+        prompt_ids = values[offset:offset + prompt_length]
+        candidate_ids = list(torch.split(values[offset + prompt_length:], lengths))
+        stats: Dict[str, Any] = {}
+        
+        with self._model_lock:
+            token_log_probs = self.inference._score_ids(prompt_ids, candidate_ids, stats=stats)
+        
+        scores = torch.cat(token_log_probs).to(SCORE_DTYPE).contiguous()
+        body = memoryview(scores.numpy()).cast("B")
+        header = RESPONSE_HEADER.pack(MAGIC, STATUS_OK, len(scores), 0, stats.get("elapsed", 0.0))
+        _send_frame(conn, header, body)
+
+class _Replica:
+    """一个模型服务副本的连接池与负载计数"""
+    
+    def __init__(self, socket_path: str):
+        self.socket_path = socket_path
+        self.pool: List[socket.socket] = []
+        self.in_flight = 0
+        self.served = 0
+        self.failed = 0
+    
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "socket": self.socket_path,
+            "in_flight": self.in_flight,
+            "served": self.served,
+            "failed": self.failed
+        }
+
+class RemoteInference(MCPInference):
+    """通过模型服务进程推理的MCPInference
+    
+    只在本进程加载分词器，生成请求经Unix套接字发送给模型服务进程。
+    提示编码、工具调用解析与执行仍在API进程中完成。给出多个套接字时，
+    每个请求发往进行中请求最少的副本。
+    """
+    
+    def __init__(self, socket_path: Union[str, List[str]] = DEFAULT_SOCKET_PATH, pool_size: int = 8):
+        socket_paths = [socket_path] if isinstance(socket_path, str) else list(socket_path)
+        if not socket_paths:
+            raise ValueError("至少需要一个模型服务套接字")
+        self.socket_paths = socket_paths
+        self.pool_size = pool_size
+        self.replicas = [_Replica(path) for path in socket_paths]
+        self._pool_lock = threading.Lock()
+        self.model = None
+        self.tokenizer = None
+        self.kv_estimator = None
+        self.model_path = None
+        self.base_model_name = None
+        self.shared_weights = False
+        self.compile_config = {}
+        self.compiled_generator = None
+        self.backend_name = "remote"
+        self.backend_options = {}
+        self.backend = None
+        self.semantic_cache = None
+        self.speculator = None
+        self.server = {}
+        self.load_model()
+    
+    def load_model(self):
+        """从模型服务获取模型信息并加载分词器"""
+        logger.info(f"连接模型服务: {', '.join(self.socket_paths)}")
+        infos = [self._request_info(replica) for replica in self.replicas]
+        self.server = infos[0]
+        models = {info["model_path"] for info in infos}
+        if len(models) > 1:
+            raise ValueError(f"模型服务副本加载了不同的模型: {sorted(models)}")
+        
+        self.model_path = self.server["model_path"]
+        self.base_model_name = self.server["base_model_name"]
+        self.shared_weights = self.server["shared_weights"]
+        self.tokenizer = AutoTokenizer.from_pretrained(self.server["tokenizer_path"])
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        
+        config = SimpleNamespace(**self.server["config"])
+        self.kv_estimator = KVCacheEstimator.from_config(config, self.server["dtype"])
+        pids = ", ".join(str(info["pid"]) for info in infos)
+        logger.info(f"已连接 {len(infos)} 个模型服务副本 (pid={pids}): {self.model_path}")
+    
+    def _acquire_replica(self) -> _Replica:
+        """选择进行中请求最少的副本并占用一个名额"""
+        with self._pool_lock:
+            replica = min(self.replicas, key=lambda item: (item.in_flight, item.served))
+            replica.in_flight += 1
+            return replica
+    
+    def _finish_replica(self, replica: _Replica, failed: bool = False):
+        """释放副本名额"""
+        with self._pool_lock:
+            replica.in_flight -= 1
+            if failed:
+                replica.failed += 1
+            else:
+                replica.served += 1
+    
+    def _connect(self, replica: _Replica) -> socket.socket:
+        """从副本的连接池获取连接"""
+        with self._pool_lock:
+            if replica.pool:
+                return replica.pool.pop()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(replica.socket_path)
+        return sock
+    
+    def _release(self, replica: _Replica, sock: socket.socket):
+        """归还连接"""
+        with self._pool_lock:
+            if len(replica.pool) < self.pool_size:
+                replica.pool.append(sock)
+                return
+        sock.close()
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """获取各副本的负载"""
+        with self._pool_lock:
+            return {"replicas": [replica.snapshot() for replica in self.replicas]}
+    
+    def _read_response(self, sock: socket.socket):
+        """读取响应帧"""
+        magic, status, length, generated_tokens, elapsed = RESPONSE_HEADER.unpack(
+            _recv_exact(sock, RESPONSE_HEADER.size)
+        )
+        if magic != MAGIC:
+            raise ConnectionError("模型服务返回了无效的响应帧")
+        
+        payload_size = length * TOKEN_SIZE if status == STATUS_OK else length
+        payload = _recv_exact(sock, payload_size) if payload_size else bytearray()
+        if status != STATUS_OK:
+            raise RuntimeError(f"模型服务错误: {payload.decode('utf-8', errors='replace')}")
+        return payload, length, generated_tokens, elapsed
+    
+    def _request_info(self, replica: _Replica) -> Dict[str, Any]:
+        """获取模型服务信息"""
+        sock = self._connect(replica)
+        try:
+            _send_frame(sock, REQUEST_HEADER.pack(MAGIC, OP_INFO, 0, 0, 0.0))
+            magic, status, length, _, _ = RESPONSE_HEADER.unpack(_recv_exact(sock, RESPONSE_HEADER.size))
+            body = _recv_exact(sock, length)
+            if status != STATUS_OK:
+                raise RuntimeError(f"模型服务错误: {body.decode('utf-8', errors='replace')}")
+        except Exception:
+            sock.close()
+            raise
+        self._release(replica, sock)
+        return json.loads(body)
+    
+    def _generate_ids(self, input_ids: torch.Tensor, attention_mask: torch.Tensor,
+                      max_new_tokens: int = 512, temperature: float = 0.7,
+                      cancel_event: Optional[threading.Event] = None,
+                      stats: Optional[Dict[str, Any]] = None) -> Optional[torch.Tensor]:
+        """发送token id到模型服务生成；取消时关闭连接，服务端在下一个解码步终止"""
+        prompt_ids = input_ids[0][attention_mask[0].bool()]
+        header = REQUEST_HEADER.pack(MAGIC, OP_GENERATE, len(prompt_ids), max_new_tokens,
+                                     temperature if temperature is not None else 0.0)
+        replica = self._acquire_replica()
+        start_time = time.perf_counter()
+        
+        try:
+            sock = self._connect(replica)
+        except Exception:
+            self._finish_replica(replica, failed=True)
+            raise
+        
+        try:
+            _send_frame(sock, header, _tensor_buffer(prompt_ids))
+            
+            # 等待响应期间轮询取消令牌
+            while True:
+                readable, _, _ = select.select([sock], [], [], 0.05)
+                if readable:
+                    break
+                if cancel_event is not None and cancel_event.is_set():
+                    sock.close()
+                    self._finish_replica(replica)
+                    self._record_stats(stats, cancelled=True, elapsed=time.perf_counter() - start_time)
+                    return None
+            
+            payload, length, generated_tokens, elapsed = self._read_response(sock)
+        except Exception:
+            sock.close()
+            self._finish_replica(replica, failed=True)
+            raise
+        
+        self._release(replica, sock)
+        self._finish_replica(replica)
+        self._record_stats(stats, prompt_tokens=len(prompt_ids), generated_tokens=generated_tokens, elapsed=elapsed)
+        # 直接在接收缓冲区上构造张量
+        return torch.frombuffer(payload, dtype=TOKEN_DTYPE) if length else torch.empty(0, dtype=TOKEN_DTYPE)
+    
+    def _score_ids(self, prompt_ids: torch.Tensor, candidate_ids: List[torch.Tensor],
+                   stats: Optional[Dict[str, Any]] = None) -> List[torch.Tensor]:
+        """发送提示与候选到模型服务打分"""
+        lengths = [len(ids) for ids in candidate_ids]
+        request_ids = torch.cat([torch.tensor([len(candidate_ids), len(prompt_ids)] + lengths), prompt_ids, *candidate_ids])
+        header = REQUEST_HEADER.pack(MAGIC, OP_SCORE, len(request_ids), 0, 0.0)
+        replica = self._acquire_replica()
+        
+        try:
+            sock = self._connect(replica)
+            try:
+                _send_frame(sock, header, _tensor_buffer(request_ids))
+                payload, _, _, elapsed = self._read_response(sock)
+            except Exception:
+                sock.close()
+                raise
+        except Exception:
+            self._finish_replica(replica, failed=True)
+            raise
+        
+        self._release(replica, sock)
+        self._finish_replica(replica)
+        self._record_stats(stats, prompt_tokens=len(prompt_ids), scored_tokens=sum(lengths), elapsed=elapsed)
+        return list(torch.split(torch.frombuffer(payload, dtype=SCORE_DTYPE), lengths))
+
+def main():
+    import argparse
+    
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    
+    parser = argparse.ArgumentParser(description="MCP模型服务进程")
+    parser.add_argument("--model_path", type=str, required=True, help="模型路径")
+    parser.add_argument("--base_model", type=str, help="基础模型名称（LoRA模型需要）")
+    parser.add_argument("--socket", type=str, default=DEFAULT_SOCKET_PATH, help="Unix套接字路径")
+    parser.add_argument("--shared-weights", action="store_true", help="内存映射safetensors权重")
+    parser.add_argument("--compile", action="store_true", help="使用静态KV缓存并编译解码步")
+    parser.add_argument("--compile-cache-dir", type=str, default="./cache/torch_compile", help="编译产物缓存目录")
+    parser.add_argument("--warmup", action="store_true", help="启动时按长度桶预先编译")
+    parser.add_argument("--backend", type=str, default="torch", help="推理后端: torch 或 onnx")
+    parser.add_argument("--quantize", action="store_true", help="onnx后端使用int8动态量化模型")
+    parser.add_argument("--cpu-dtype", type=str, choices=["float32", "bfloat16"], help="CPU上的权重数据类型")
+    parser.add_argument("--max-memory-mb", type=int, help="CPU内存预算（MB），超出部分的层卸载到磁盘")
+    parser.add_argument("--cpus", type=str, help="绑定的CPU核心，如 0-15")
+    parser.add_argument("--threads", type=int, help="intra-op线程数，默认等于绑定的核心数")
+    
+    args = parser.parse_args()
+    
+    # 绑定核心需在加载模型前完成，线程池按此配置创建
+    num_threads = args.threads
+    if args.cpus:
+        cpus = parse_cpu_list(args.cpus)
+        pin_current_process(cpus, args.threads)
+        num_threads = args.threads or len(cpus)
+    elif args.threads:
+        torch.set_num_threads(args.threads)
+    
+    # 由副本池终止时正常退出，清理套接字文件
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    
+    compile_config = {"enabled": args.compile, "cache_dir": args.compile_cache_dir, "warmup": args.warmup}
+    backend_options = {"quantize": True} if args.quantize else {}
+    if args.backend == "onnx" and num_threads:
+        backend_options["num_threads"] = num_threads
+    if args.backend == "torch":
+        backend_options.update(cpu_dtype=args.cpu_dtype, max_memory_mb=args.max_memory_mb)
+    inference = MCPInference(args.model_path, args.base_model, shared_weights=args.shared_weights,
+                             compile_config=compile_config, backend=args.backend,
+                             backend_options=backend_options)
+    ModelServer(inference, args.socket).serve_forever()
+
+if __name__ == "__main__":
+    main()
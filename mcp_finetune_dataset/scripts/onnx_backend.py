@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ONNX Runtime推理后端
+将合并后的微调模型导出为带KV缓存输入输出的ONNX模型，在CPU上用ONNX Runtime推理，
+可选int8动态量化。依赖 optimum[onnxruntime]。
+"""
+
+import os
+import sys
+import logging
+import tempfile
+from typing import Dict, Any, Optional
+
+import torch
+from transformers import AutoTokenizer
+
+# 添加父目录到路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from scripts.inference import InferenceBackend, register_backend
+from scripts.shared_weights import export_merged_model
+
+logger = logging.getLogger(__name__)
+
+ONNX_MODEL_FILE = "model.onnx"
+QUANTIZED_MODEL_FILE = "model_quantized.onnx"
+
+def default_onnx_dir(model_path: str) -> str:
+    """ONNX模型默认导出目录"""
+    return os.path.join(model_path, "onnx")
+
+def export_onnx(model_path: str, onnx_dir: str, base_model_name: Optional[str] = None):
+    """导出ONNX模型，LoRA适配器先合并到基础模型
+    
+    导出的解码器以past_key_values为输入输出，解码步只计算新token。
+    """
+    from optimum.onnxruntime import ORTModelForCausalLM
+    
+    base_model = InferenceBackend.resolve_base_model(model_path, base_model_name)
+    with tempfile.TemporaryDirectory() as merged_dir:
+        source_dir = model_path
+        if base_model is not None:
+            export_merged_model(model_path, merged_dir, base_model)
+            source_dir = merged_dir
+        
+        logger.info(f"导出ONNX模型: {source_dir} -> {onnx_dir}")
+        model = ORTModelForCausalLM.from_pretrained(source_dir, export=True, use_cache=True)
+        model.save_pretrained(onnx_dir)
+        AutoTokenizer.from_pretrained(source_dir).save_pretrained(onnx_dir)
+
+def _cpu_flags() -> set:
+    """读取CPU指令集标志"""
+    try:
+        with open("/proc/cpuinfo", "r") as f:
+            for line in f:
+                if line.startswith("flags"):
+                    return set(line.split(":", 1)[1].split())
+    except OSError:
+        pass
+    return set()
+
+def quantize_onnx(onnx_dir: str) -> str:
+    """int8动态量化，返回量化模型文件名"""
+    from optimum.onnxruntime import ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    
+    # 支持VNNI指令的CPU使用对应的量化配置
+    if "avx512_vnni" in _cpu_flags():
+        quantization_config = AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+    else:
+        quantization_config = AutoQuantizationConfig.avx2(is_static=False, per_channel=False)
+    
+    # 超过2GB的模型权重以外部数据文件保存
+    external_data = os.path.exists(os.path.join(onnx_dir, ONNX_MODEL_FILE + "_data"))
+    quantizer = ORTQuantizer.from_pretrained(onnx_dir, file_name=ONNX_MODEL_FILE)
+    quantizer.quantize(save_dir=onnx_dir, quantization_config=quantization_config,
+                       use_external_data_format=external_data)
+    logger.info(f"int8量化完成: {os.path.join(onnx_dir, QUANTIZED_MODEL_FILE)}")
+    return QUANTIZED_MODEL_FILE
+
+@register_backend
+class ONNXBackend(InferenceBackend):
+    """ONNX Runtime CPU后端
+    
+    选项:
+        onnx_dir: ONNX模型目录，默认为模型目录下的onnx子目录，不存在时自动导出
+        quantize: 使用int8动态量化模型，不存在时自动量化
+        num_threads: ONNX Runtime的intra-op线程数
+    """
+    
+    name = "onnx"
+    
+    def load(self):
+        import onnxruntime
+        from optimum.onnxruntime import ORTModelForCausalLM
+        
+        onnx_dir = self.options.get("onnx_dir") or default_onnx_dir(self.model_path)
+        if not os.path.exists(os.path.join(onnx_dir, ONNX_MODEL_FILE)):
+            export_onnx(self.model_path, onnx_dir, self.base_model_name)
+        
+        file_name = ONNX_MODEL_FILE
+        if self.options.get("quantize"):
+            file_name = QUANTIZED_MODEL_FILE
+            if not os.path.exists(os.path.join(onnx_dir, file_name)):
+                quantize_onnx(onnx_dir)
+        
+        session_options = onnxruntime.SessionOptions()
+        session_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        session_options.inter_op_num_threads = 1
+        if self.options.get("num_threads"):
+            session_options.intra_op_num_threads = self.options["num_threads"]
+        
+        self.onnx_dir = onnx_dir
+        self.file_name = file_name
+        self.model = ORTModelForCausalLM.from_pretrained(
+            onnx_dir,
+            file_name=file_name,
+            provider="CPUExecutionProvider",
+            session_options=session_options,
+            use_cache=True,
+            use_io_binding=False
+        )
+        self.tokenizer = AutoTokenizer.from_pretrained(onnx_dir)
+        logger.info(f"ONNX Runtime会话已创建: {os.path.join(onnx_dir, file_name)}")
+    
+    @property
+    def dtype(self) -> torch.dtype:
+        # 导出的模型与KV缓存均为float32，量化只作用于权重
+        return torch.float32
+    
+    @property
+    def device(self) -> torch.device:
+        return torch.device("cpu")
+    
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "backend": self.name,
+            "onnx_dir": self.onnx_dir,
+            "file_name": self.file_name,
+            "quantized": self.file_name == QUANTIZED_MODEL_FILE
+        }
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+多副本CPU推理
+将可用CPU核心划分为互不重叠的核心组，每组启动一个绑定核心的模型服务副本，
+避免单个大实例的线程争用和内存带宽抖动。API进程按负载将请求分发到各副本。
+"""
+
+import os
+import sys
+import time
+import signal
+import socket
+import logging
+import subprocess
+from typing import Dict, Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+MODEL_SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "model_server.py")
+
+def parse_cpu_list(spec: str) -> List[int]:
+    """解析CPU列表，格式与taskset一致，如 "0-15,32-47" """
+    cpus = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            start, end = part.split("-", 1)
+            cpus.extend(range(int(start), int(end) + 1))
+        else:
+            cpus.append(int(part))
+    if not cpus:
+        raise ValueError(f"无效的CPU列表: {spec}")
+    return sorted(set(cpus))
+
+def format_cpu_list(cpus: List[int]) -> str:
+    """将CPU编号列表格式化为紧凑的区间表示"""
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and cpu == ranges[-1][1] + 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ",".join(f"{start}-{end}" if start != end else str(start) for start, end in ranges)
+
+def socket_ready(socket_path: str) -> bool:
+    """检查Unix套接字是否已在监听"""
+    if not os.path.exists(socket_path):
+        return False
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.close()
+
+def available_cpus() -> List[int]:
+    """当前进程可用的CPU核心"""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+def partition_cores(num_replicas: int, cpus: Optional[List[int]] = None) -> List[List[int]]:
+    """将CPU核心均分为连续的核心组
+    
+    连续编号的核心通常位于同一物理插槽（NUMA节点），同一副本的线程共享本地内存带宽。
+    """
+    cpus = sorted(cpus if cpus is not None else available_cpus())
+    if num_replicas < 1:
+        raise ValueError("副本数必须至少为1")
+    if num_replicas > len(cpus):
+        raise ValueError(f"副本数 {num_replicas} 超过可用核心数 {len(cpus)}")
+    
+    size, remainder = divmod(len(cpus), num_replicas)
+    groups = []
+    start = 0
+    for index in range(num_replicas):
+        end = start + size + (1 if index < remainder else 0)
+        groups.append(cpus[start:end])
+        start = end
+    return groups
+
+def pin_current_process(cpus: List[int], num_threads: Optional[int] = None):
+    """将当前进程绑定到指定核心，并按核心数设置torch线程数
+    
+    需在加载模型和首次运算之前调用，OpenMP线程池在首次使用时按此配置创建。
+    """
+    import torch
+    
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+    else:
+        logger.warning("当前平台不支持CPU绑定，仅设置线程数")
+    
+    num_threads = num_threads or len(cpus)
+    os.environ["OMP_NUM_THREADS"] = str(num_threads)
+    torch.set_num_threads(num_threads)
+    # 单个请求内不需要算子间并行，避免额外线程争用核心
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # 算子间线程池已创建时无法再修改
+        pass
+    logger.info(f"已绑定CPU {format_cpu_list(cpus)}，intra-op线程数 {num_threads}")
+
+class ReplicaPool:
+    """模型服务副本进程组
+    
+    每个副本是一个独立的 scripts/model_server.py 进程，绑定到一组核心并监听各自的套接字。
+    开启共享权重时各副本以内存映射方式加载同一份safetensors，权重页只占一份物理内存。
+    """
+    
+    def __init__(self, model_path: str, num_replicas: int, base_model_name: Optional[str] = None,
+                 socket_prefix: str = "/tmp/mcp_replica", shared_weights: bool = True,
+                 cpus: Optional[List[int]] = None, threads_per_replica: Optional[int] = None,
+                 extra_args: Optional[List[str]] = None):
+        self.model_path = model_path
+        self.base_model_name = base_model_name
+        self.shared_weights = shared_weights
+        self.threads_per_replica = threads_per_replica
+        self.extra_args = extra_args or []
+        self.core_groups = partition_cores(num_replicas, cpus)
+        self.socket_paths = [f"{socket_prefix}_{index}.sock" for index in range(num_replicas)]
+        self.processes: List[subprocess.Popen] = []
+    
+    def start(self):
+        """启动所有副本进程"""
+        for socket_path, cpus in zip(self.socket_paths, self.core_groups):
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)
+            
+            command = [
+                sys.executable, MODEL_SERVER_SCRIPT,
+                "--model_path", self.model_path,
+                "--socket", socket_path,
+                "--cpus", format_cpu_list(cpus)
+            ]
+            if self.base_model_name:
+                command += ["--base_model", self.base_model_name]
+            if self.shared_weights:
+                command.append("--shared-weights")
+            if self.threads_per_replica:
+                command += ["--threads", str(self.threads_per_replica)]
+            command += self.extra_args
+            
+            self.processes.append(subprocess.Popen(command))
+            logger.info(f"已启动模型副本: {socket_path} (CPU {format_cpu_list(cpus)})")
+    
+    def wait_ready(self, timeout: float = 600.0):
+        """等待所有副本的套接字就绪"""
+        deadline = time.monotonic() + timeout
+        pending = list(zip(self.socket_paths, self.processes))
+        while pending:
+            for socket_path, process in list(pending):
+                if process.poll() is not None:
+                    self.stop()
+                    raise RuntimeError(f"模型副本启动失败（退出码 {process.returncode}）: {socket_path}")
+                if socket_ready(socket_path):
+                    pending.remove((socket_path, process))
+            if pending and time.monotonic() > deadline:
+                self.stop()
+                raise TimeoutError(f"等待模型副本就绪超时: {[path for path, _ in pending]}")
+            time.sleep(0.5)
+        logger.info(f"{len(self.processes)} 个模型副本已就绪")
+    
+    def stop(self, timeout: float = 10.0):
+        """终止所有副本进程"""
+        for process in self.processes:
+            if process.poll() is None:
+                process.send_signal(signal.SIGTERM)
+        for process in self.processes:
+            try:
+                process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        self.processes = []
+    
+    def describe(self) -> List[Dict[str, Any]]:
+        """副本的核心分配"""
+        return [
+            {"socket": socket_path, "cpus": format_cpu_list(cpus)}
+            for socket_path, cpus in zip(self.socket_paths, self.core_groups)
+        ]
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+语义响应缓存
+将规范化后的用户请求向量化存入内存向量索引，相似请求（如"北京今天天气"与"北京的天气如何？"）
+命中时直接复用缓存的工具调用，跳过第一轮生成。缓存的是工具调用而不是工具结果，
+命中后工具仍会重新执行，结果始终是最新的。
+"""
+
+import re
+import time
+import zlib
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 结尾的标点和语气词不影响请求含义
+TRAILING_CHARACTERS = "。！？!?.，,~ 呢吗呀啊"
+
+# 各向量化方式的默认相似度阈值；ngram向量只反映字面重合，需要更低的阈值才能匹配改写
+DEFAULT_THRESHOLDS = {
+    "model": 0.9,
+    "sentence_transformers": 0.85,
+    "ngram": 0.65
+}
+
+# 有副作用的工具默认不缓存，相似请求不应重复执行写操作
+DEFAULT_EXCLUDED_TOOLS = ["write_file"]
+
+def normalize_request(text: str) -> str:
+    """规范化用户请求：全角转半角、小写、合并空白、去掉结尾标点"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.rstrip(TRAILING_CHARACTERS)
+
+def _compact(text: str) -> str:
+    """去掉空白后比较参数，"125 * 37" 与 "125*37" 视为相同"""
+    return re.sub(r"\s+", "", normalize_request(text))
+
+class NgramEmbedder:
+    """字符n-gram哈希向量，不依赖模型，适合API进程不持有模型时使用"""
+    
+    name = "ngram"
+    
+    def __init__(self, dim: int = 2048, n_values=(1, 2, 3)):
+        self.dim = dim
+        self.n_values = n_values
+    
+    def embed(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for n in self.n_values:
+            for i in range(len(text) - n + 1):
+                vector[zlib.crc32(text[i:i + n].encode("utf-8")) % self.dim] += 1.0
+        return vector
+
+class ModelEmbedder:
+    """微调模型最后一层隐藏状态的均值作为请求向量
+    
+    需要在持有模型的进程中使用；向量化是一次很短的预填充，远小于一次生成的开销。
+    """
+    
+    name = "model"
+    
+    def __init__(self, inference):
+        self.inference = inference
+    
+    def embed(self, text: str) -> np.ndarray:
+        import torch
+        
+        inputs = self.inference.tokenizer(text, return_tensors="pt")
+        device = self.inference.backend.device
+        with torch.no_grad():
+            outputs = self.inference.backend.forward(
+                input_ids=inputs["input_ids"].to(device),
+                attention_mask=inputs["attention_mask"].to(device),
+                output_hidden_states=True
+            )
+        return outputs.hidden_states[-1][0].float().mean(dim=0).cpu().numpy()
+
+class SentenceTransformerEmbedder:
+    """本地句向量模型，依赖 sentence-transformers"""
+    
+    name = "sentence_transformers"
+    
+    def __init__(self, model_name: str):
+        from sentence_transformers import SentenceTransformer
+        
+        self.model = SentenceTransformer(model_name, device="cpu")
+    
+    def embed(self, text: str) -> np.ndarray:
+        return self.model.encode(text, convert_to_numpy=True).astype(np.float32)
+
+def create_embedder(name: str, inference=None, model_name: Optional[str] = None):
+    """按配置创建向量化器；模型不在本进程时model退回ngram"""
+    if name == "model":
+        backend = getattr(inference, "backend", None)
+        if backend is not None and backend.name == "torch":
+            return ModelEmbedder(inference)
+        logger.warning("当前进程没有可用的torch模型，语义缓存改用ngram向量")
+        return NgramEmbedder()
+    if name == "sentence_transformers":
+        if not model_name:
+            raise ValueError("sentence_transformers向量化需要配置model_name")
+        return SentenceTransformerEmbedder(model_name)
+    if name == "ngram":
+        return NgramEmbedder()
+    raise ValueError(f"未知的向量化方式: {name}，可选: model, sentence_transformers, ngram")
+
+class _Entry:
+    """缓存条目"""
+    
+    def __init__(self, text: str, vector: np.ndarray, value: Dict[str, Any], expires_at: float):
+        self.text = text
+        self.vector = vector
+        self.value = value
+        self.expires_at = expires_at
+
+class SemanticCache:
+    """语义缓存
+    
+    向量归一化后存入内存索引，查询时计算与所有条目的余弦相似度，最高相似度达到阈值、
+    未过期且工具参数都能在新请求中找到时命中。参数校验避免"上海天气"命中"北京天气"的缓存。
+    条目数超过上限时淘汰最久未命中的条目。
+    """
+    
+    def __init__(self, embedder, threshold: Optional[float] = None, ttl_seconds: float = 600.0,
+                 max_entries: int = 10000, excluded_tools: Optional[List[str]] = None):
+        self.embedder = embedder
+        self.threshold = threshold if threshold is not None else DEFAULT_THRESHOLDS.get(embedder.name, 0.9)
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.excluded_tools = set(DEFAULT_EXCLUDED_TOOLS if excluded_tools is None else excluded_tools)
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._matrix: Optional[np.ndarray] = None
+        self._keys: List[str] = []
+        self._lock = threading.Lock()
+        self.metrics = {
+            "lookups": 0,
+            "hits": 0,
+            "misses": 0,
+            "rejected_arguments": 0,
+            "stores": 0,
+            "expired": 0,
+            "evicted": 0
+        }
+    
+    def _embed(self, text: str) -> np.ndarray:
+        # 中文请求中的空白不影响含义
+        vector = np.asarray(self.embedder.embed(re.sub(r"\s+", "", text)), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+    
+    def _rebuild_index(self):
+        """条目变化后重建向量矩阵"""
+        self._keys = list(self._entries)
+        self._matrix = np.stack([self._entries[key].vector for key in self._keys]) if self._keys else None
+    
+    def _expire(self, now: float):
+        expired = [key for key, entry in self._entries.items() if entry.expires_at <= now]
+        for key in expired:
+            del self._entries[key]
+        if expired:
+            self.metrics["expired"] += len(expired)
+            self._matrix = None
+    
+    @staticmethod
+    def _arguments_grounded(tool_calls: List[Dict[str, Any]], text: str) -> bool:
+        """工具调用中的字符串参数都出现在请求中"""
+        compact_text = _compact(text)
+        for tool_call in tool_calls:
+            for value in tool_call["arguments"].values():
+                if isinstance(value, str) and _compact(value) not in compact_text:
+                    return False
+        return True
+    
+    def lookup(self, user_input: str) -> Optional[Dict[str, Any]]:
+        """查找相似请求的工具调用，命中时返回缓存值和相似度"""
+        text = normalize_request(user_input)
+        if not text:
+            return None
+        vector = self._embed(text)
+        
+        with self._lock:
+            self.metrics["lookups"] += 1
+            self._expire(time.monotonic())
+            if self._matrix is None:
+                self._rebuild_index()
+            if self._matrix is None:
+                self.metrics["misses"] += 1
+                return None
+            
+            # 按相似度从高到低取第一个参数能在请求中找到的条目
+            similarities = self._matrix @ vector
+            for index in np.argsort(-similarities):
+                similarity = float(similarities[index])
+                if similarity < self.threshold:
+                    break
+                key = self._keys[index]
+                entry = self._entries[key]
+                if not self._arguments_grounded(entry.value["tool_calls"], text):
+                    self.metrics["rejected_arguments"] += 1
+                    continue
+                
+                self._entries.move_to_end(key)
+                self.metrics["hits"] += 1
+                return {**entry.value, "similarity": round(similarity, 4), "matched": entry.text}
+            
+            self.metrics["misses"] += 1
+            return None
+    
+    def store(self, user_input: str, assistant_response: str, tool_calls: List[Dict[str, Any]]):
+        """缓存请求的工具调用；没有工具调用或包含被排除工具时不缓存"""
+        if not tool_calls or any(tool_call["name"] in self.excluded_tools for tool_call in tool_calls):
+            return
+        text = normalize_request(user_input)
+        if not text:
+            return
+        
+        entry = _Entry(
+            text,
+            self._embed(text),
+            {"assistant_response": assistant_response, "tool_calls": tool_calls},
+            time.monotonic() + self.ttl_seconds
+        )
+        with self._lock:
+            self._entries[text] = entry
+            self._entries.move_to_end(text)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.metrics["evicted"] += 1
+            self._matrix = None
+            self.metrics["stores"] += 1
+    
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """获取缓存指标"""
+        with self._lock:
+            lookups = self.metrics["lookups"]
+            return {
+                "embedder": self.embedder.name,
+                "threshold": self.threshold,
+                "ttl_seconds": self.ttl_seconds,
+                "size": len(self._entries),
+                "hit_rate": round(self.metrics["hits"] / lookups, 4) if lookups else 0.0,
+                **self.metrics
+            }
+
+def create_semantic_cache(config: Dict[str, Any], inference=None) -> SemanticCache:
+    """按配置（config.yaml的inference.semantic_cache段）创建语义缓存"""
+    embedder = create_embedder(config.get("embedder", "model"), inference, config.get("model_name"))
+    return SemanticCache(
+        embedder,
+        threshold=config.get("threshold"),
+        ttl_seconds=config.get("ttl_seconds", 600),
+        max_entries=config.get("max_entries", 10000),
+        excluded_tools=config.get("excluded_tools")
+    )
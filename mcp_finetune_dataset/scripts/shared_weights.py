@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+跨进程共享模型权重
+通过内存映射safetensors文件加载模型，多个API工作进程共享同一份只读权重页
+"""
+
+import os
+import re
+import json
+import mmap
+import struct
+import logging
+from typing import Dict, Any, List, Optional, Tuple
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+# multiprocessing spawn启动的子进程命令行中带有各自不同的管道句柄，如 spawn_main(tracker_fd=5, pipe_handle=7)
+SPAWN_MAIN_ARGS = re.compile(rb"spawn_main\([^)]*\)")
+
+# safetensors数据类型到torch数据类型的映射
+SAFETENSORS_DTYPES = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool
+}
+
+def load_safetensors_mmap(path: str) -> Tuple[Dict[str, torch.Tensor], mmap.mmap]:
+    """以内存映射方式读取safetensors文件
+    
+    张量直接指向映射的文件页，不复制数据。映射使用写时复制模式，
+    未被修改的页在所有映射同一文件的进程间共享。
+    """
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    
+    header_length = struct.unpack("<Q", mapped[:8])[0]
+    header = json.loads(mapped[8:8 + header_length])
+    data_start = 8 + header_length
+    
+    tensors = {}
+    for name, info in header.items():
+        if name == "__metadata__":
+            continue
+        
+        dtype = SAFETENSORS_DTYPES.get(info["dtype"])
+        if dtype is None:
+            raise ValueError(f"不支持的safetensors数据类型: {info['dtype']} ({name})")
+        
+        begin, end = info["data_offsets"]
+        shape = info["shape"]
+        itemsize = torch.tensor([], dtype=dtype).element_size()
+        count = (end - begin) // itemsize
+        
+        if count == 0:
+            tensors[name] = torch.empty(shape, dtype=dtype)
+        else:
+            tensors[name] = torch.frombuffer(
+                mapped, dtype=dtype, count=count, offset=data_start + begin
+            ).reshape(shape)
+    
+    return tensors, mapped
+
+def load_state_dict_mmap(model_dir: str) -> Tuple[Dict[str, torch.Tensor], List[mmap.mmap]]:
+    """内存映射加载模型目录中的全部safetensors权重（支持分片）"""
+    index_path = os.path.join(model_dir, "model.safetensors.index.json")
+    if os.path.exists(index_path):
+        with open(index_path, "r") as f:
+            weight_map = json.load(f)["weight_map"]
+        files = sorted(set(weight_map.values()))
+    elif os.path.exists(os.path.join(model_dir, "model.safetensors")):
+        files = ["model.safetensors"]
+    else:
+        raise FileNotFoundError(f"目录中没有safetensors权重: {model_dir}")
+    
+    state_dict = {}
+    maps = []
+    for filename in files:
+        tensors, mapped = load_safetensors_mmap(os.path.join(model_dir, filename))
+        state_dict.update(tensors)
+        maps.append(mapped)
+    
+    return state_dict, maps
+
+def has_safetensors(model_dir: str) -> bool:
+    """检查目录是否包含safetensors权重"""
+    return (os.path.exists(os.path.join(model_dir, "model.safetensors")) or
+            os.path.exists(os.path.join(model_dir, "model.safetensors.index.json")))
+
+def load_model_shared(model_dir: str):
+    """加载模型，参数直接使用内存映射的权重
+    
+    模型先在meta设备上构建，再将映射的张量直接赋给参数，权重保持safetensors
+    中存储的数据类型。LoRA模型需先用 --export-merged 合并导出为完整模型。
+    """
+    from accelerate import init_empty_weights
+    from transformers import AutoConfig, AutoModelForCausalLM
+    
+    config = AutoConfig.from_pretrained(model_dir)
+    with init_empty_weights(include_buffers=False):
+        model = AutoModelForCausalLM.from_config(config)
+    
+    state_dict, maps = load_state_dict_mmap(model_dir)
+    result = model.load_state_dict(state_dict, strict=False, assign=True)
+    if result.unexpected_keys:
+        logger.warning(f"忽略未使用的权重: {result.unexpected_keys[:5]}...")
+    
+    # 共享权重的参数（如lm_head与embedding）需要重新绑定
+    model.tie_weights()
+    
+    missing = [name for name, param in model.named_parameters() if param.is_meta]
+    if missing:
+        raise ValueError(f"权重文件缺少参数: {missing[:5]}")
+    
+    model.eval()
+    # 张量引用映射内存，保持映射对象与模型同生命周期
+    model._shared_weight_maps = maps
+    
+    mapped_bytes = sum(len(m) for m in maps)
+    logger.info(f"已内存映射加载模型权重: {model_dir} ({mapped_bytes / 1024**3:.2f}GB)")
+    return model
+
+def export_merged_model(model_path: str, output_dir: str, base_model_name: Optional[str] = None):
+    """将LoRA适配器合并到基础模型并导出为safetensors，供共享权重模式使用"""
+    from transformers import AutoTokenizer, AutoModelForCausalLM
+    from peft import PeftModel
+    
+    adapter_config_path = os.path.join(model_path, "adapter_config.json")
+    if os.path.exists(adapter_config_path):
+        with open(adapter_config_path, "r") as f:
+            base_model_name = json.load(f).get("base_model_name_or_path", base_model_name)
+        if not base_model_name:
+            raise ValueError("无法确定基础模型名称，请提供base_model_name参数")
+        
+        tokenizer = AutoTokenizer.from_pretrained(base_model_name)
+        base_model = AutoModelForCausalLM.from_pretrained(base_model_name, torch_dtype="auto")
+        model = PeftModel.from_pretrained(base_model, model_path).merge_and_unload()
+    else:
+        tokenizer = AutoTokenizer.from_pretrained(model_path)
+        model = AutoModelForCausalLM.from_pretrained(model_path, torch_dtype="auto")
+    
+    model.save_pretrained(output_dir, safe_serialization=True)
+    tokenizer.save_pretrained(output_dir)
+    logger.info(f"合并模型已导出: {output_dir}")
+
+def process_memory(pid: Any = "self") -> Dict[str, Any]:
+    """读取进程的RSS和PSS（字节）
+    
+    PSS将共享页按共享进程数均摊，多个工作进程共享权重时PSS明显小于RSS。
+    """
+    fields = {}
+    rollup_path = f"/proc/{pid}/smaps_rollup"
+    try:
+        with open(rollup_path, "r") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 3 and parts[2] == "kB":
+                    fields[parts[0].rstrip(":")] = int(parts[1]) * 1024
+    except OSError:
+        # 旧内核没有smaps_rollup，只能获取RSS
+        with open(f"/proc/{pid}/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    fields["Rss"] = int(line.split()[1]) * 1024
+    
+    return {
+        "pid": os.getpid() if pid == "self" else int(pid),
+        "rss": fields.get("Rss"),
+        "pss": fields.get("Pss"),
+        "shared": fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0) if "Pss" in fields else None,
+        "private": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0) if "Pss" in fields else None
+    }
+
+def _worker_cmdline(pid: Any) -> bytes:
+    """进程的命令行，去掉spawn_main的参数后再比较"""
+    with open(f"/proc/{pid}/cmdline", "rb") as f:
+        return SPAWN_MAIN_ARGS.sub(b"spawn_main()", f.read())
+
+def worker_memory_report() -> List[Dict[str, Any]]:
+    """获取当前进程及同级工作进程的内存报告
+    
+    uvicorn多进程模式下各工作进程由同一父进程以multiprocessing spawn启动，
+    去掉spawn_main参数后命令行相同，以此识别同级工作进程；同一父进程启动的resource_tracker等进程命令行不同，被排除。
+    """
+    own_pid = os.getpid()
+    parent_pid = os.getppid()
+    own_cmdline = _worker_cmdline(own_pid)
+    
+    workers = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "r") as f:
+                # 进程名可能包含空格，从最后一个右括号后解析
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            if ppid != parent_pid:
+                continue
+            if _worker_cmdline(entry) != own_cmdline:
+                continue
+            report = process_memory(entry)
+            report["current"] = int(entry) == own_pid
+            workers.append(report)
+        except (OSError, IndexError, ValueError):
+            # 进程可能已退出
+            continue
+    
+    return sorted(workers, key=lambda item: item["pid"])
+
+if __name__ == "__main__":
+    import argparse
+    
+    logging.basicConfig(level=logging.INFO)
+    
+    parser = argparse.ArgumentParser(description="共享权重工具")
+    parser.add_argument("--export-merged", action="store_true", help="合并LoRA并导出safetensors完整模型")
+    parser.add_argument("--model_path", type=str, help="模型或LoRA适配器路径")
+    parser.add_argument("--base_model", type=str, help="基础模型名称（LoRA模型需要）")
+    parser.add_argument("--output_dir", type=str, help="导出目录")
+    parser.add_argument("--report", type=int, nargs="*", metavar="PID", help="显示指定进程的RSS/PSS")
+    
+    args = parser.parse_args()
+    
+    if args.export_merged:
+        if not args.model_path or not args.output_dir:
+            parser.error("--export-merged 需要 --model_path 和 --output_dir")
+        export_merged_model(args.model_path, args.output_dir, args.base_model)
+    
+    if args.report is not None:
+        pids = args.report or ["self"]
+        print(f"{'PID':>8} {'RSS(MB)':>10} {'PSS(MB)':>10} {'共享(MB)':>10}")
+        for pid in pids:
+            info = process_memory(pid)
+            to_mb = lambda value: f"{value / 1024**2:.1f}" if value is not None else "-"
+            print(f"{info['pid']:>8} {to_mb(info['rss']):>10} {to_mb(info['pss']):>10} {to_mb(info['shared']):>10}")
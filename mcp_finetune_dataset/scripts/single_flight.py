@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+请求合并（single-flight）
+相同键的并发请求共享同一次执行，避免重试和探活请求造成重复计算
+"""
+
+import asyncio
+import logging
+import threading
+from typing import Dict, Any, List, Optional, Callable, Awaitable
+
+logger = logging.getLogger(__name__)
+
+class CancelGroup:
+    """共享执行的取消令牌
+    
+    与threading.Event接口兼容（is_set/set），可直接传给推理的停止条件。
+    只有当所有参与者都已放弃（各自的取消事件被设置或已离开）时才视为取消，
+    调用set()则强制取消。
+    """
+    
+    def __init__(self):
+        self._members: List[threading.Event] = []
+        self._lock = threading.Lock()
+        self._forced = threading.Event()
+    
+    def join(self, event: threading.Event):
+        """加入参与者"""
+        with self._lock:
+            self._members.append(event)
+    
+    def leave(self, event: threading.Event):
+        """移除参与者"""
+        with self._lock:
+            if event in self._members:
+                self._members.remove(event)
+    
+    def set(self):
+        """强制取消"""
+        self._forced.set()
+    
+    def is_set(self) -> bool:
+        """是否已取消"""
+        if self._forced.is_set():
+            return True
+        with self._lock:
+            return all(member.is_set() for member in self._members)
+
+class _Call:
+    """进行中的共享执行"""
+    
+    def __init__(self, future: asyncio.Future):
+        self.future = future
+        self.cancel_group = CancelGroup()
+
+class SingleFlight:
+    """请求合并器
+    
+    同一键在执行期间的后续请求直接等待首个请求的结果，不再重复执行。
+    执行函数接收一个CancelGroup，仅当所有等待者都放弃时才会被取消。
+    """
+    
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+        self.metrics = {
+            "executed": 0,
+            "coalesced": 0,
+            "coalesced_by_label": {}
+        }
+    
+    async def do(self, key: str, func: Callable[[CancelGroup], Awaitable[Any]],
+                 cancel_event: Optional[threading.Event] = None, label: Optional[str] = None) -> Any:
+        """执行或加入相同键的执行
+        
+        Args:
+            key: 合并键，相同键的并发请求共享结果
+            func: 执行函数，参数为共享的取消令牌
+            cancel_event: 当前请求的取消事件（如客户端断开）
+            label: 指标分类标签，如路由名称
+        """
+        participant = cancel_event if cancel_event is not None else threading.Event()
+        call = self._calls.get(key)
+        
+        if call is None:
+            call = _Call(asyncio.get_running_loop().create_future())
+            call.cancel_group.join(participant)
+            self._calls[key] = call
+            self.metrics["executed"] += 1
+            asyncio.ensure_future(self._run(key, call, func))
+        else:
+            call.cancel_group.join(participant)
+            self.metrics["coalesced"] += 1
+            if label:
+                by_label = self.metrics["coalesced_by_label"]
+                by_label[label] = by_label.get(label, 0) + 1
+            logger.debug(f"合并进行中的请求: {label or key}")
+        
+        try:
+            return await asyncio.shield(call.future)
+        finally:
+            call.cancel_group.leave(participant)
+    
+    async def _run(self, key: str, call: _Call, func: Callable[[CancelGroup], Awaitable[Any]]):
+        """执行共享任务并广播结果"""
+        try:
+            result = await func(call.cancel_group)
+        except asyncio.CancelledError:
+            call.future.cancel()
+            raise
+        except Exception as e:
+            call.future.set_exception(e)
+            # 所有等待者都已离开时避免未读取异常的警告
+            call.future.exception()
+        else:
+            call.future.set_result(result)
+        finally:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """获取合并指标"""
+        return {
+            "in_flight": len(self._calls),
+            **self.metrics
+        }
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+工具预执行
+模型生成开场白和工具调用期间，根据用户请求预测最可能调用的只读工具及参数并提前执行。
+解析出的工具调用与预测一致时直接使用预执行的结果，否则丢弃。
+"""
+
+import os
+import sys
+import logging
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Dict, Any, List, Optional
+
+# 添加父目录到路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from scripts.intent_router import IntentRouter
+
+logger = logging.getLogger(__name__)
+
+# 没有副作用、可以安全地预先执行的工具
+READ_ONLY_TOOLS = ["web_search", "get_weather", "list_files", "read_file", "calculate", "get_current_time"]
+
+def _normalize_arguments(arguments: Dict[str, Any]) -> Dict[str, Any]:
+    return {key: value.strip() if isinstance(value, str) else value for key, value in arguments.items()}
+
+class SpeculativeExecution:
+    """一次预执行：预测的工具调用及其结果"""
+    
+    def __init__(self, tool_call: Dict[str, Any], future: Future):
+        self.tool_call = tool_call
+        self.future = future
+        self.used = False
+    
+    def matches(self, tool_call: Dict[str, Any]) -> bool:
+        """解析出的工具调用与预测一致"""
+        return (not self.used and tool_call["name"] == self.tool_call["name"]
+                and _normalize_arguments(tool_call["arguments"]) == _normalize_arguments(self.tool_call["arguments"]))
+
+class ToolSpeculator:
+    """工具预执行器
+    
+    用意图路由器（正则模板 + 分类器）从用户请求预测工具调用。预测错误只浪费一次只读工具的执行，
+    所以阈值可以比快速路由低。write_file等有副作用的工具即使配置了也不会预执行。
+    """
+    
+    def __init__(self, registry, threshold: float = 0.6, tools: Optional[List[str]] = None, max_workers: int = 4):
+        tools = [name for name in (tools or READ_ONLY_TOOLS) if name in READ_ONLY_TOOLS]
+        self.registry = registry
+        self.router = IntentRouter(threshold=threshold, tools=tools, registry=registry)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="speculative-tool")
+        self.metrics = {
+            "predicted": 0,
+            "hits": 0,
+            "misses": 0,
+            "unpredicted": 0
+        }
+    
+    def start(self, user_input: str) -> Optional[SpeculativeExecution]:
+        """预测工具调用并在后台开始执行；无法预测时返回None"""
+        decision = self.router.route(user_input)
+        if decision is None:
+            self.metrics["unpredicted"] += 1
+            return None
+        
+        tool_call = {"name": decision["name"], "arguments": decision["arguments"]}
+        future = self.executor.submit(self.registry.execute_tool, tool_call["name"], **tool_call["arguments"])
+        self.metrics["predicted"] += 1
+        return SpeculativeExecution(tool_call, future)
+    
+    def resolve(self, speculation: Optional[SpeculativeExecution], tool_call: Dict[str, Any]) -> Optional[str]:
+        """工具调用与预测一致时返回预执行结果，否则返回None由调用方正常执行"""
+        if speculation is None or not speculation.matches(tool_call):
+            return None
+        speculation.used = True
+        self.metrics["hits"] += 1
+        return speculation.future.result()
+    
+    def finish(self, speculation: Optional[SpeculativeExecution]):
+        """请求结束时统计未被使用的预测"""
+        if speculation is not None and not speculation.used:
+            self.metrics["misses"] += 1
+            logger.debug(f"丢弃预执行结果: {speculation.tool_call}")
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """获取预执行指标"""
+        predicted = self.metrics["predicted"]
+        return {
+            "threshold": self.router.threshold,
+            "tools": sorted(self.router.tools),
+            "hit_rate": round(self.metrics["hits"] / predicted, 4) if predicted else 0.0,
+            **self.metrics
+        }
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+工具沙箱
+在工作进程池中执行CPU密集或不可信的工具，每次调用受墙钟超时、CPU时间与内存上限约束。
+超时、超限或崩溃的工作进程被终止并替换，失控的工具只会损失一个工作进程，不会拖垮服务进程。
+工作进程由forkserver创建：服务进程只在启动时拉起一个预先导入工具模块的forkserver，
+补充的工作进程都从forkserver fork，不会复制服务进程中已加载的模型、线程池和可能被持有的锁。
+"""
+
+import os
+import queue
+import pickle
+import signal
+import asyncio
+import inspect
+import logging
+import threading
+import multiprocessing
+from typing import Dict, Any, Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# forkserver预先导入的模块，工作进程fork后无需再次导入工具及其依赖
+DEFAULT_PRELOAD_MODULES = ["examples.mcp_tools"]
+
+class ToolTimeout(Exception):
+    """工具执行超过墙钟超时"""
+
+class ToolWorkerCrashed(Exception):
+    """工作进程异常退出，通常是超出了CPU时间或内存上限"""
+
+def _address_space_bytes() -> int:
+    """当前进程的虚拟地址空间大小"""
+    with open("/proc/self/statm", "r") as f:
+        return int(f.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+
+def _limit_memory(memory_mb: Optional[int]):
+    """限制工作进程在启动时的地址空间之外最多再分配memory_mb"""
+    if not memory_mb:
+        return
+    import resource
+    
+    try:
+        limit = _address_space_bytes() + memory_mb * 1024**2
+    except OSError:
+        logger.warning("无法读取进程地址空间大小，跳过内存限制")
+        return
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+def _limit_cpu(cpu_seconds: Optional[int]):
+    """限制本次调用最多再使用cpu_seconds秒CPU时间，超出时内核发送SIGXCPU终止进程"""
+    if not cpu_seconds:
+        return
+    import resource
+    
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    used = int(usage.ru_utime + usage.ru_stime) + 1
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    soft = used + cpu_seconds
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+def _worker_main(conn, tools: Dict[str, Callable], cpu_seconds: Optional[int], memory_mb: Optional[int]):
+    """工作进程主循环：接收(工具名, 参数)，返回(是否成功, 结果或错误, 是否需要回收)"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _limit_memory(memory_mb)
+    
+    while True:
+        try:
+            tool_name, kwargs = conn.recv()
+        except (EOFError, OSError):
+            return
+        
+        _limit_cpu(cpu_seconds)
+        try:
+            func = tools[tool_name]
+            result = asyncio.run(func(**kwargs)) if inspect.iscoroutinefunction(func) else func(**kwargs)
+            conn.send((True, result, False))
+        except MemoryError:
+            # 内存分配失败后进程状态不可靠，由父进程回收
+            conn.send((False, "超出内存上限", True))
+        except Exception as e:
+            conn.send((False, str(e), False))
+
+class _Worker:
+    """一个工作进程及其管道"""
+    
+    def __init__(self, context, tools: Dict[str, Callable], cpu_seconds: Optional[int], memory_mb: Optional[int]):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main,
+            args=(child_conn, tools, cpu_seconds, memory_mb),
+            daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.tasks = 0
+    
+    def kill(self):
+        """强制终止工作进程"""
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join(timeout=1)
+        self.conn.close()
+
+class ToolSandbox:
+    """工具工作进程池
+    
+    工具函数以pickle传给工作进程，必须是模块级函数或MCPToolRegistry的方法（在工作进程中重建注册表）。
+    每个工作进程同一时间只执行一个调用，所有进程都忙时调用方阻塞等待。
+    """
+    
+    def __init__(self, tools: Dict[str, Callable], num_workers: int = 2, timeout: float = 5.0,
+                 cpu_seconds: Optional[int] = 5, memory_mb: Optional[int] = 512,
+                 max_tasks_per_worker: int = 200, preload: Optional[List[str]] = None):
+        """
+        Args:
+            tools: 在沙箱中执行的工具名到函数的映射
+            timeout: 单次调用的墙钟超时（秒）
+            cpu_seconds: 单次调用的CPU时间上限（秒）
+            memory_mb: 工作进程在启动时的内存之外可额外分配的内存（MB）
+            max_tasks_per_worker: 工作进程执行该数量的调用后被替换，回收泄漏的内存
+            preload: forkserver预先导入的模块，默认为DEFAULT_PRELOAD_MODULES
+        """
+        try:
+            pickle.dumps(tools)
+        except Exception as e:
+            raise ValueError(f"沙箱中的工具必须可以pickle（模块级函数或注册表方法）: {e}")
+        self.tools = tools
+        self.num_workers = num_workers
+        self.timeout = timeout
+        self.cpu_seconds = cpu_seconds
+        self.memory_mb = memory_mb
+        self.max_tasks_per_worker = max_tasks_per_worker
+        self._context = multiprocessing.get_context("forkserver")
+        # 只在forkserver启动前生效，forkserver在创建第一个工作进程时启动
+        self._context.set_forkserver_preload(DEFAULT_PRELOAD_MODULES if preload is None else preload)
+        self._idle: "queue.Queue[_Worker]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._started = False
+        # 替换失败、尚未补回的工作进程数
+        self._missing = 0
+        self.metrics = {
+            "executed": 0,
+            "failed": 0,
+            "timeouts": 0,
+            "crashed": 0,
+            "recycled": 0
+        }
+    
+    def _spawn(self) -> _Worker:
+        return _Worker(self._context, self.tools, self.cpu_seconds, self.memory_mb)
+    
+    def _count(self, key: str):
+        with self._lock:
+            self.metrics[key] += 1
+    
+    def _respawn(self) -> Optional[_Worker]:
+        """创建替换的工作进程，失败时记入缺少的进程数，由后续调用补回"""
+        try:
+            return self._spawn()
+        except Exception as e:
+            logger.error(f"工具沙箱创建工作进程失败: {e}")
+            with self._lock:
+                self._missing += 1
+            return None
+    
+    def _replenish(self):
+        """补回之前替换失败的工作进程"""
+        while True:
+            with self._lock:
+                if not self._missing:
+                    return
+                self._missing -= 1
+            worker = self._respawn()
+            if worker is None:
+                return
+            self._idle.put(worker)
+    
+    def start(self):
+        """预先创建所有工作进程"""
+        with self._lock:
+            if self._started:
+                return
+            for _ in range(self.num_workers):
+                self._idle.put(self._spawn())
+            self._started = True
+        logger.info(f"工具沙箱已启动: {self.num_workers} 个工作进程，超时 {self.timeout}s，"
+                    f"CPU上限 {self.cpu_seconds}s，内存上限 {self.memory_mb}MB")
+    
+    def run(self, tool_name: str, kwargs: Dict[str, Any], timeout: Optional[float] = None) -> Any:
+        """在工作进程中执行工具，超时、崩溃或工具异常时抛出异常"""
+        if not self._started:
+            self.start()
+        if self._missing:
+            self._replenish()
+        timeout = timeout if timeout is not None else self.timeout
+        
+        try:
+            worker = self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise ToolWorkerCrashed(f"工具 {tool_name} 等待工作进程超时（{timeout}秒），"
+                                    f"{self._missing} 个工作进程未能替换")
+        recycle = False
+        try:
+            worker.conn.send((tool_name, kwargs))
+            if not worker.conn.poll(timeout):
+                recycle = True
+                self._count("timeouts")
+                raise ToolTimeout(f"工具 {tool_name} 执行超时（{timeout}秒）")
+            ok, value, recycle = worker.conn.recv()
+        except (EOFError, OSError):
+            recycle = True
+            self._count("crashed")
+            raise ToolWorkerCrashed(f"工具 {tool_name} 的工作进程异常退出（可能超出CPU或内存上限）")
+        finally:
+            worker.tasks += 1
+            if recycle or worker.tasks >= self.max_tasks_per_worker or not worker.process.is_alive():
+                worker.kill()
+                self._count("recycled")
+                worker = self._respawn()
+            if worker is not None:
+                self._idle.put(worker)
+        
+        if not ok:
+            self._count("failed")
+            raise RuntimeError(value)
+        self._count("executed")
+        return value
+    
+    def shutdown(self):
+        """终止所有空闲工作进程"""
+        while True:
+            try:
+                self._idle.get_nowait().kill()
+            except queue.Empty:
+                break
+        with self._lock:
+            self._missing = 0
+        self._started = False
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """获取沙箱指标"""
+        with self._lock:
+            return {
+                "workers": self.num_workers,
+                "idle_workers": self._idle.qsize(),
+                "missing_workers": self._missing,
+                "timeout": self.timeout,
+                "cpu_seconds": self.cpu_seconds,
+                "memory_mb": self.memory_mb,
+                **self.metrics
+            }
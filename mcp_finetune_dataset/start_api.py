@@ -17,6 +17,18 @@ def main():
     parser.add_argument("--reload", action="store_true", help="启用自动重载")
     parser.add_argument("--workers", type=int, default=1, help="工作进程数")
     parser.add_argument("--log-level", default="info", help="日志级别")
+    parser.add_argument("--shared-weights", action="store_true",
+                        help="内存映射safetensors权重，多个工作进程共享同一份模型内存")
+    parser.add_argument("--compile", action="store_true",
+                        help="使用静态KV缓存并编译解码步，编译产物缓存在 inference.compile.cache_dir")
+    parser.add_argument("--backend", choices=["torch", "onnx"],
+                        help="推理后端，默认使用config.yaml的inference.backend")
+    parser.add_argument("--model-server", metavar="SOCKET",
+                        help="连接独立模型服务进程（scripts/model_server.py）的Unix套接字，工作进程不加载模型")
+    parser.add_argument("--replicas", type=int, default=0,
+                        help="启动K个绑定互不重叠核心组的模型服务副本，请求分发到负载最低的副本")
+    parser.add_argument("--model-path", help="副本加载的模型路径，默认使用config.yaml的output.model_dir")
+    parser.add_argument("--threads-per-replica", type=int, help="每个副本的intra-op线程数，默认等于分配的核心数")
     
     args = parser.parse_args()
     
@@ -24,21 +36,77 @@ def main():
     script_dir = Path(__file__).parent
     os.chdir(script_dir)
     
+    replica_pool = None
+    if args.replicas:
+        if args.model_server:
+            parser.error("--replicas 与 --model-server 不能同时使用")
+        replica_pool = start_replicas(args)
+        args.model_server = ",".join(replica_pool.socket_paths)
+    
+    # 工作进程以spawn方式启动并各自执行启动事件，通过环境变量传递共享权重开关
+    if args.model_server:
+        os.environ["MCP_MODEL_SERVER_SOCKET"] = args.model_server
+    elif args.shared_weights:
+        os.environ["MCP_SHARED_WEIGHTS"] = "1"
+    elif args.workers > 1:
+        print(f"提示: {args.workers} 个工作进程将各自加载一份模型，可使用 --shared-weights 共享权重内存")
+    
+    if args.compile:
+        os.environ["MCP_COMPILE"] = "1"
+    if args.backend:
+        os.environ["MCP_BACKEND"] = args.backend
+    
     print(f"启动MCP API服务...")
     print(f"主机: {args.host}")
     print(f"端口: {args.port}")
     print(f"文档地址: http://{args.host}:{args.port}/docs")
     print(f"工作目录: {script_dir}")
+    if args.shared_weights:
+        print(f"共享权重: 已开启，内存报告: http://{args.host}:{args.port}/system/memory")
+    if args.model_server:
+        print(f"模型服务: {args.model_server}")
+    if replica_pool:
+        for replica in replica_pool.describe():
+            print(f"  副本 {replica['socket']}: CPU {replica['cpus']}")
     
     # 启动服务
-    uvicorn.run(
-        "api_server:app",
-        host=args.host,
-        port=args.port,
-        reload=args.reload,
-        workers=args.workers if not args.reload else 1,
-        log_level=args.log_level
+    try:
+        uvicorn.run(
+            "api_server:app",
+            host=args.host,
+            port=args.port,
+            reload=args.reload,
+            workers=args.workers if not args.reload else 1,
+            log_level=args.log_level
+        )
+    finally:
+        if replica_pool:
+            replica_pool.stop()
+
+def start_replicas(args):
+    """按核心组启动模型服务副本并等待就绪"""
+    import yaml
+    from scripts.replica_pool import ReplicaPool
+    
+    model_path = args.model_path
+    if not model_path:
+        with open("config.yaml", "r", encoding="utf-8") as f:
+            model_path = yaml.safe_load(f)["output"]["model_dir"]
+    
+    extra_args = ["--compile"] if args.compile else []
+    if args.backend:
+        extra_args += ["--backend", args.backend]
+    replica_pool = ReplicaPool(
+        model_path,
+        args.replicas,
+        shared_weights=True,
+        threads_per_replica=args.threads_per_replica,
+        extra_args=extra_args
     )
+    print(f"启动 {args.replicas} 个模型副本: {model_path}")
+    replica_pool.start()
+    replica_pool.wait_ready()
+    return replica_pool
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -210,6 +210,28 @@ class MCPAPITester:
             print(f"❌ 聊天接口异常: {e}")
             return False
     
+    def test_score(self, text: str = "北京今天天气怎么样") -> bool:
+        """测试候选打分（工具选择）"""
+        try:
+            response = self.session.post(f"{self.base_url}/score", json={"text": text})
+            if response.status_code == 200:
+                result = response.json()
+                best = result["best"]
+                print("✅ 候选打分测试成功")
+                print(f"   最佳工具: {best.get('tool')} (概率 {best['probability']:.3f})")
+                return True
+            elif response.status_code == 404:
+                print("⚠️  模型未加载，无法进行打分")
+                return False
+            else:
+                print(f"❌ 候选打分失败: {response.status_code}")
+                if response.content:
+                    print(f"   错误: {response.json().get('detail', '未知错误')}")
+                return False
+        except Exception as e:
+            print(f"❌ 候选打分异常: {e}")
+            return False
+    
     def test_get_config(self) -> bool:
         """测试获取配置"""
         try:
@@ -304,6 +326,7 @@ class MCPAPITester:
         print("=== 推理功能测试 ===")
         results['simple_chat'] = self.test_simple_chat()
         results['chat'] = self.test_chat()
+        results['score'] = self.test_score()
         print()
         
         # 测试结果汇总
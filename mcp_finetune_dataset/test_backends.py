@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试推理后端一致性
+在随机初始化的小模型上比较torch与ONNX Runtime后端的贪心生成结果
+"""
+
+import tempfile
+
+import pytest
+import torch
+
+from scripts.inference import MCPInference
+from scripts.benchmark_backends import create_tiny_model_dir, random_prompts, generate_greedy, token_agreement
+
+def test_onnx_parity():
+    """ONNX Runtime后端与torch后端的贪心生成应逐token一致"""
+    # onnxruntime与optimum是可选依赖（requirements.txt中注释的部分），未安装时跳过
+    pytest.importorskip("onnxruntime")
+    pytest.importorskip("optimum.onnxruntime")
+    print("🧪 测试ONNX Runtime后端一致性...\n")
+    
+    with tempfile.TemporaryDirectory() as model_dir:
+        create_tiny_model_dir(model_dir)
+        torch_inference = MCPInference(model_dir, backend="torch")
+        onnx_inference = MCPInference(model_dir, backend="onnx")
+        
+        prompts = random_prompts(torch_inference.backend.config.vocab_size, 16, 4)
+        for index, prompt_ids in enumerate(prompts):
+            expected = generate_greedy(torch_inference, prompt_ids, 24)["ids"]
+            actual = generate_greedy(onnx_inference, prompt_ids, 24)["ids"]
+            print(f"📋 提示 {index}: torch={expected[:8]}... onnx={actual[:8]}...")
+            assert expected == actual, f"提示 {index} 的生成结果不一致"
+        
+        # int8量化会改变数值，只报告一致率
+        quantized = MCPInference(model_dir, backend="onnx", backend_options={"quantize": True})
+        reference = [generate_greedy(torch_inference, prompt_ids, 24)["ids"] for prompt_ids in prompts]
+        candidate = [generate_greedy(quantized, prompt_ids, 24)["ids"] for prompt_ids in prompts]
+        print(f"📤 int8量化token一致率: {token_agreement(reference, candidate):.2%}")
+        
+        # KV缓存估算与后端无关
+        assert torch_inference.kv_estimator.bytes_per_token == onnx_inference.kv_estimator.bytes_per_token
+
+if __name__ == "__main__":
+    torch.manual_seed(0)
+    test_onnx_parity()
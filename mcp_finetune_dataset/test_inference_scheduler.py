@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试推理请求调度器
+用普通函数代替模型推理，验证优先级调度、截止时间与内存准入
+"""
+
+import time
+import asyncio
+import threading
+from types import SimpleNamespace
+
+from scripts.inference_scheduler import InferenceScheduler, DeadlineExceeded, AdmissionRejected, PRIORITY_CLASSES
+from scripts.kv_cache_estimator import KVCacheEstimator, dtype_num_bytes
+
+def test_priority_and_deadline():
+    """高优先级任务先调度；过期与无法按期完成的任务不会执行"""
+    print("🧪 测试优先级与截止时间...\n")
+    
+    async def run():
+        scheduler = InferenceScheduler(max_workers=1)
+        release = threading.Event()
+        order = []
+        
+        def job(name):
+            def func():
+                order.append(name)
+                return name
+            return func
+        
+        # 占住唯一的工作线程，后续任务都在队列中等待
+        blocker = asyncio.ensure_future(scheduler.submit(lambda: release.wait(5)))
+        await asyncio.sleep(0.05)
+        queued = [
+            asyncio.ensure_future(scheduler.submit(job(name), priority=PRIORITY_CLASSES[name]))
+            for name in ["batch", "normal", "interactive"]
+        ]
+        expiring = asyncio.ensure_future(scheduler.submit(job("expiring"), deadline=time.monotonic() + 0.05))
+        await asyncio.sleep(0.1)
+        
+        try:
+            await expiring
+            assert False, "截止时间已过的任务应抛出DeadlineExceeded"
+        except DeadlineExceeded:
+            pass
+        release.set()
+        await blocker
+        assert await asyncio.gather(*queued) == ["batch", "normal", "interactive"]
+        print(f"📋 执行顺序: {order}")
+        assert order == ["interactive", "normal", "batch"], "应按优先级从高到低调度"
+        
+        # 按实测生成速度估算无法在截止时间前完成的任务直接拒绝
+        scheduler.tokens_per_second = 10.0
+        try:
+            await scheduler.submit(job("slow"), deadline=time.monotonic() + 1, max_tokens=100)
+            assert False, "预计耗时10秒的任务不应在1秒的截止时间内启动"
+        except DeadlineExceeded as e:
+            print(f"📤 {e}")
+        
+        snapshot = scheduler.snapshot()
+        print(f"📊 {snapshot}")
+        assert snapshot["expired"] == 1 and snapshot["rejected_deadline"] == 1
+        assert "expiring" not in order and "slow" not in order
+        scheduler.executor.shutdown()
+    
+    asyncio.run(run())
+    print("✅ 优先级与截止时间测试通过")
+
+def test_kv_cache_estimator():
+    """按层数、KV头数、头维度和数据类型估算KV缓存"""
+    print("🧪 测试KV缓存估算...\n")
+    
+    config = SimpleNamespace(num_hidden_layers=2, num_attention_heads=4, hidden_size=64,
+                             num_key_value_heads=2, torch_dtype="bfloat16")
+    estimator = KVCacheEstimator.from_config(config)
+    print(f"📋 {estimator.to_dict()}")
+    assert estimator.head_dim == 16 and estimator.bytes_per_token == 2 * 2 * 2 * 16 * 2
+    assert estimator.estimate(10, 6, batch_size=2) == 2 * 16 * 256
+    assert KVCacheEstimator.from_config(config, dtype="torch.float32").bytes_per_token == 512
+    try:
+        dtype_num_bytes("float8")
+        assert False, "不支持的数据类型应抛出ValueError"
+    except ValueError:
+        pass
+    print("✅ KV缓存估算测试通过")
+
+def test_memory_admission():
+    """超过总预算的请求直接拒绝；内存不足时队首任务等待，小任务不能插队"""
+    print("🧪 测试内存准入...\n")
+    
+    async def run():
+        scheduler = InferenceScheduler(max_workers=2, memory_budget_bytes=100)
+        try:
+            await scheduler.submit(lambda: "too large", memory_bytes=101)
+            assert False, "超过内存预算的请求应被拒绝"
+        except AdmissionRejected as e:
+            print(f"📤 {e}")
+        
+        release = threading.Event()
+        started = []
+        
+        def job(name):
+            def func():
+                started.append(name)
+                return name
+            return func
+        
+        running = asyncio.ensure_future(scheduler.submit(lambda: release.wait(5), memory_bytes=60))
+        await asyncio.sleep(0.05)
+        large = asyncio.ensure_future(scheduler.submit(job("large"), priority=PRIORITY_CLASSES["interactive"],
+                                                       memory_bytes=60))
+        small = asyncio.ensure_future(scheduler.submit(job("small"), priority=PRIORITY_CLASSES["batch"],
+                                                       memory_bytes=10))
+        await asyncio.sleep(0.05)
+        
+        # 空闲线程与剩余内存足够小任务运行，但它排在等待内存的大任务之后
+        snapshot = scheduler.snapshot()
+        print(f"📊 {snapshot}")
+        assert started == [] and snapshot["queued"] == 2 and snapshot["reserved_bytes"] == 60
+        
+        release.set()
+        await running
+        assert await asyncio.gather(large, small) == ["large", "small"]
+        assert scheduler.snapshot()["reserved_bytes"] == 0 and scheduler.metrics["rejected_memory"] == 1
+        scheduler.executor.shutdown()
+    
+    asyncio.run(run())
+    print("✅ 内存准入测试通过")
+
+if __name__ == "__main__":
+    test_priority_and_deadline()
+    test_kv_cache_estimator()
+    test_memory_admission()
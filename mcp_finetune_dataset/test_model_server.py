@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试模型服务协议
+不加载模型，直接在套接字对上检查请求帧的处理
+"""
+
+import socket
+import threading
+from types import SimpleNamespace
+
+from scripts.model_server import (
+    ModelServer, MAGIC, OP_GENERATE, OP_INFO, REQUEST_HEADER, RESPONSE_HEADER, STATUS_ERROR,
+    MAX_INFO_BYTES, _recv_exact
+)
+
+def test_oversized_request_rejected():
+    """负载长度超过上限的请求在分配缓冲区之前被拒绝，并关闭连接"""
+    print("🧪 测试超长请求帧...\n")
+    
+    inference = SimpleNamespace(backend=SimpleNamespace(config=SimpleNamespace(max_position_embeddings=128)))
+    server = ModelServer(inference, socket_path="unused")
+    assert server.payload_limit(OP_GENERATE) == 128 and server.payload_limit(OP_INFO) == MAX_INFO_BYTES
+    
+    for op, length in [(OP_GENERATE, 0xFFFFFFFF), (OP_GENERATE, 129), (OP_INFO, MAX_INFO_BYTES + 1)]:
+        client, conn = socket.socketpair()
+        handler = threading.Thread(target=server._handle_connection, args=(conn,), daemon=True)
+        handler.start()
+        client.sendall(REQUEST_HEADER.pack(MAGIC, op, length, 16, 0.0))
+        
+        magic, status, body_length, _, _ = RESPONSE_HEADER.unpack(_recv_exact(client, RESPONSE_HEADER.size))
+        body = _recv_exact(client, body_length).decode("utf-8")
+        print(f"📤 操作码 {op}，长度 {length}: {body}")
+        assert magic == MAGIC and status == STATUS_ERROR and "请求负载过长" in body
+        handler.join(timeout=5)
+        assert not handler.is_alive() and client.recv(1) == b"", "拒绝后应关闭连接"
+        client.close()
+    print("✅ 超长请求帧测试通过")
+
+if __name__ == "__main__":
+    test_oversized_request_rejected()
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试同级工作进程识别
+以multiprocessing spawn启动两个子进程（与uvicorn --workers相同），每个子进程的内存报告都应包含两个工作进程
+"""
+
+import multiprocessing
+
+from scripts.shared_weights import worker_memory_report
+
+def _report_workers(barrier, results):
+    # 两个子进程都启动后再读取，报告完成后再一起退出
+    barrier.wait()
+    results.put(sorted(item["pid"] for item in worker_memory_report()))
+    barrier.wait()
+
+def test_worker_memory_report_spawn():
+    """spawn子进程的命令行中pipe_handle各不相同，仍应识别为同级工作进程"""
+    print("🧪 测试同级工作进程识别...\n")
+    
+    context = multiprocessing.get_context("spawn")
+    barrier = context.Barrier(2)
+    results = context.Queue()
+    workers = [context.Process(target=_report_workers, args=(barrier, results)) for _ in range(2)]
+    for worker in workers:
+        worker.start()
+    reports = [results.get(timeout=60) for _ in workers]
+    for worker in workers:
+        worker.join(timeout=60)
+    
+    expected = sorted(worker.pid for worker in workers)
+    print(f"📋 工作进程: {expected}，各自的报告: {reports}")
+    assert reports == [expected, expected], "每个工作进程都应报告两个同级工作进程，且不包含resource_tracker"
+
+if __name__ == "__main__":
+    test_worker_memory_report_spawn()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试请求合并
+相同键的并发请求共享一次执行；共享执行只在所有参与者都放弃后取消
+"""
+
+import asyncio
+import threading
+
+from scripts.single_flight import SingleFlight, CancelGroup
+
+def test_single_flight_coalescing():
+    """并发的相同请求只执行一次，不同的键分别执行"""
+    print("🧪 测试请求合并...\n")
+    
+    async def run():
+        flight = SingleFlight()
+        calls = []
+        
+        async def generate(cancel_group):
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return "answer"
+        
+        results = await asyncio.gather(
+            *(flight.do("prompt", generate, label="chat") for _ in range(5)),
+            flight.do("other", generate)
+        )
+        return flight, calls, results
+    
+    flight, calls, results = asyncio.run(run())
+    snapshot = flight.snapshot()
+    print(f"📊 {snapshot}")
+    assert results == ["answer"] * 6 and len(calls) == 2
+    assert snapshot["executed"] == 2 and snapshot["coalesced"] == 4
+    assert snapshot["coalesced_by_label"] == {"chat": 4} and snapshot["in_flight"] == 0
+    print("✅ 请求合并测试通过")
+
+def test_cancel_group():
+    """只有所有参与者都已取消或离开时共享执行才视为取消"""
+    print("🧪 测试共享取消令牌...\n")
+    
+    group = CancelGroup()
+    first, second = threading.Event(), threading.Event()
+    group.join(first)
+    group.join(second)
+    
+    first.set()
+    assert not group.is_set(), "仍有参与者等待时不应取消"
+    group.leave(second)
+    assert group.is_set(), "剩余参与者都已取消时应取消"
+    
+    group = CancelGroup()
+    group.join(first)
+    group.join(second)
+    group.leave(first)
+    assert not group.is_set()
+    group.leave(second)
+    assert group.is_set(), "所有参与者都离开后应取消"
+    
+    forced = CancelGroup()
+    forced.join(threading.Event())
+    forced.set()
+    assert forced.is_set(), "调用set()应强制取消"
+    
+    # 合并执行中一个请求断开不影响其他请求，全部断开后执行函数看到取消
+    async def run():
+        flight = SingleFlight()
+        observed = []
+        
+        async def generate(cancel_group):
+            for _ in range(20):
+                observed.append(cancel_group.is_set())
+                if cancel_group.is_set():
+                    return None
+                await asyncio.sleep(0.01)
+            return "answer"
+        
+        disconnected, waiting = threading.Event(), threading.Event()
+        first_task = asyncio.ensure_future(flight.do("prompt", generate, disconnected))
+        second_task = asyncio.ensure_future(flight.do("prompt", generate, waiting))
+        await asyncio.sleep(0.03)
+        disconnected.set()
+        first_task.cancel()
+        assert await second_task == "answer"
+        
+        observed.clear()
+        third_task = asyncio.ensure_future(flight.do("prompt", generate, waiting))
+        await asyncio.sleep(0.03)
+        waiting.set()
+        await third_task
+        return observed
+    
+    observed = asyncio.run(run())
+    assert observed[-1] is True, "所有参与者都取消后执行函数应看到取消"
+    print("✅ 共享取消令牌测试通过")
+
+if __name__ == "__main__":
+    test_single_flight_coalescing()
+    test_cancel_group()
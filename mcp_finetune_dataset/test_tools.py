@@ -4,7 +4,21 @@
 测试MCP工具功能
 """
 
-from examples.mcp_tools import tool_registry
+import os
+import json
+import time
+import asyncio
+import tempfile
+from typing import Optional
+
+from examples.mcp_tools import tool_registry, MCPToolRegistry, is_tool_error
+from scripts.intent_router import IntentRouter
+from scripts.speculative_tools import ToolSpeculator
+from scripts.semantic_cache import SemanticCache, NgramEmbedder
+from scripts.tool_sandbox import ToolSandbox
+from examples.search_backends import SearchBackend, HTTPSearchBackend
+from examples.stub_search_server import StubSearchServer
+from examples.mcp_server import MCPServer, SESSION_HEADER, INVALID_REQUEST, INVALID_PARAMS, PARSE_ERROR
 
 def test_all_tools():
     """测试所有工具"""
@@ -28,5 +42,616 @@ def test_all_tools():
         print(f"📤 结果: {result}")
         print("-" * 50)
 
+def test_async_tools():
+    """测试异步工具接口：协程工具与同步工具都可注册，同步工具不阻塞事件循环"""
+    print("🧪 测试异步工具接口...\n")
+    
+    registry = MCPToolRegistry()
+    
+    async def async_echo(text: str) -> str:
+        await asyncio.sleep(0.2)
+        return f"echo: {text}"
+    
+    def slow_echo(text: str) -> str:
+        time.sleep(0.2)
+        return f"slow: {text}"
+    
+    registry.register_tool("async_echo", async_echo)
+    registry.register_tool("slow_echo", slow_echo)
+    
+    # 同步接口也能执行协程工具
+    assert registry.execute_tool("async_echo", text="a") == "echo: a"
+    
+    start = time.perf_counter()
+    results = asyncio.run(registry.execute_tools_async([
+        {"name": "async_echo", "arguments": {"text": "a"}},
+        {"name": "slow_echo", "arguments": {"text": "b"}},
+        {"name": "slow_echo", "arguments": {"text": "c"}}
+    ]))
+    elapsed = time.perf_counter() - start
+    print(f"📤 {results}，耗时 {elapsed:.2f}s")
+    assert results == ["echo: a", "slow: b", "slow: c"]
+    assert elapsed < 0.5, "工具调用应当并发执行"
+    assert asyncio.run(registry.execute_tool_async("missing")).startswith("未知工具")
+    print("✅ 异步工具接口测试通过")
+
+def test_batch_execution():
+    """测试批量执行：结果按顺序返回、相同调用去重、遵守并发上限"""
+    print("🧪 测试批量工具执行...\n")
+    
+    registry = MCPToolRegistry()
+    running = {"current": 0, "peak": 0}
+    
+    async def tracked(value: int) -> str:
+        running["current"] += 1
+        running["peak"] = max(running["peak"], running["current"])
+        await asyncio.sleep(0.05)
+        running["current"] -= 1
+        return str(value)
+    
+    registry.register_tool("tracked", tracked)
+    registry.set_concurrency_limit("tracked", 2)
+    
+    calls = [{"name": "tracked", "arguments": {"value": index % 5}} for index in range(10)]
+    calls.append({"name": "calculate", "arguments": {"expression": "1/0"}})
+    calls.append({"name": "missing", "arguments": {}})
+    results = asyncio.run(registry.execute_batch_async(calls))
+    
+    assert [item["result"] for item in results[:10]] == [str(index % 5) for index in range(10)]
+    assert sum(1 for item in results if item["deduplicated"]) == 5
+    assert running["peak"] <= 2, f"并发数超过上限: {running['peak']}"
+    assert results[-2]["result"] is None and results[-2]["error"].startswith("计算错误"), results[-2]
+    assert results[-1]["error"].startswith("未知工具")
+    print(f"📤 去重后执行 {sum(1 for item in results if not item['deduplicated'])} 次，峰值并发 {running['peak']}")
+    print("✅ 批量工具执行测试通过")
+
+def test_tool_schemas():
+    """测试工具schema：覆盖所有已注册工具，参数在执行前校验，注册新工具后缓存失效"""
+    print("🧪 测试工具schema...\n")
+    
+    registry = MCPToolRegistry()
+    names = [schema["function"]["name"] for schema in registry.get_tool_schema()]
+    assert names == list(registry.tools), names
+    
+    write_file = registry.schemas["write_file"]["function"]
+    print(f"📋 {write_file}")
+    assert write_file["description"] == "写入文件内容"
+    assert write_file["parameters"]["required"] == ["filename", "content"]
+    assert write_file["parameters"]["properties"]["content"] == {"type": "string", "description": "文件内容"}
+    
+    assert registry.execute_tool("calculate") == "参数错误: 缺少必需参数: expression"
+    assert registry.execute_tool("calculate", expression=3) == "参数错误: 参数 expression 应为字符串"
+    assert registry.execute_tool("get_weather", city="北京", date="今天") == "参数错误: 未知参数: date"
+    
+    calls = []
+    
+    def lookup(key: str, limit: int = 10, strict: Optional[bool] = None) -> str:
+        """查询键值
+        
+        Args:
+            key: 键名
+            limit: 最多返回的条数
+        """
+        calls.append(key)
+        return key
+    
+    registry.get_tools_response()
+    cached = registry._tools_response
+    registry.get_tools_response()
+    assert registry._tools_response is cached, "未注册工具时应复用序列化的schema"
+    registry.register_tool("lookup", lookup)
+    response = json.loads(registry.get_tools_response())
+    assert response["tools"] == list(registry.tools) and response["tool_schemas"] == registry.get_tool_schema()
+    assert response["circuit_breakers"] == {} and response["bulkheads"] == {}
+    
+    parameters = registry.schemas["lookup"]["function"]["parameters"]
+    assert parameters["required"] == ["key"]
+    assert parameters["properties"]["limit"] == {"type": "integer", "description": "最多返回的条数", "default": 10}
+    assert parameters["properties"]["strict"]["type"] == ["boolean", "null"]
+    assert registry.execute_tool("lookup", key="a", limit=True).startswith("参数错误")
+    assert registry.execute_tool("lookup", key="a", strict=None) == "a"
+    assert calls == ["a"], "参数不合法的调用不应进入工具函数"
+    print("✅ 工具schema测试通过")
+
+def test_list_files():
+    """测试目录列表：分页、glob过滤，目录未变化时命中缓存，新增文件后缓存失效"""
+    print("🧪 测试目录列表...\n")
+    
+    registry = MCPToolRegistry()
+    with tempfile.TemporaryDirectory() as directory:
+        os.mkdir(os.path.join(directory, "sub"))
+        for index in range(25):
+            open(os.path.join(directory, f"file{index:02d}.txt"), "w").close()
+        
+        page = registry.list_files(directory, offset=10, limit=5)
+        print(f"📤 {page}")
+        assert "📄 file10.txt" in page and "📄 file14.txt" in page and "file15.txt" not in page
+        assert "共 26 项" in page and "offset=15" in page
+        assert "📁 sub/" in registry.list_files(directory, offset=25)
+        assert "没有匹配 *.json 的文件" in registry.list_files(directory, pattern="*.json")
+        assert registry.listing_cache.metrics["misses"] == 1, "目录未变化时应复用缓存"
+        
+        # 同一个mtime刻度内的修改无法区分，等待后再新增文件
+        time.sleep(0.01)
+        open(os.path.join(directory, "new.json"), "w").close()
+        assert "📄 new.json" in registry.list_files(directory, pattern="*.json")
+        assert registry.listing_cache.metrics["misses"] == 2
+    print("✅ 目录列表测试通过")
+
+def test_read_file():
+    """测试按范围读取：行号与字节范围、超过上限截断、大文件走mmap与流式读取"""
+    print("🧪 测试按范围读取文件...\n")
+    
+    registry = MCPToolRegistry()
+    registry.file_reader.max_bytes = 1024
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "big.log")
+        with open(filename, "w", encoding="utf-8") as f:
+            f.writelines(f"第{index}行 line {index}\n" for index in range(1, 200001))
+        assert os.path.getsize(filename) > registry.file_reader.mmap_threshold
+        
+        result = registry.read_file(filename, start_line=150000, end_line=150002)
+        print(f"📤 {result}")
+        assert result.endswith("第150000行 line 150000\n第150001行 line 150001\n第150002行 line 150002\n")
+        
+        result = registry.read_file(filename, offset=4)
+        assert "内容已截断" in result and "�" not in result, "截断位置应落在字符边界"
+        assert registry.read_file(filename, offset=0, length=19).endswith("第1行 line 1\n第2")
+        
+        pieces = registry.stream_read_file({"filename": filename, "start_line": 1, "end_line": 100000})
+        assert pieces is not None, "超过max_bytes的范围应当流式返回"
+        content = "".join(pieces)
+        assert content.count("\n") == 100001 and "line 100000" in content and "line 100001" not in content
+        assert registry.stream_read_file({"filename": filename, "length": 100}) is None
+        
+        # 结束行小于起始行是参数错误，不会回退为读到文件末尾
+        inverted = {"filename": filename, "start_line": 10, "end_line": 5}
+        assert registry.read_file(**inverted) == "读取文件失败: 结束行 5 小于起始行 10"
+        assert registry.stream_read_file(inverted) is None
+        
+        # 流式读取同样经过read_file的舱壁与熔断器，迭代结束或丢弃迭代器后归还名额
+        registry.set_concurrency_limit("read_file", 1, max_wait=0.01)
+        registry.enable_circuit_breaker("read_file", failure_threshold=1, reset_timeout=60)
+        pieces = registry.stream_read_file({"filename": filename})
+        busy = "".join(registry.stream_read_file({"filename": filename}))
+        assert busy.startswith("工具暂不可用") and "并发已满" in busy
+        del pieces
+        assert registry.bulkheads["read_file"].active == 0
+        "".join(registry.stream_read_file({"filename": filename}))
+        assert registry.breakers["read_file"].metrics["successes"] == 2
+        registry.breakers["read_file"].record_failure()
+        assert "熔断中" in "".join(registry.stream_read_file({"filename": filename}))
+        assert registry.bulkheads["read_file"].active == 0
+    print("✅ 按范围读取文件测试通过")
+
+def test_circuit_breaker():
+    """测试舱壁与熔断器：连续失败后快速失败并返回缓存结果，冷却后试探成功恢复"""
+    print("🧪 测试舱壁与熔断器...\n")
+    
+    registry = MCPToolRegistry()
+    backend = {"healthy": True, "calls": 0}
+    
+    async def quote(symbol: str) -> str:
+        backend["calls"] += 1
+        if not backend["healthy"]:
+            await asyncio.sleep(1)
+        return f"{symbol}: 100"
+    
+    registry.register_tool("quote", quote)
+    registry.enable_circuit_breaker("quote", failure_threshold=2, reset_timeout=0.3, call_timeout=0.1)
+    assert asyncio.run(registry.execute_tool_async("quote", symbol="A")) == "A: 100"
+    
+    backend["healthy"] = False
+    for _ in range(2):
+        assert "执行超时" in asyncio.run(registry.execute_tool_async("quote", symbol="B"))
+    assert registry.breakers["quote"].state == "open"
+    
+    calls = backend["calls"]
+    start = time.perf_counter()
+    cached = asyncio.run(registry.execute_tool_async("quote", symbol="A"))
+    print(f"📤 {cached}")
+    assert cached.endswith("A: 100") and "暂时不可用" in cached, "熔断时应返回相同参数的缓存结果"
+    assert registry.execute_tool("quote", symbol="C").startswith("工具暂不可用")
+    assert backend["calls"] == calls and time.perf_counter() - start < 0.05, "熔断时不应调用后端"
+    
+    time.sleep(0.3)
+    backend["healthy"] = True
+    assert asyncio.run(registry.execute_tool_async("quote", symbol="C")) == "C: 100"
+    assert registry.breakers["quote"].state == "closed"
+    
+    # 工具自身返回的错误结果计为失败，不作为降级结果
+    registry.enable_circuit_breaker("read_file", failure_threshold=3, reset_timeout=60)
+    for _ in range(3):
+        assert registry.execute_tool("read_file", filename="/nonexistent").startswith("读取文件失败")
+    snapshot = registry.breakers["read_file"].snapshot()
+    assert snapshot["failures"] == 3 and snapshot["successes"] == 0 and snapshot["state"] == "open", snapshot
+    assert registry.cached_result("read_file", {"filename": "/nonexistent"}) is None
+    degraded = asyncio.run(registry.execute_tool_async("read_file", filename="/nonexistent"))
+    assert degraded.startswith("工具暂不可用") and is_tool_error(degraded), degraded
+    
+    # 舱壁：并发已满时等待max_wait后快速失败
+    async def slow(value: int) -> str:
+        await asyncio.sleep(0.2)
+        return str(value)
+    
+    registry.register_tool("slow", slow)
+    registry.set_concurrency_limit("slow", 2, max_wait=0.05)
+    
+    async def run_concurrently():
+        return await asyncio.gather(*(registry.execute_tool_async("slow", value=index) for index in range(4)))
+    
+    results = asyncio.run(run_concurrently())
+    print(f"📤 {results}")
+    assert results[:2] == ["0", "1"] and all(result.startswith("工具暂不可用") for result in results[2:])
+    assert json.loads(registry.get_tools_response())["circuit_breakers"]["quote"]["opened"] == 1
+    print("✅ 舱壁与熔断器测试通过")
+
+def test_web_search_backend():
+    """测试HTTP搜索后端：复用连接池，5xx响应退避重试，超大响应被拒绝"""
+    print("🧪 测试web_search搜索后端...\n")
+    
+    try:
+        SearchBackend()
+        assert False, "未实现search的后端不能实例化"
+    except TypeError:
+        pass
+    
+    registry = MCPToolRegistry()
+    assert registry.execute_tool("web_search", query="Python").endswith("3. 相关文章标题3")
+    
+    with StubSearchServer() as server:
+        registry.set_search_backend(HTTPSearchBackend(server.url, max_connections=4, retries=2, backoff=0.01))
+        result = registry.execute_tool("web_search", query="Python")
+        print(f"📤 {result}")
+        assert result.startswith("搜索结果：关于'Python'的相关信息") and "https://example.com/3" in result
+        
+        async def search_concurrently():
+            return await asyncio.gather(*(registry.execute_tool_async("web_search", query=f"q{index}")
+                                          for index in range(20)))
+        
+        results = asyncio.run(search_concurrently())
+        assert all(result.startswith("搜索结果") for result in results)
+        connections = server.snapshot()["connections"]
+        print(f"📊 21次搜索使用了 {connections} 个连接")
+        assert connections <= 4, "请求应复用连接池中的连接"
+        
+        server.fail_next(2)
+        assert registry.execute_tool("web_search", query="retry").startswith("搜索结果")
+        assert registry.search_backend.snapshot()["retries"] == 2
+        
+        server.fail_next(3)
+        assert registry.execute_tool("web_search", query="down").startswith("工具执行错误")
+        
+        server.snippet_bytes = 4096
+        registry.set_search_backend(HTTPSearchBackend(server.url, max_response_bytes=1024))
+        result = registry.execute_tool("web_search", query="large")
+        print(f"📤 {result}")
+        assert result.startswith("工具执行错误") and "1024" in result
+        registry.search_backend.close()
+    print("✅ web_search搜索后端测试通过")
+
+def test_mcp_server():
+    """测试MCP服务端：stdio上的流水线调用并发执行，Streamable HTTP的会话、批量与SSE"""
+    print("🧪 测试MCP服务端...\n")
+    
+    registry = MCPToolRegistry()
+    
+    async def slow_echo(text: str) -> str:
+        """延迟回显
+        
+        Args:
+            text: 回显内容
+        """
+        await asyncio.sleep(0.2)
+        return text
+    
+    registry.register_tool("slow_echo", slow_echo)
+    server = MCPServer(registry)
+    
+    def message(request_id, method, params=None):
+        payload = {"jsonrpc": "2.0", "method": method, "params": params or {}}
+        if request_id is not None:
+            payload["id"] = request_id
+        return json.dumps(payload, ensure_ascii=False).encode("utf-8") + b"\n"
+    
+    async def run_stdio():
+        reader = asyncio.StreamReader()
+        reader.feed_data(message(0, "initialize", {"protocolVersion": "2025-03-26"}))
+        reader.feed_data(message(None, "notifications/initialized"))
+        reader.feed_data(message(1, "tools/list"))
+        for index in range(2, 10):
+            reader.feed_data(message(index, "tools/call", {"name": "slow_echo", "arguments": {"text": f"m{index}"}}))
+        reader.feed_data(message(10, "tools/call", {"name": "missing", "arguments": {}}))
+        reader.feed_data(message(11, "tools/call", {"name": "calculate", "arguments": {}}))
+        reader.feed_data(message(12, "tools/call", {"name": "calculate", "arguments": {"expression": "1/0"}}))
+        reader.feed_data(b"{not json\n")
+        reader.feed_eof()
+        lines = []
+        start = time.perf_counter()
+        await server.serve_stream(reader, lines.append)
+        return lines, time.perf_counter() - start
+    
+    lines, elapsed = asyncio.run(run_stdio())
+    responses = {response["id"]: response for response in map(json.loads, lines)}
+    print(f"📊 {len(lines)} 个响应，耗时 {elapsed:.2f}s，最大并发 {server.metrics['peak_in_flight']}")
+    assert len(lines) == 14, "通知不应有响应"
+    assert responses[0]["result"]["capabilities"]["tools"] == {"listChanged": False}
+    tools = {tool["name"]: tool for tool in responses[1]["result"]["tools"]}
+    assert tools["calculate"]["inputSchema"]["required"] == ["expression"]
+    assert all(responses[index]["result"]["content"][0]["text"] == f"m{index}" for index in range(2, 10))
+    assert elapsed < 0.6, "同一连接上的工具调用应并发执行"
+    assert responses[10]["error"]["code"] == INVALID_PARAMS
+    assert responses[11]["result"]["isError"] and "参数错误" in responses[11]["result"]["content"][0]["text"]
+    assert responses[12]["result"]["isError"] and "计算错误" in responses[12]["result"]["content"][0]["text"]
+    assert responses[None]["error"]["code"] == PARSE_ERROR
+    
+    async def run_oversized():
+        # 超长消息分多次到达：丢弃到换行符为止的全部内容，只返回一个错误
+        reader = asyncio.StreamReader(limit=64)
+        lines = []
+        serving = asyncio.ensure_future(server.serve_stream(reader, lines.append))
+        for _ in range(4):
+            reader.feed_data(b"x" * 50)
+            await asyncio.sleep(0)
+        reader.feed_data(b"x" * 10 + b"\n" + message(1, "ping"))
+        reader.feed_eof()
+        await serving
+        return [json.loads(line) for line in lines]
+    
+    oversized = asyncio.run(run_oversized())
+    assert len(oversized) == 2, oversized
+    assert oversized[0]["error"]["code"] == INVALID_REQUEST and oversized[1]["id"] == 1
+    
+    async def run_http():
+        initialized = await server.handle_http("POST", message(0, "initialize"), "application/json")
+        session_id = initialized.headers[SESSION_HEADER]
+        notified = await server.handle_http("POST", message(None, "notifications/initialized"), "", session_id)
+        batch = b"[" + b",".join(
+            message(index, "tools/call", {"name": "slow_echo", "arguments": {"text": str(index)}}).strip()
+            for index in range(5)
+        ) + b"]"
+        as_json = await server.handle_http("POST", batch, "application/json", session_id)
+        as_events = await server.handle_http("POST", batch, "application/json, text/event-stream", session_id)
+        events = [event async for event in as_events.events]
+        deleted = await server.handle_http("DELETE", session_id=session_id)
+        expired = await server.handle_http("POST", message(1, "ping"), "application/json", session_id)
+        method_not_allowed = await server.handle_http("GET")
+        return notified, as_json, events, deleted, expired, method_not_allowed
+    
+    notified, as_json, events, deleted, expired, method_not_allowed = asyncio.run(run_http())
+    assert notified.status == 202 and notified.body is None
+    assert [item["id"] for item in json.loads(as_json.body)] == [0, 1, 2, 3, 4]
+    assert len(events) == 5 and all(event.startswith(b"event: message\ndata: ") for event in events)
+    assert deleted.status == 200 and expired.status == 404 and method_not_allowed.status == 405
+    
+    # 注册新工具后tools/list的缓存失效
+    registry.register_tool("noop", lambda: "ok", description="空操作")
+    assert any(tool["name"] == "noop" for tool in json.loads(registry.get_mcp_tool_list())["tools"])
+    print("✅ MCP服务端测试通过")
+
+def test_calculate():
+    """测试算术引擎：失控的表达式在计算前被拒绝，批量结果与逐个计算一致"""
+    print("🧪 测试算术引擎...\n")
+    
+    registry = MCPToolRegistry()
+    start = time.perf_counter()
+    result = registry.calculate("9**9**9**9")
+    print(f"📤 {result}")
+    assert result.startswith("计算错误") and time.perf_counter() - start < 0.1
+    assert registry.calculate("2**5000").startswith("计算错误")
+    assert registry.calculate("__import__('os')") == "计算错误: 表达式包含不允许的字符"
+    assert registry.calculate("1024 / 8") == "计算结果：1024 / 8 = 128.0"
+    
+    expressions = [f"({a} + {b}) * {b} / {a + 1}" for a in range(50) for b in range(-5, 5)]
+    expressions += ["7 // 0", "2 ** 10", "1.5 - 3"]
+    batch = registry.calculate_batch(expressions)
+    reference = MCPToolRegistry()
+    assert batch == [reference.calculate(expression) for expression in expressions]
+    print(f"📋 {registry.arithmetic.snapshot()}")
+    assert registry.arithmetic.metrics["vectorized"] > 0
+    print("✅ 算术引擎测试通过")
+
+def _runaway_tool(n: int) -> str:
+    # 失控的工具：永不返回；沙箱工具需在模块级定义才能pickle到工作进程
+    while True:
+        n += 1
+
+def _parent_pid(pid: int) -> int:
+    with open(f"/proc/{pid}/stat", "r") as f:
+        return int(f.read().rsplit(")", 1)[1].split()[1])
+
+def test_tool_sandbox():
+    """测试工具沙箱：失控的计算超时后工作进程被替换，后续调用不受影响"""
+    print("🧪 测试工具沙箱...\n")
+    
+    registry = MCPToolRegistry()
+    registry.register_tool("runaway", _runaway_tool)
+    sandboxed = ["calculate", "runaway"]
+    sandbox = ToolSandbox({name: registry.tools[name] for name in sandboxed},
+                          num_workers=1, timeout=1.0, cpu_seconds=2, memory_mb=256)
+    registry.enable_sandbox(sandbox, sandboxed)
+    try:
+        sandbox.start()
+        start = time.perf_counter()
+        result = registry.execute_tool("runaway", n=9)
+        elapsed = time.perf_counter() - start
+        print(f"📤 {result}，耗时 {elapsed:.2f}s")
+        assert result.startswith("工具执行错误"), "失控的计算应当被终止"
+        assert elapsed < 3, "超时后应立即返回"
+        
+        result = asyncio.run(registry.execute_tool_async("calculate", expression="125 * 37"))
+        assert result == "计算结果：125 * 37 = 4625", result
+        assert registry.execute_tool("get_current_time").startswith("当前时间"), "未放入沙箱的工具在本进程执行"
+        
+        snapshot = sandbox.snapshot()
+        print(f"📋 {snapshot}")
+        assert snapshot["timeouts"] == 1 and snapshot["recycled"] == 1 and snapshot["executed"] == 1
+        
+        # 替换的工作进程由forkserver创建，而不是从本进程fork
+        workers = list(sandbox._idle.queue)
+        assert workers and all(_parent_pid(worker.process.pid) != os.getpid() for worker in workers)
+        
+        # 替换工作进程失败时调用在超时后报错而不是永久阻塞，恢复后自动补回
+        def broken_spawn():
+            raise OSError("forkserver不可用")
+        
+        sandbox._spawn = broken_spawn
+        assert registry.execute_tool("runaway", n=1).startswith("工具执行错误")
+        start = time.perf_counter()
+        result = registry.execute_tool("calculate", expression="1 + 1")
+        print(f"📤 {result}")
+        assert "等待工作进程超时" in result and time.perf_counter() - start < 2
+        assert sandbox.snapshot()["missing_workers"] == 1
+        del sandbox._spawn
+        assert registry.execute_tool("calculate", expression="1 + 1") == "计算结果：1 + 1 = 2"
+        assert sandbox.snapshot()["missing_workers"] == 0
+    finally:
+        sandbox.shutdown()
+    print("✅ 工具沙箱测试通过")
+
+def test_template_answers():
+    """测试模板回答：开启模板的工具直接渲染最终回答，关闭后交给模型生成"""
+    print("🧪 测试模板回答...\n")
+    
+    tool_calls = [{"name": "get_weather", "arguments": {"city": "北京"}}]
+    tool_results = [tool_registry.execute_tool("get_weather", city="北京")]
+    answer = tool_registry.render_final_answer(tool_calls, tool_results)
+    print(f"📤 {answer}")
+    assert answer is not None and "北京：晴" in answer
+    
+    # 未开启模板的工具和执行出错的调用都返回None
+    assert tool_registry.render_final_answer([{"name": "web_search", "arguments": {"query": "x"}}], ["r"]) is None
+    assert tool_registry.render_final_answer([{"name": "calculate", "arguments": {}}], ["工具执行错误: x"]) is None
+    
+    # 工具自身返回的错误同样交给模型
+    for tool_name, arguments in [("calculate", {"expression": "1/0"}), ("read_file", {"filename": "/nonexistent"}),
+                                 ("list_files", {"path": "/nonexistent"})]:
+        result = tool_registry.execute_tool(tool_name, **arguments)
+        assert tool_registry.render_final_answer([{"name": tool_name, "arguments": arguments}], [result]) is None, result
+    
+    # 参数名与{result}相同时以工具结果为准
+    registry = MCPToolRegistry()
+    registry.register_tool("echo", lambda result: f"回显: {result}", answer_template="{result}", template_answer=True)
+    echo_call = {"name": "echo", "arguments": {"result": "x"}}
+    assert registry.render_final_answer([echo_call], [registry.execute_tool("echo", result="x")]) == "回显: x"
+    
+    tool_registry.set_template_answer("get_weather", False)
+    try:
+        assert tool_registry.render_final_answer(tool_calls, tool_results) is None
+    finally:
+        tool_registry.set_template_answer("get_weather", True)
+    print("✅ 模板回答测试通过")
+
+def test_semantic_cache():
+    """测试语义缓存：改写的请求命中缓存的工具调用，参数不同的请求不命中"""
+    print("🧪 测试语义缓存...\n")
+    
+    cache = SemanticCache(NgramEmbedder())
+    cache.store("计算125*37", "我来帮您计算125*37的结果。", [{"name": "calculate", "arguments": {"expression": "125*37"}}])
+    cache.store("写入文件a.txt", "", [{"name": "write_file", "arguments": {"filename": "a.txt", "content": "x"}}])
+    
+    hit = cache.lookup("请帮我计算 125 * 37")
+    print(f"📋 命中: {hit}")
+    assert hit is not None and hit["tool_calls"][0]["name"] == "calculate"
+    assert cache.lookup("计算125*38") is None, "参数不同的请求不应命中"
+    assert cache.lookup("写入文件a.txt") is None, "有副作用的工具不应缓存"
+    
+    expiring = SemanticCache(NgramEmbedder(), ttl_seconds=0)
+    expiring.store("计算125*37", "", [{"name": "calculate", "arguments": {"expression": "125*37"}}])
+    assert expiring.lookup("计算125*37") is None, "过期条目不应命中"
+    print("✅ 语义缓存测试通过")
+
+def test_intent_router():
+    """测试意图快速路由：简单请求直接路由到工具，其他请求交给模型"""
+    print("🧪 测试意图快速路由...\n")
+    
+    router = IntentRouter(threshold=0.9)
+    
+    # 应当被路由的请求及期望的工具调用
+    routed_cases = [
+        ("获取当前时间", "get_current_time", {}),
+        ("北京天气怎么样", "get_weather", {"city": "北京"}),
+        ("计算125*37", "calculate", {"expression": "125*37"}),
+        ("请帮我搜索关于区块链技术的信息", "web_search", {"query": "区块链技术"})
+    ]
+    for text, tool_name, arguments in routed_cases:
+        decision = router.route(text)
+        print(f"📋 {text} -> {decision}")
+        assert decision is not None and decision["name"] == tool_name, f"未正确路由: {text}"
+        assert decision["arguments"] == arguments, f"参数提取错误: {decision['arguments']}"
+    
+    # 闲聊和有副作用的请求交给模型
+    for text in ["你好", "给我讲个笑话", "写入文件test.txt，内容：Hello"]:
+        assert router.route(text) is None, f"不应路由: {text}"
+    
+    result = router.handle("计算125*37")
+    assert "4625" in result["final_response"]
+    assert router.snapshot()["routed"] == 1
+    
+    # 工具执行失败时不渲染模板，交给模型
+    assert router.route("计算1/0") is not None and router.handle("计算1/0") is None
+    assert router.snapshot()["routed"] == 1
+    print("✅ 意图快速路由测试通过")
+
+def test_tool_speculator():
+    """测试工具预执行：预测一致时复用结果，不一致时正常执行，有副作用的工具从不预执行"""
+    print("🧪 测试工具预执行...\n")
+    
+    registry = MCPToolRegistry()
+    writes = []
+    
+    def write_file(filename: str, content: str) -> str:
+        """写入文件内容
+        
+        Args:
+            filename: 文件名
+            content: 文件内容
+        """
+        writes.append(filename)
+        return f"成功写入文件 {filename}"
+    
+    registry.register_tool("write_file", write_file)
+    speculator = ToolSpeculator(registry, tools=["get_weather", "write_file"])
+    try:
+        speculation = speculator.start("北京天气怎么样")
+        assert speculation is not None and speculation.tool_call["name"] == "get_weather"
+        result = speculator.resolve(speculation, {"name": "get_weather", "arguments": {"city": " 北京 "}})
+        print(f"📤 {result}")
+        assert result == registry.execute_tool("get_weather", city="北京")
+        speculator.finish(speculation)
+        
+        # 模型解析出的调用与预测不一致：丢弃预执行结果，由调用方正常执行
+        speculation = speculator.start("北京天气怎么样")
+        tool_call = {"name": "get_weather", "arguments": {"city": "上海"}}
+        assert speculator.resolve(speculation, tool_call) is None
+        assert "上海" in registry.execute_tool(tool_call["name"], **tool_call["arguments"])
+        speculator.finish(speculation)
+        
+        # 即使在tools中配置了write_file也不会预执行
+        assert "write_file" not in speculator.router.tools
+        assert speculator.start("写入文件test.txt，内容：Hello") is None
+        
+        snapshot = speculator.snapshot()
+        print(f"📊 {snapshot}")
+        assert snapshot["hits"] == 1 and snapshot["misses"] == 1 and snapshot["predicted"] == 2
+        assert snapshot["unpredicted"] == 1 and writes == []
+    finally:
+        speculator.executor.shutdown()
+    print("✅ 工具预执行测试通过")
+
 if __name__ == "__main__":
-    test_all_tools()
\ No newline at end of file
+    test_all_tools()
+    test_async_tools()
+    test_batch_execution()
+    test_tool_schemas()
+    test_list_files()
+    test_read_file()
+    test_circuit_breaker()
+    test_web_search_backend()
+    test_mcp_server()
+    test_calculate()
+    test_tool_sandbox()
+    test_template_answers()
+    test_semantic_cache()
+    test_intent_router()
+    test_tool_speculator()
\ No newline at end of file